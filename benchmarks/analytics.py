@@ -0,0 +1,76 @@
+"""Run the availability analytics over a synthetic year of history
+
+Run with: python -m benchmarks.analytics [--stations 1000] [--interval 300]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from bikemi_data_analyser.history.analytics import analyse
+from bikemi_data_analyser.history.store import HistoryStore
+
+YEAR = 365 * 24 * 3600
+# Frames generated and written at once
+BLOCK = 8192
+
+
+def fill(store, stations, interval, seconds=YEAR, seed=0):
+    """Append a random walk of the counts of "stations" stations"""
+    rng = np.random.default_rng(seed)
+    station_ids = [str(i) for i in range(stations)]
+    capacity = rng.integers(10, 40, stations)
+    bikes = rng.integers(0, 10, stations)
+    start = 1609459200  # 2021-01-01
+    frames = seconds // interval
+    for first in range(0, frames, BLOCK):
+        size = min(BLOCK, frames - first)
+        steps = rng.integers(-1, 2, (size, stations))
+        walk = np.clip(bikes + np.cumsum(steps, axis=0), 0, capacity)
+        bikes = walk[-1]
+        ebike = walk // 3
+        store.extend(
+            start + (first + np.arange(size)) * interval,
+            station_ids,
+            {
+                "bike": walk - ebike,
+                "ebike": ebike,
+                "ebike_with_childseat": np.zeros_like(walk),
+                "availableDocks": capacity - walk,
+            },
+        )
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--interval", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        store = HistoryStore(path, width=args.stations, create=True)
+        start = time.perf_counter()
+        fill(store, args.stations, args.interval)
+        print(
+            "Generated {} frames x {} stations in {:.1f}s".format(
+                len(store), args.stations, time.perf_counter() - start
+            )
+        )
+
+        start = time.perf_counter()
+        report = analyse(HistoryStore(path))
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        report.occupancy_percentiles()
+        percentiles = time.perf_counter() - start
+        print(
+            "analyse: {:.2f}s, weekly percentiles: {:.2f}s".format(elapsed, percentiles)
+        )
+        print("Most often empty:", report.rank("empty", 3))
+
+
+if __name__ == "__main__":
+    main()
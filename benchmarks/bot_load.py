@@ -0,0 +1,116 @@
+"""Reply latency of the bot with many chats writing at once, with the handlers
+run one after the other on the dispatcher as they were, and on the ChatPool
+
+Run with: python -m benchmarks.bot_load [--chats 500] [--workers 8]
+
+Updates come from a fake source and replies go nowhere: the geocoder sleeps
+"--latency" seconds for every place not seen yet, to stand in for MapBox.
+One more chat spams "--spam" messages at the same time as the others.
+"""
+
+import argparse
+import random
+import time
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.snapshot import SnapshotStore
+from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+from bikemi_data_analyser.telegram_bot.geocode import GeocodeCache
+from bikemi_data_analyser.telegram_bot.workers import ChatPool
+from benchmarks import synthetic
+from benchmarks.fakes import FakeContext, FakeLocation, FakeMessage, FakeUpdate
+
+SPAMMER = -1
+
+
+class SlowGeocoder:
+    def __init__(self, latency, seed=0):
+        self.latency = latency
+        self.rng = random.Random(seed)
+
+    def geocode(self, query, **options):
+        time.sleep(self.latency)
+        return FakeLocation(
+            self.rng.uniform(*synthetic.LAT_RANGE),
+            self.rng.uniform(*synthetic.LON_RANGE),
+        )
+
+
+def run(bot, messages):
+    """Send all the (chat_id, place) messages at once, wait for the replies and
+    return the updates"""
+    updates = [FakeUpdate(chat_id, FakeMessage(place)) for chat_id, place in messages]
+    for update, (_, place) in zip(updates, messages):
+        bot.submit(update, bot.search_nearest, FakeContext(), place)
+    if bot.pool.running:
+        while bot.pool.pending():
+            time.sleep(0.001)
+    return updates
+
+
+def latencies(updates, spammer):
+    return sorted(
+        (update.message.replied - update.sent) * 1000
+        for update in updates
+        if update.message.replies and (update.effective_chat.id == SPAMMER) == spammer
+    )
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--places", type=int, default=300)
+    parser.add_argument("--spam", type=int, default=50)
+    args = parser.parse_args()
+
+    api = BikeMiApi()
+    stations = api.merge_stations(
+        api.parse_station_information(synthetic.station_information(300)),
+        api.parse_stations_page(synthetic.stations_page(300)),
+    )
+    rng = random.Random(1)
+    messages = [
+        (chat_id, "Via {}".format(rng.randrange(args.places)))
+        for chat_id in range(args.chats)
+    ]
+    # The spammer's messages come first, the worst case for everyone else
+    spam = [(SPAMMER, "Corso {}".format(i)) for i in range(args.spam)]
+
+    print(
+        "{:>10} {:>9} {:>9} {:>9} {:>10} {:>9}".format(
+            "mode", "p50 (ms)", "p99 (ms)", "max (ms)", "geocodes", "spam p50"
+        )
+    )
+    for mode in ("dispatcher", "pool"):
+        bot = TelegramBot()
+        bot.snapshots = SnapshotStore(lambda: stations, ttl=3600)
+        bot.snapshots.get()
+        bot.geocoder = GeocodeCache(SlowGeocoder(args.latency))
+        bot.pool = ChatPool(args.workers, per_chat=args.spam)
+        if mode == "pool":
+            bot.pool.start()
+        updates = run(bot, spam + messages)
+        bot.pool.stop()
+
+        others = latencies(updates, spammer=False)
+        spammer = latencies(updates, spammer=True)
+        print(
+            "{:>10} {:>9.1f} {:>9.1f} {:>9.1f} {:>10} {:>9.1f}".format(
+                mode,
+                percentile(others, 50),
+                percentile(others, 99),
+                others[-1],
+                bot.geocoder.misses,
+                percentile(spammer, 50) if spammer else float("nan"),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Compare rebuilding a snapshot from scratch with patching the previous one,
+when 1% of the stations changed since the last refresh
+
+Run with: python -m benchmarks.delta
+"""
+
+import random
+import time
+import tracemalloc
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.snapshot import Snapshot
+from benchmarks import synthetic
+
+SIZES = (1000, 10000, 50000)
+CHURN = 0.01
+REPEATS = 3
+
+
+def fetch(api, n, churn=0.0, seed=0):
+    """Stations as a refresh would get them: all new objects, with the counts
+    of a "churn" share of them changed"""
+    rng = random.Random(seed)
+    basic = api.parse_station_information(synthetic.station_information(n))
+    status = api.parse_stations_page(synthetic.stations_page(n))
+    for station in rng.sample(status, int(n * churn)):
+        station.bike += 1
+        station.availableDocks -= 1
+    return api.merge_stations(basic, status)
+
+
+def measure(function):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak / 1024
+
+
+def main(api=BikeMiApi()):
+    print(
+        "{:>8} {:>12} {:>14} {:>12} {:>14} {:>8}".format(
+            "stations",
+            "full (ms)",
+            "full (KiB)",
+            "patch (ms)",
+            "patch (KiB)",
+            "delta",
+        )
+    )
+    for n in SIZES:
+        previous = Snapshot(1, fetch(api, n), 0)
+        stations = fetch(api, n, CHURN)
+        full = measure(lambda: Snapshot(2, stations, 0))
+        patch = measure(lambda: Snapshot(2, stations, 0, previous))
+
+        snapshot = Snapshot(2, stations, 0, previous)
+        rebuilt = Snapshot(2, stations, 0)
+        assert snapshot.search.search("dante", k=None) == rebuilt.search.search(
+            "dante", k=None
+        )
+        assert snapshot.spatial.nearest(45.46, 9.19, 5) == rebuilt.spatial.nearest(
+            45.46, 9.19, 5
+        )
+        print(
+            "{:>8} {:>12.2f} {:>14.0f} {:>12.2f} {:>14.0f} {:>8}".format(
+                n, *full, *patch, len(snapshot.delta)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
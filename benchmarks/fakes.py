@@ -0,0 +1,105 @@
+"""Stand-ins for the Telegram updates and contexts and for the geocoder, to run
+the bot handlers in the benchmarks and the tests with no network.
+
+Given a "calls" list, the messages, callback queries and contexts append
+each call made to Telegram to it, as (name, args, kwargs) tuples in order.
+"""
+
+import time
+
+
+def record(calls, name, *args, **kwargs):
+    if calls is not None:
+        calls.append((name, args, kwargs))
+
+
+class FakeLocation:
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class FakeGeocoder:
+    """Finds every place, at the "points" in turn"""
+
+    def __init__(self, points):
+        self.points = points
+        self.calls = 0
+
+    def geocode(self, query, **options):
+        self.calls += 1
+        lat, lon = self.points[self.calls % len(self.points)]
+        return FakeLocation(lat, lon)
+
+
+class FakeChat:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeMessage:
+    """A message, counting the replies to it and keeping the perf_counter()
+    time of the first one"""
+
+    def __init__(self, text=None, location=None, calls=None):
+        self.text = text
+        self.location = location
+        self.calls = calls
+        self.replies = 0
+        self.replied = None
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def reply_text(self, text, reply_markup=None):
+        if self.replied is None:
+            self.replied = time.perf_counter()
+        self.replies += 1
+        record(self.calls, "reply_text", text, reply_markup=reply_markup)
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, calls=None):
+        self.data = data
+        self.calls = calls
+
+    def answer(self, text=None):
+        record(self.calls, "answer", text)
+
+    def edit_message_text(self, text, reply_markup=None):
+        record(self.calls, "edit_message_text", text, reply_markup=reply_markup)
+
+
+class FakeUpdate:
+    def __init__(self, chat_id, message=None, callback_query=None):
+        self.effective_chat = FakeChat(chat_id)
+        self.message = message
+        self.callback_query = callback_query
+        self.sent = time.perf_counter()
+
+
+class FakeBot:
+    def __init__(self, calls=None):
+        self.calls = calls
+
+    def send_chat_action(self, chat_id, action):
+        record(self.calls, "send_chat_action", chat_id=chat_id, action=action)
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        record(
+            self.calls,
+            "send_message",
+            chat_id=chat_id,
+            text=text,
+            reply_markup=reply_markup,
+        )
+
+
+class FakeContext:
+    def __init__(self, args=(), calls=None):
+        self.bot = FakeBot(calls)
+        self.args = list(args)
+        self.user_data = {}
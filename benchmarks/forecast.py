@@ -0,0 +1,151 @@
+"""Train the availability forecasts on a synthetic year of one-minute frames,
+time the incremental updates and predict(), and compare the forecast error
+on the following week with persistence, i.e. the count staying the same.
+Errors are root mean squared, what the trend models minimise
+
+Run with: python -m benchmarks.forecast [--stations 300] [--days 365]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from bikemi_data_analyser.history.forecast import HORIZONS, TREND, Forecaster
+from bikemi_data_analyser.history.store import FIELDS, HistoryStore
+
+DAY = 24 * 3600
+START = 1609459200  # 2021-01-01
+# Frames generated and written at once
+BLOCK = 1440
+# Minutes between the forecasts checked on the following week
+EVERY = 30
+PREDICTIONS = 100000
+
+
+class Synthetic:
+    """Counts following a daily cycle, flatter on the weekends, that each
+    station is shifted from by a random walk"""
+
+    def __init__(self, stations, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.station_ids = [str(i) for i in range(stations)]
+        self.capacity = self.rng.integers(10, 40, stations)
+        self.phase = self.rng.uniform(0, DAY, stations)
+        self.wander = np.zeros(stations, int)
+
+    def frames(self, first, count):
+        """Return the timestamps and columns of "count" frames, one a minute"""
+        times = first + np.arange(count) * 60
+        # A bike taken or brought back every 10 minutes or so
+        steps = self.rng.choice(
+            (-1, 0, 1), (count, len(self.station_ids)), p=(0.05, 0.9, 0.05)
+        )
+        wander = np.clip(self.wander + np.cumsum(steps, axis=0), -6, 6)
+        self.wander = wander[-1]
+        weekend = ((times // DAY + 3) % 7 >= 5)[:, None]
+        cycle = np.sin(2 * np.pi * (times[:, None] - self.phase) / DAY)
+        share = 0.5 + np.where(weekend, 0.15, 0.35) * cycle
+        bikes = np.clip(np.rint(share * self.capacity) + wander, 0, self.capacity)
+        bikes = bikes.astype(int)
+        ebike = bikes // 3
+        childseat = ebike // 4
+        return times, {
+            "bike": bikes - ebike - childseat,
+            "ebike": ebike - childseat,
+            "ebike_with_childseat": childseat,
+            "availableDocks": self.capacity - bikes,
+        }
+
+
+def fill(store, synthetic, first, days):
+    for day in range(days):
+        times, columns = synthetic.frames(first + day * DAY, BLOCK)
+        store.extend(times, synthetic.station_ids, columns)
+    store.close()
+
+
+def errors(forecaster, synthetic, first, days):
+    """Root mean squared error of the forecasts and of persistence, by
+    horizon, over "days" days of frames from "first" """
+    longest = max(HORIZONS)
+    times, columns = synthetic.frames(first, days * BLOCK)
+    counts = np.stack([columns[field] for field in FIELDS]).astype(np.float32)
+    forecast = np.zeros(len(HORIZONS))
+    persistence = np.zeros(len(HORIZONS))
+    checked = 0
+    for i in range(TREND, len(times) - longest, EVERY):
+        table = forecaster.forecast(times[i], counts[:, i], counts[:, i - TREND])
+        for h, minutes in enumerate(HORIZONS):
+            actual = counts[:, i + minutes]
+            forecast[h] += np.square(table[:, h] - actual).mean()
+            persistence[h] += np.square(counts[:, i] - actual).mean()
+        checked += 1
+    return (
+        np.sqrt(forecast / checked),
+        np.sqrt(persistence / checked),
+        times,
+        counts,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=300)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        synthetic = Synthetic(args.stations)
+        store = HistoryStore(path, width=args.stations, create=True)
+        start = time.perf_counter()
+        fill(store, synthetic, START, args.days)
+        print(
+            "Generated {} frames x {} stations in {:.1f}s".format(
+                len(store), args.stations, time.perf_counter() - start
+            )
+        )
+
+        forecaster = Forecaster()
+        start = time.perf_counter()
+        forecaster.fit(HistoryStore(path))
+        print("fit: {:.1f}s".format(time.perf_counter() - start))
+
+        # The next week, as the bot would see it
+        first = START + args.days * DAY
+        forecast, persistence, times, counts = errors(forecaster, synthetic, first, 7)
+        print("\n{:>8} {:>10} {:>12}".format("minutes", "forecast", "persistence"))
+        for minutes, mine, same in zip(HORIZONS, forecast, persistence):
+            print("{:>8} {:>10.3f} {:>12.3f}".format(minutes, mine, same))
+        # Five minutes ahead, the count mostly stays the same
+        assert (forecast <= persistence * 1.01).all(), (forecast, persistence)
+        assert (forecast[1:] < persistence[1:]).all(), (forecast, persistence)
+
+        # Live frames, folded in one at a time
+        station_ids = synthetic.station_ids
+        start = time.perf_counter()
+        for i in range(BLOCK):
+            forecaster.observe(times[i], station_ids, counts[:, i])
+        elapsed = time.perf_counter() - start
+        print("\nobserve: {:.2f} ms a frame".format(elapsed / BLOCK * 1000))
+
+        # And a week recorded while the bot was down, caught up with
+        fill(HistoryStore(path), synthetic, first + DAY, 7)
+        start = time.perf_counter()
+        forecaster.fit(HistoryStore(path), since=forecaster.trained_until)
+        print("fit on a new week: {:.2f}s".format(time.perf_counter() - start))
+        assert forecaster.trained_until == first + 8 * DAY - 60
+
+        now = int(time.time()) // 60 * 60
+        forecaster.observe(now, station_ids, counts[:, 0])
+        start = time.perf_counter()
+        for i in range(PREDICTIONS):
+            forecaster.predict(station_ids[i % len(station_ids)], 15)
+        elapsed = time.perf_counter() - start
+        print("predict: {:.2f} us".format(elapsed / PREDICTIONS * 1e6))
+        assert set(forecaster.predict(station_ids[0])) == set(FIELDS)
+
+
+if __name__ == "__main__":
+    main()
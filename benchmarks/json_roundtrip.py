@@ -0,0 +1,92 @@
+"""Compare the json round-trips of the old pipeline with the native Station API
+
+Run with: python -m benchmarks.json_roundtrip
+"""
+
+import json
+import time
+import tracemalloc
+
+from operator import itemgetter
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from benchmarks import synthetic
+
+SIZES = (300, 1000, 5000)
+REPEATS = 5
+
+
+def legacy(info_payload, page):
+    """The pipeline as it was, from the http responses to pull_stations"""
+    stations = json.loads(info_payload)["data"]["stations"]
+    for element in stations:
+        del element["name"]
+    basic = json.dumps(stations, indent=4)
+
+    raw = page
+    placeholder = '"stationMapPage","slug":null},'
+    start = raw.find(placeholder) + len(placeholder)
+    end = raw.find('},"baseUrl":"https://bikemi.com"')
+    jsontxt = json.loads("{" + (raw[start:end]))
+    station_list = []
+    for element in jsontxt:
+        info = jsontxt[element]["availabilityInfo"]
+        station_list.append(
+            {
+                "station_id": jsontxt[element]["id"],
+                "name": jsontxt[element]["name"],
+                "title": jsontxt[element]["title"],
+                "bike": info["availableVehicleCategories"][0]["count"],
+                "ebike": info["availableVehicleCategories"][1]["count"],
+                "ebike_with_childseat": info["availableVehicleCategories"][2]["count"],
+                "availableDocks": info["availableDocks"],
+                "availableVirtualDocks": info["availableVirtualDocks"],
+                "availablePhysicalDocks": info["availablePhysicalDocks"],
+            }
+        )
+    extra = json.dumps(station_list, indent=4)
+
+    basic_sorted = sorted(json.loads(basic), key=itemgetter("station_id"))
+    extra_sorted = sorted(json.loads(extra), key=itemgetter("station_id"))
+    full = json.dumps([a | b for (a, b) in zip(extra_sorted, basic_sorted)], indent=4)
+    return json.loads(full)
+
+
+def native(info_payload, page, api=BikeMiApi()):
+    """The same pipeline with the Station records"""
+    return api.merge_stations(
+        api.parse_station_information(json.loads(info_payload)),
+        api.parse_stations_page(page),
+    )
+
+
+def measure(function, *args):
+    """Return the best time, in ms, and the peak of traced memory, in KiB"""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak / 1024
+
+
+def main():
+    print(
+        "{:>8} {:>8} {:>12} {:>12}".format(
+            "stations", "pipeline", "time (ms)", "peak (KiB)"
+        )
+    )
+    for n in SIZES:
+        info_payload = json.dumps(synthetic.station_information(n))
+        page = synthetic.stations_page(n)
+        for name, function in (("legacy", legacy), ("native", native)):
+            elapsed, peak = measure(function, info_payload, page)
+            print("{:>8} {:>8} {:>12.2f} {:>12.0f}".format(n, name, elapsed, peak))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare the sort-and-zip merge of the old get_station_full_info_json with
+the hash join, on sources that disagree on a few stations
+
+Run with: python -m benchmarks.merge
+"""
+
+import time
+
+from operator import attrgetter
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from benchmarks import synthetic
+
+SIZES = (300, 1000, 10000, 50000)
+REPEATS = 5
+
+
+def sort_and_zip(stations_basic_info, stations_extra_info):
+    """merge_stations as it was"""
+    basic = sorted(stations_basic_info, key=attrgetter("station_id"))
+    extra = sorted(stations_extra_info, key=attrgetter("station_id"))
+    return [a.merge(b) for (a, b) in zip(extra, basic)]
+
+
+def best(function, *args):
+    elapsed = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed * 1000
+
+
+def main(api=BikeMiApi()):
+    print(
+        "{:>8} {:>16} {:>16} {:>12}".format(
+            "stations", "sort-zip (ms)", "hash join (ms)", "mismatched"
+        )
+    )
+    for n in SIZES:
+        basic = api.parse_station_information(synthetic.station_information(n))
+        extra = api.parse_stations_page(synthetic.stations_page(n))
+        # A station was added to the Open Data, another one was decommissioned
+        # on the website only
+        basic = basic[:]
+        del basic[n // 2]
+        extra = extra[:-1]
+
+        # Zipped stations whose name comes from a different station than the
+        # coordinates are paired with the wrong one
+        names = {station.station_id: station.name for station in extra}
+        wrong = sum(
+            station.name != names.get(station.station_id)
+            for station in sort_and_zip(basic, extra)
+        )
+        result = api.join_stations(basic, extra)
+        assert all(station.name == names[station.station_id] for station in result.rows)
+        assert result.left_only == [str(n - 1)]
+        assert result.right_only == [str(n // 2)]
+
+        print(
+            "{:>8} {:>16.2f} {:>16.2f} {:>12}".format(
+                n,
+                best(sort_and_zip, basic, extra),
+                best(api.join_stations, basic, extra),
+                wrong,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Overhead of recording the metrics, on the instrumented API paths and bot
+handlers of benchmarks.suite, with the metrics off and on in turn
+
+Each path runs in pairs of runs with the metrics off and on, in a random
+order, until it ran for --budget seconds; a run repeats the path's batch
+of calls for at least RUN seconds, with the garbage collector off. The overhead is
+the median of the on / off ratios of the pairs, with a 95% bootstrap
+confidence interval, whose upper bound is checked to be below LIMIT for
+every path.
+
+Run with: python -m benchmarks.metrics [--stations 1000] [--budget 30]
+"""
+
+import argparse
+import gc
+import math
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.metrics import METRICS, MetricsServer
+from bikemi_data_analyser.api.status import GbfsStatus
+from benchmarks import suite
+
+# Pairs of runs of each path, at least and at most
+PAIRS = (30, 2000)
+RESAMPLES = 2000
+# Seconds each run takes, at least
+RUN = 0.02
+LIMIT = 0.02
+INSTRUMENTED = (
+    "get_station_full_info",
+    "bot.search_station",
+    "bot.search_nearest",
+    "bot.get_location",
+    "bot.station_callback",
+    "bot.search_page_callback",
+)
+
+
+def timed(function, setup, enabled, loops=1):
+    METRICS.enable(enabled)
+    args = [setup() if setup else () for _ in range(loops)]
+    # Like timeit, so that a collection of the garbage of earlier runs
+    # doesn't land in this one
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for arguments in args:
+            function(*arguments)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def overheads(function, setup, budget, rng):
+    """Return the on / off - 1 ratios of the pairs of runs, and the
+    batches in each run"""
+    # Warm up the caches, and let the histograms settle on their sampling
+    for enabled in (False, True, True):
+        timed(function, setup, enabled)
+    # Runs of at least RUN seconds, so that the timer and the scheduler's
+    # jitter are small next to them
+    loops = max(1, math.ceil(RUN / timed(function, setup, False)))
+    # What's alive by now is never garbage, keep it out of the collections
+    gc.freeze()
+    ratios = []
+    started = time.perf_counter()
+    while len(ratios) < PAIRS[1] and (
+        len(ratios) < PAIRS[0] or time.perf_counter() - started < budget
+    ):
+        order = [False, True]
+        rng.shuffle(order)
+        elapsed = {enabled: timed(function, setup, enabled, loops) for enabled in order}
+        ratios.append(elapsed[True] / elapsed[False] - 1)
+    gc.unfreeze()
+    return np.array(ratios), loops
+
+
+def interval(ratios, rng):
+    """95% bootstrap confidence interval of the median"""
+    resampled = rng.choice(ratios, (RESAMPLES, len(ratios)))
+    medians = np.median(resampled, axis=1)
+    return np.percentile(medians, 2.5), np.percentile(medians, 97.5)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--budget", type=float, default=30.0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = suite.synthetic_sources(args.stations)
+        urls = suite.write_sources(sources, directory)
+        benchmarks = suite.api_benchmarks(urls, sources)
+        stations = BikeMiApi(Fetcher(), GbfsStatus(urls["gbfs"])).get_station_full_info(
+            urls["station_information"]
+        )
+        benchmarks += suite.bot_benchmarks(stations) or []
+
+        print(
+            "{:<28} {:>6} {:>6} {:>10} {:>10} {:>19}".format(
+                "path", "loops", "pairs", "off (ms)", "overhead", "95% interval"
+            )
+        )
+        over = []
+        for name, function, setup, calls in benchmarks:
+            if name not in INSTRUMENTED:
+                continue
+            off = min(timed(function, setup, False) for _ in range(5))
+            ratios, loops = overheads(function, setup, args.budget, random)
+            low, high = interval(ratios, rng)
+            median = float(np.median(ratios))
+            print(
+                "{:<28} {:>6} {:>6} {:>10.3f} {:>9.2f}% {:>8.2f}% {:>8.2f}%".format(
+                    name,
+                    loops,
+                    len(ratios),
+                    off * 1000,
+                    median * 100,
+                    low * 100,
+                    high * 100,
+                )
+            )
+            if high >= LIMIT:
+                over.append(name)
+        METRICS.enable()
+        assert not over, "Overhead above {:.0%}: {}".format(LIMIT, over)
+
+    server = MetricsServer(port=0)
+    server.start()
+    start = time.perf_counter()
+    text = METRICS.render()
+    print(
+        "\nexported {} lines in {:.2f} ms".format(
+            text.count("\n"), (time.perf_counter() - start) * 1000
+        )
+    )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare the geodesic loop of the old get_nearest_station with SpatialIndex
+
+Run with: python -m benchmarks.nearest
+"""
+
+import random
+import time
+
+from geopy import distance
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.spatial import SpatialIndex
+from benchmarks import synthetic
+
+SIZES = (300, 1000, 10000, 50000)
+QUERIES = 200
+
+
+def geodesic_nearest(stations, lat, lon):
+    """get_nearest_station as it was"""
+    distances = [
+        distance.distance((lat, lon), (station["lat"], station["lon"])).kilometers
+        for station in stations
+    ]
+    return stations[distances.index(min(distances))]
+
+
+def main(api=BikeMiApi()):
+    rng = random.Random(42)
+    print(
+        "{:>8} {:>14} {:>12} {:>14} {:>10}".format(
+            "stations", "geodesic (ms)", "build (ms)", "nearest (us)", "max error"
+        )
+    )
+    for n in SIZES:
+        stations = api.parse_station_information(synthetic.station_information(n))
+        points = [
+            (rng.uniform(*synthetic.LAT_RANGE), rng.uniform(*synthetic.LON_RANGE))
+            for _ in range(QUERIES)
+        ]
+
+        start = time.perf_counter()
+        index = SpatialIndex(stations)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for lat, lon in points:
+            index.nearest(lat, lon)
+        lookup = (time.perf_counter() - start) / QUERIES
+
+        # The geodesic loop is slow: only time (and check) a few queries
+        checked = points[: max(1, QUERIES * 300 // n // 10)]
+        start = time.perf_counter()
+        expected = [geodesic_nearest(stations, lat, lon) for lat, lon in checked]
+        geodesic = (time.perf_counter() - start) / len(checked)
+        error = 0.0
+        for (lat, lon), station in zip(checked, expected):
+            found, meters = index.nearest(lat, lon)[0]
+            exact = distance.distance((lat, lon), (station["lat"], station["lon"])).m
+            error = max(error, abs(meters - exact) / exact)
+
+        print(
+            "{:>8} {:>14.2f} {:>12.2f} {:>14.1f} {:>9.3%}".format(
+                n, geodesic * 1000, build * 1000, lookup * 1e6, error
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
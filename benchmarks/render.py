@@ -0,0 +1,122 @@
+"""Compare rendering a station's card and buttons for every reply, as the bot
+did, with looking them up in StationCards
+
+Run with: python -m benchmarks.render
+"""
+
+import random
+import time
+
+from emojis import encode
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.snapshot import Snapshot
+from bikemi_data_analyser.telegram_bot.cards import StationCards
+from bikemi_data_analyser.telegram_bot.tools import Tools
+from benchmarks import synthetic
+
+STATIONS = 1000
+REPLIES = 20000
+
+
+def print_result(station_raw):
+    """TelegramBot.print_result as it was"""
+    return (
+        encode(":busstop: Name: ")
+        + station_raw["title"]
+        + "\n"
+        + encode(":round_pushpin: Address: ")
+        + station_raw["address"]
+        + "\n"
+        + encode(":bike: Bikes: ")
+        + str(station_raw["bike"])
+        + "\n"
+        + encode(":zap: Electric Bikes: ")
+        + str(station_raw["ebike"])
+        + "\n"
+        + encode(":seat: Electric Bikes with Child Seat: ")
+        + str(station_raw["ebike_with_childseat"])
+        + "\n"
+        + encode(":parking: Available docks: ")
+        + str(station_raw["availableDocks"])
+    )
+
+
+def inline_keyboard_buttons(tools, station_raw):
+    """Tools.inline_keyboard_buttons as it was"""
+    location_link = (
+        "https://www.google.com/maps/search/?api=1&query="
+        + str(station_raw["lat"])
+        + ","
+        + str(station_raw["lon"])
+    )
+    button_list = [
+        InlineKeyboardButton(
+            text=encode(":round_pushpin: Open in Maps"), url=location_link
+        )
+    ]
+    tools.build_custom_keyboard()
+    button_list.append(
+        InlineKeyboardButton(
+            text=encode(":gear: Main Menu"), callback_data="main_menu_callback"
+        )
+    )
+    return InlineKeyboardMarkup(tools.build_menu(button_list, n_cols=1))
+
+
+def main(api=BikeMiApi()):
+    stations = api.merge_stations(
+        api.parse_station_information(synthetic.station_information(STATIONS)),
+        api.parse_stations_page(synthetic.stations_page(STATIONS)),
+    )
+    snapshot = Snapshot(1, stations, 0)
+    rng = random.Random(0)
+    picks = [rng.choice(snapshot.stations) for _ in range(REPLIES)]
+    tools = Tools()
+
+    start = time.perf_counter()
+    for station in picks:
+        print_result(station)
+        inline_keyboard_buttons(tools, station)
+    before = (time.perf_counter() - start) / REPLIES
+
+    cards = StationCards(tools)
+    start = time.perf_counter()
+    cards.get(snapshot, picks[0])
+    render = time.perf_counter() - start
+    start = time.perf_counter()
+    for station in picks:
+        cards.get(snapshot, station)
+    after = (time.perf_counter() - start) / REPLIES
+
+    # A refresh where a tenth of the stations changed their availability
+    fresh = api.merge_stations(
+        api.parse_station_information(synthetic.station_information(STATIONS)),
+        api.parse_stations_page(synthetic.stations_page(STATIONS, seed=1)),
+    )
+    changed = {station.station_id for station in rng.sample(fresh, STATIONS // 10)}
+    refreshed = Snapshot(
+        2,
+        [
+            new if new.station_id in changed else old
+            for old, new in zip(snapshot.stations, fresh)
+        ],
+        0,
+        snapshot,
+    )
+    start = time.perf_counter()
+    cards.get(refreshed, picks[0])
+    rerender = time.perf_counter() - start
+
+    print("Per reply, rendered every time: {:8.1f} us".format(before * 1e6))
+    print("Per reply, looked up:           {:8.1f} us".format(after * 1e6))
+    print(
+        "Rendering {} stations once: {:.1f} ms, {} changed ones: {:.1f} ms".format(
+            STATIONS, render * 1000, len(refreshed.delta), rerender * 1000
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
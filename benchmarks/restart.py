@@ -0,0 +1,184 @@
+"""Time to the first reply of a freshly started bot process, as after /r:
+"before" imports requests, geopy and http.server up front and fetches the
+stations like the bot used to, "cold" is the bot as it is with no image, and
+"image" starts from the image saved by the previous process. Also checks
+that the mapped back snapshot answers like the one it was saved from.
+
+Each run is a new interpreter, timed from its spawn to the reply to a
+location; upstream is the synthetic feeds read through file:// urls, plus
+"--latency" seconds to stand in for the network.
+
+Run with: python -m benchmarks.restart [--stations 300,10000] [--latency 0.5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.image import load_image, save_image
+from bikemi_data_analyser.api.snapshot import Snapshot
+from bikemi_data_analyser.api.status import GbfsStatus
+from benchmarks import suite
+from benchmarks.fakes import FakeContext, FakeLocation, FakeMessage, FakeUpdate
+
+RUNS = 5
+MODES = ("before", "cold", "image")
+
+
+def upstream(urls, latency):
+    api = BikeMiApi(Fetcher(), GbfsStatus(urls["gbfs"]))
+
+    def fetch():
+        time.sleep(latency)
+        return api.get_station_full_info(urls["station_information"])
+
+    return fetch
+
+
+def check_image(snapshot, path):
+    """The mapped back snapshot has the same stations and answers the same"""
+    start = time.perf_counter()
+    restored, extra = load_image(path)
+    elapsed = time.perf_counter() - start
+    assert extra == {"geocode": []}
+    assert restored.version == snapshot.version
+    assert list(restored.stations) == list(snapshot.stations)
+    assert abs(restored.age() - snapshot.age()) < 1
+    words, points = suite.queries(list(snapshot.stations))
+    for word in words:
+        expected = snapshot.search.search(word, k=None)
+        assert restored.search.search(word, k=None) == expected
+    for lat, lon in points:
+        for available in (None, {"ebike": 1}):
+            expected = snapshot.spatial.nearest(lat, lon, 5, available)
+            assert restored.spatial.nearest(lat, lon, 5, available) == expected
+        expected = snapshot.spatial.within(lat, lon, 800)
+        assert restored.spatial.within(lat, lon, 800) == expected
+    # The next refresh patches the restored indexes like any others
+    following = Snapshot(restored.version + 1, snapshot.stations[1:], 0, restored)
+    assert snapshot.stations[0].station_id in following.delta.removed
+    assert following.search.search(snapshot.stations[0].title) != [snapshot.stations[0]]
+    return elapsed
+
+
+def child(urls, latency, mode):
+    """Reply to a location, the way the bot's first handler would"""
+    start = time.perf_counter()
+    if mode == "before":
+        import geopy.geocoders  # noqa: F401
+        import http.server  # noqa: F401
+        import requests  # noqa: F401
+    from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+
+    imported = time.perf_counter()
+    bot = TelegramBot()
+    bot.snapshots.fetch = upstream(urls, latency)
+    bot.open_geocoder(bot.load_image())
+    loaded = time.perf_counter()
+    lat, lon = suite.queries(list(bot.snapshots.get().stations))[1][0]
+    message = FakeMessage(location=FakeLocation(lat, lon))
+    bot.get_location(FakeUpdate(0, message), FakeContext())
+    assert message.replies
+    replied = time.perf_counter()
+    print(
+        json.dumps(
+            {
+                "import": imported - start,
+                "load": loaded - imported,
+                "reply": replied - loaded,
+            }
+        ),
+        flush=True,
+    )
+
+
+def first_reply(directory, urls, latency, mode):
+    """Seconds from spawning a bot process to its first reply, and the
+    phases the process timed itself"""
+    environment = dict(
+        os.environ,
+        HOME=directory,
+        BIKEMI_IMAGE=os.path.join(directory, "warm.img") if mode == "image" else "",
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.restart",
+            "--child",
+            mode,
+            "--urls",
+            json.dumps(urls),
+            "--latency",
+            str(latency),
+        ],
+        stdout=subprocess.PIPE,
+        env=environment,
+        text=True,
+    )
+    line = process.stdout.readline()
+    elapsed = time.perf_counter() - start
+    process.wait()
+    assert process.returncode == 0, mode
+    return elapsed, json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", default="300,10000")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--urls")
+    args = parser.parse_args()
+    if args.child:
+        child(json.loads(args.urls), args.latency, args.child)
+        return
+
+    print(
+        "{:>8} {:>7} {:>12} {:>11} {:>10} {:>10} {:>11}".format(
+            "stations",
+            "mode",
+            "first (ms)",
+            "import (ms)",
+            "load (ms)",
+            "reply (ms)",
+            "image (KiB)",
+        )
+    )
+    for n in map(int, args.stations.split(",")):
+        with tempfile.TemporaryDirectory() as directory:
+            urls = suite.write_sources(suite.synthetic_sources(n), directory)
+            path = os.path.join(directory, "warm.img")
+            snapshot = Snapshot(1, upstream(urls, 0)(), time.monotonic())
+            save_image(path, snapshot, {"geocode": []})
+            mapped = check_image(snapshot, path)
+            size = os.path.getsize(path) / 1024
+            for mode in MODES:
+                runs = [
+                    first_reply(directory, urls, args.latency, mode)
+                    for _ in range(RUNS)
+                ]
+                print(
+                    "{:>8} {:>7} {:>12.0f} {:>11.0f} {:>10.1f} {:>10.1f} {:>11}".format(
+                        n,
+                        mode,
+                        statistics.median(run[0] for run in runs) * 1000,
+                        statistics.median(run[1]["import"] for run in runs) * 1000,
+                        statistics.median(run[1]["load"] for run in runs) * 1000,
+                        statistics.median(run[1]["reply"] for run in runs) * 1000,
+                        "{:.0f}".format(size) if mode == "image" else "",
+                    )
+                )
+            print("{:>8} mapped back in-process in {:.1f} ms".format("", mapped * 1000))
+
+
+if __name__ == "__main__":
+    main()
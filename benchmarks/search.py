@@ -0,0 +1,75 @@
+"""Compare the linear scan of the old find_station with SearchIndex
+
+Run with: python -m benchmarks.search
+"""
+
+import re
+import time
+
+import unidecode
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.search import SearchIndex
+from benchmarks import synthetic
+
+SIZES = (300, 1000, 10000)
+QUERIES = (
+    "duomo",
+    "porta romana",
+    "garibaldi 1",
+    "citta studi",
+    "navigly",
+    "cadrona",
+    "via montenapoelone",
+    "42",
+)
+
+
+def scan(stations, user_input):
+    """find_station as it was"""
+    user_input_edit = re.sub("[^A-Za-z0-9]+", "", unidecode.unidecode(user_input))
+    return [
+        station
+        for station in stations
+        if user_input_edit
+        and (
+            re.search(
+                user_input_edit,
+                re.sub("[^A-Za-z0-9]+", "", unidecode.unidecode(station["title"])),
+                re.IGNORECASE,
+            )
+            or re.search(user_input, station["station_id"], re.IGNORECASE)
+        )
+    ]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for query in QUERIES:
+        function(*args, query)
+    return (time.perf_counter() - start) / len(QUERIES)
+
+
+def main(api=BikeMiApi()):
+    print(
+        "{:>8} {:>12} {:>12} {:>12}".format(
+            "stations", "scan (ms)", "build (ms)", "search (us)"
+        )
+    )
+    for n in SIZES:
+        stations = api.parse_stations_page(synthetic.stations_page(n))
+        start = time.perf_counter()
+        index = SearchIndex(stations)
+        build = time.perf_counter() - start
+        print(
+            "{:>8} {:>12.2f} {:>12.2f} {:>12.1f}".format(
+                n,
+                timed(scan, stations) * 1000,
+                build * 1000,
+                timed(index.search) * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Requests per second of the StationServer, running on a single core, for
+each endpoint; clients poll with keep-alive connections and gzip
+
+Run with: python -m benchmarks.server
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.server import StationServer
+from bikemi_data_analyser.api.snapshot import SnapshotStore
+from benchmarks.delta import fetch
+
+STATIONS = 1000
+PORT = 8765
+CONNECTIONS = 16
+# Requests sent at once on each connection
+PIPELINE = 8
+SECONDS = 2
+REQUESTS = (
+    ("/stations", False),
+    ("/stations", True),
+    ("/stations/42", False),
+    ("/search?q=via%20dante", False),
+    ("/nearest?lat=45.4642&lon=9.1916&k=5", False),
+    ("/diff?since=1", False),
+)
+
+
+def run_server(ready):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {0})
+    stations = fetch(BikeMiApi(), STATIONS)
+    snapshots = SnapshotStore(lambda: stations, ttl=3600)
+    server = StationServer(snapshots)
+
+    async def serve():
+        serving = asyncio.ensure_future(server.serve(port=PORT))
+        while snapshots._snapshot is None:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        ready.set()
+        await serving
+
+    asyncio.run(serve())
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    etag = None
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"etag":
+            etag = value.strip()
+    body = await reader.readexactly(length) if length else b""
+    return status, etag, len(body)
+
+
+async def client(path, conditional, deadline, counts):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    request = "GET {} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip\r\n".format(path)
+    writer.write((request + "\r\n").encode())
+    _, etag, size = await read_response(reader)
+    if conditional:
+        request += "If-None-Match: {}\r\n".format(etag.decode())
+    request = (request + "\r\n").encode() * PIPELINE
+    while time.perf_counter() < deadline:
+        writer.write(request)
+        for _ in range(PIPELINE):
+            status, _, size = await read_response(reader)
+            counts[status] = counts.get(status, 0) + 1
+            counts["bytes"] = counts.get("bytes", 0) + size
+    writer.close()
+
+
+async def load(path, conditional):
+    counts = {}
+    start = time.perf_counter()
+    deadline = start + SECONDS
+    await asyncio.gather(
+        *(client(path, conditional, deadline, counts) for _ in range(CONNECTIONS))
+    )
+    elapsed = time.perf_counter() - start
+    total = sum(v for k, v in counts.items() if k != "bytes")
+    statuses = ",".join(str(k) for k in counts if k != "bytes")
+    return total / elapsed, counts.get("bytes", 0) / max(total, 1), statuses
+
+
+def main():
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server, args=(ready,), daemon=True)
+    server.start()
+    ready.wait()
+    try:
+        print(
+            "{:<40} {:>8} {:>12} {:>10}".format("request", "status", "bytes", "req/s")
+        )
+        for path, conditional in REQUESTS:
+            rate, size, statuses = asyncio.run(load(path, conditional))
+            print(
+                "{:<40} {:>8} {:>12.0f} {:>10.0f}".format(
+                    path + (" (If-None-Match)" if conditional else ""),
+                    statuses,
+                    size,
+                    rate,
+                )
+            )
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
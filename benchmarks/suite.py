@@ -0,0 +1,553 @@
+"""Time, peak memory and allocations of every BikeMiApi entry point and bot
+handler, on copies of the upstream sources and on synthetic sets of
+stations, written as json to compare a change against a baseline
+
+Run with: python -m benchmarks.suite [--sizes 300,1000,10000,50000]
+                                      [--output results.json]
+                                      [--compare baseline.json]
+          python -m benchmarks.suite --record
+
+The sources are written to files and read back through the Fetcher's
+file:// urls, so the fetch paths run as they do in production, minus the
+network. --record saves the live station_information.json, GBFS
+station_status.json and vehicle_types.json, and the bikemi.com/stazioni
+page in benchmarks/fixtures, to replay them as the "recorded" data set.
+The "sample" data set, in benchmarks/sample, is synthetic: 42 central
+stations written by hand in the upstream formats, with made up
+availability counts, so that the formats are covered with no recording.
+
+"peak" is the traced memory peak of a call, "retained" what's still
+allocated once it returns, with its result alive, and "blocks" the
+number of those allocations. The bot handlers run with fake Telegram
+updates and contexts, and are skipped when python-telegram-bot isn't
+installed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.snapshot import Snapshot, SnapshotStore
+from bikemi_data_analyser.api.status import GbfsStatus, ScraperStatus
+from benchmarks import synthetic
+from benchmarks.fakes import (
+    FakeCallbackQuery,
+    FakeContext,
+    FakeGeocoder,
+    FakeLocation,
+    FakeMessage,
+    FakeUpdate,
+)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+SAMPLE = os.path.join(os.path.dirname(__file__), "sample")
+SIZES = (300, 1000, 10000, 50000)
+REPEATS = 5
+# Runs stop early once they took this many seconds
+BUDGET = 5
+# Queries in each batch of searches, nearest queries and bot handler calls
+CALLS = 100
+# Times slower than the baseline counted as a regression by --compare
+THRESHOLD = 1.2
+
+
+# Data sets
+
+
+def synthetic_sources(n):
+    return {
+        "station_information": synthetic.station_information(n),
+        "station_status": synthetic.station_status(n),
+        "vehicle_types": synthetic.vehicle_types(),
+        "stazioni": synthetic.stations_page(n),
+    }
+
+
+def recorded_sources(directory=FIXTURES):
+    """The sources saved in "directory", or None if they weren't recorded"""
+    sources = {}
+    for name in ("station_information", "station_status", "vehicle_types"):
+        path = os.path.join(directory, name + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            sources[name] = json.load(f)
+    path = os.path.join(directory, "stazioni.html")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        sources["stazioni"] = f.read()
+    return sources
+
+
+def record(directory=FIXTURES, fetcher=None):
+    """Save the live upstream sources in "directory" """
+    fetcher = fetcher or Fetcher()
+    os.makedirs(directory, exist_ok=True)
+    feeds = GbfsStatus(BikeMiApi.GBFS).feed_urls(fetcher)
+    urls = {
+        "station_information.json": BikeMiApi.STATION_INFO,
+        "station_status.json": feeds["station_status"],
+        "vehicle_types.json": feeds["vehicle_types"],
+        "stazioni.html": BikeMiApi.STATIONS_PAGE,
+    }
+    for name, url in urls.items():
+        content = fetcher.get(url, lambda response: response.content).value
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(content)
+        print("{:<28} {:>10} bytes".format(name, len(content)))
+
+
+def write_sources(sources, directory):
+    """Write the sources as files and return their file:// urls"""
+    urls = {}
+    for name in ("station_information", "station_status", "vehicle_types"):
+        path = os.path.join(directory, name + ".json")
+        with open(path, "w") as f:
+            json.dump(sources[name], f)
+        urls[name] = "file://" + path
+    path = os.path.join(directory, "gbfs.json")
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "last_updated": 0,
+                "ttl": 0,
+                "data": {
+                    "en": {
+                        "feeds": [
+                            {"name": "station_status", "url": urls["station_status"]},
+                            {"name": "vehicle_types", "url": urls["vehicle_types"]},
+                        ]
+                    }
+                },
+            },
+            f,
+        )
+    urls["gbfs"] = "file://" + path
+    path = os.path.join(directory, "stazioni.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(sources["stazioni"])
+    urls["stazioni"] = "file://" + path
+    return urls
+
+
+# Measurements
+
+
+def measure(function, setup=None, calls=1):
+    """Run function(*setup()) a few times and return its metrics"""
+    times = []
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() - started > BUDGET:
+            break
+    args = setup() if setup else ()
+    tracemalloc.start()
+    result = function(*args)
+    retained, peak = tracemalloc.get_traced_memory()
+    blocks = len(tracemalloc.take_snapshot().traces)
+    tracemalloc.stop()
+    del result
+    return {
+        "calls": calls,
+        "runs": len(times),
+        "best_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "per_call_us": min(times) / calls * 1e6,
+        "peak_kib": peak / 1024,
+        "retained_kib": retained / 1024,
+        "blocks": blocks,
+    }
+
+
+def queries(stations, seed=0):
+    """Search terms and points to query the stations with"""
+    rng = random.Random(seed)
+    sample = [rng.choice(stations) for _ in range(CALLS)]
+    words = [
+        max(station["title"].split(), key=len)[:6]
+        for station in sample
+        if station.get("title")
+    ]
+    points = [
+        (station["lat"] + rng.uniform(-0.002, 0.002), station["lon"])
+        for station in sample
+    ]
+    return words, points
+
+
+def api_benchmarks(urls, sources):
+    """(name, function, setup, calls) of every BikeMiApi entry point"""
+
+    def gbfs_api():
+        return (BikeMiApi(Fetcher(), GbfsStatus(urls["gbfs"])),)
+
+    def scraper_api():
+        return (BikeMiApi(Fetcher(), ScraperStatus(urls["stazioni"])),)
+
+    warm = gbfs_api()[0]
+    stations = warm.get_station_full_info(urls["station_information"])
+    words, points = queries(stations)
+    snapshot = Snapshot(1, stations, 0)
+    api = BikeMiApi(Fetcher())
+    page = sources["stazioni"]
+
+    return [
+        (
+            "get_stations_basic_info",
+            lambda api: api.get_stations_basic_info(urls["station_information"]),
+            gbfs_api,
+            1,
+        ),
+        ("get_station_extra_info[gbfs]", BikeMiApi.get_station_extra_info, gbfs_api, 1),
+        (
+            "get_station_extra_info[scraper]",
+            BikeMiApi.get_station_extra_info,
+            scraper_api,
+            1,
+        ),
+        ("parse_stations_page", lambda: api.parse_stations_page(page), None, 1),
+        (
+            "get_station_full_info",
+            lambda api: api.get_station_full_info(urls["station_information"]),
+            gbfs_api,
+            1,
+        ),
+        (
+            "get_station_full_info[unchanged]",
+            lambda: warm.get_station_full_info(urls["station_information"]),
+            None,
+            1,
+        ),
+        (
+            "get_station_full_info_json",
+            lambda api: api.get_station_full_info_json(urls["station_information"]),
+            gbfs_api,
+            1,
+        ),
+        ("Snapshot", lambda: Snapshot(2, stations, 0), None, 1),
+        (
+            "find_station",
+            lambda: [list(api.find_station(stations, word)) for word in words[:10]],
+            None,
+            10,
+        ),
+        (
+            "SearchIndex.search",
+            lambda: [snapshot.search.search(word) for word in words],
+            None,
+            len(words),
+        ),
+        (
+            "get_nearest_station",
+            lambda: [
+                api.get_nearest_station(stations, lat, lon) for lat, lon in points[:10]
+            ],
+            None,
+            10,
+        ),
+        (
+            "SpatialIndex.nearest",
+            lambda: [snapshot.spatial.nearest(lat, lon) for lat, lon in points],
+            None,
+            len(points),
+        ),
+    ]
+
+
+# Bot handlers, with Telegram mocked
+
+
+def bot_benchmarks(stations):
+    """(name, function, setup, calls) of the bot handlers, or None when
+    python-telegram-bot isn't installed"""
+    try:
+        from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+    except ImportError:
+        return None
+    from bikemi_data_analyser.telegram_bot.geocode import GeocodeCache
+    from bikemi_data_analyser.telegram_bot.watch import WatchList
+
+    words, points = queries(stations, seed=1)
+    bot = TelegramBot()
+    bot.snapshots = SnapshotStore(lambda: stations, ttl=3600)
+    bot.snapshots.get()
+    bot.watches = WatchList()
+    context = FakeContext()
+    token, _ = bot.results.search(bot.snapshots.get(), words[0])
+    station_ids = [station.station_id for station in stations[:CALLS]]
+
+    def geocoder():
+        # A new cache every run: every place is a miss
+        bot.geocoder = GeocodeCache(FakeGeocoder(points))
+        return ()
+
+    def each(handler, arguments):
+        return lambda: [handler(*args) for args in arguments]
+
+    return [
+        (
+            "bot.search_station",
+            each(
+                bot.search_station,
+                [
+                    (FakeUpdate(i, FakeMessage(w)), context, w)
+                    for i, w in enumerate(words)
+                ],
+            ),
+            None,
+            len(words),
+        ),
+        (
+            "bot.search_nearest",
+            each(
+                bot.search_nearest,
+                [
+                    (FakeUpdate(i, FakeMessage(w)), context, "{} {}".format(w, i))
+                    for i, w in enumerate(words)
+                ],
+            ),
+            geocoder,
+            len(words),
+        ),
+        (
+            "bot.get_location",
+            each(
+                bot.get_location,
+                [
+                    (FakeUpdate(i, FakeMessage(location=FakeLocation(*p))), context)
+                    for i, p in enumerate(points)
+                ],
+            ),
+            None,
+            len(points),
+        ),
+        (
+            "bot.get_location[ebike]",
+            each(
+                bot.get_location,
+                [
+                    (
+                        FakeUpdate(i, FakeMessage(location=FakeLocation(*p))),
+                        context,
+                        {"ebike": 2},
+                    )
+                    for i, p in enumerate(points)
+                ],
+            ),
+            None,
+            len(points),
+        ),
+        (
+            "bot.station_callback",
+            each(
+                bot.station_callback,
+                [
+                    (
+                        FakeUpdate(0, callback_query=FakeCallbackQuery("station:" + i)),
+                        context,
+                    )
+                    for i in station_ids
+                ],
+            ),
+            None,
+            len(station_ids),
+        ),
+        (
+            "bot.search_page_callback",
+            each(
+                bot.search_page_callback,
+                [
+                    (
+                        FakeUpdate(
+                            0,
+                            callback_query=FakeCallbackQuery(
+                                "search:{}:{}".format(token, page % 3)
+                            ),
+                        ),
+                        context,
+                    )
+                    for page in range(CALLS)
+                ],
+            ),
+            None,
+            CALLS,
+        ),
+        (
+            "bot.watch_command",
+            each(
+                bot.watch_command,
+                [
+                    (FakeUpdate(i, FakeMessage()), FakeContext([w]))
+                    for i, w in enumerate(words)
+                ],
+            ),
+            None,
+            len(words),
+        ),
+    ]
+
+
+# Reports
+
+
+def run(datasets):
+    results = []
+    skipped = []
+    with tempfile.TemporaryDirectory() as directory:
+        for dataset, sources in datasets:
+            root = os.path.join(directory, dataset)
+            os.makedirs(root)
+            urls = write_sources(sources, root)
+            benchmarks = api_benchmarks(urls, sources)
+            stations = BikeMiApi(
+                Fetcher(), GbfsStatus(urls["gbfs"])
+            ).get_station_full_info(urls["station_information"])
+            handlers = bot_benchmarks(stations)
+            if handlers is None:
+                skipped.append("bot handlers: python-telegram-bot isn't installed")
+            else:
+                benchmarks += handlers
+            for name, function, setup, calls in benchmarks:
+                result = measure(function, setup, calls)
+                result.update(name=name, dataset=dataset, stations=len(stations))
+                results.append(result)
+                print_result(result)
+    return results, sorted(set(skipped))
+
+
+def print_header():
+    print(
+        "{:<34} {:>12} {:>11} {:>11} {:>11} {:>11}".format(
+            "benchmark", "data set", "best (ms)", "call (us)", "peak (KiB)", "blocks"
+        )
+    )
+
+
+def print_result(result):
+    print(
+        "{:<34} {:>12} {:>11.2f} {:>11.1f} {:>11.0f} {:>11}".format(
+            result["name"],
+            result["dataset"],
+            result["best_ms"],
+            result["per_call_us"],
+            result["peak_kib"],
+            result["blocks"],
+        )
+    )
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(baseline, results, threshold=THRESHOLD):
+    """Print the results next to the baseline's, and return the regressions"""
+    old = {(r["name"], r["dataset"]): r for r in baseline["results"]}
+    regressions = []
+    print(
+        "\n{:<34} {:>12} {:>11} {:>11} {:>8} {:>10}".format(
+            "benchmark", "data set", "base (ms)", "now (ms)", "ratio", "peak ratio"
+        )
+    )
+    for result in results:
+        before = old.get((result["name"], result["dataset"]))
+        if before is None:
+            continue
+        ratio = result["best_ms"] / max(before["best_ms"], 1e-9)
+        peak = result["peak_kib"] / max(before["peak_kib"], 1e-9)
+        slower = ratio > threshold or peak > threshold
+        if slower:
+            regressions.append(result)
+        print(
+            "{:<34} {:>12} {:>11.2f} {:>11.2f} {:>8.2f} {:>10.2f}{}".format(
+                result["name"],
+                result["dataset"],
+                before["best_ms"],
+                result["best_ms"],
+                ratio,
+                peak,
+                "  <- regression" if slower else "",
+            )
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(n) for n in SIZES),
+        help="stations in each synthetic data set, comma separated",
+    )
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--output", help="json file to write the results to")
+    parser.add_argument("--compare", help="json results of a previous run")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--record", action="store_true", help="save the live sources as fixtures"
+    )
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.fixtures)
+        return 0
+
+    datasets = []
+    recorded = recorded_sources(args.fixtures)
+    if recorded is not None:
+        datasets.append(("recorded", recorded))
+    datasets.append(("sample", recorded_sources(SAMPLE)))
+    for n in (int(size) for size in args.sizes.split(",") if size):
+        datasets.append(("synthetic-{}".format(n), synthetic_sources(n)))
+
+    print_header()
+    results, skipped = run(datasets)
+    if recorded is None:
+        skipped.append("recorded data set: no fixtures in " + args.fixtures)
+    for reason in skipped:
+        print("skipped " + reason)
+
+    report = {"meta": metadata(), "skipped": skipped, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print("\n{} regressions".format(len(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Synthetic BikeMi data, shaped like the upstream sources, for the benchmarks"""
+
+import json
+import random
+
+# Bounding box around Milan
+LAT_RANGE = (45.40, 45.53)
+LON_RANGE = (9.10, 9.28)
+
+PAGE_HEAD = '<html><script>{"page":{"type":"stationMapPage","slug":null},'
+PAGE_TAIL = '},"baseUrl":"https://bikemi.com"}</script></html>'
+
+
+def station_information(n, seed=0):
+    """Return a station_information.json payload, already decoded"""
+    rng = random.Random(seed)
+    stations = []
+    for i in range(n):
+        stations.append(
+            {
+                "station_id": str(i),
+                "name": "{} - Via {}".format(i, _street(rng)),
+                "address": "Via {}, {}".format(_street(rng), rng.randint(1, 200)),
+                "cross_street": _street(rng),
+                "lat": rng.uniform(*LAT_RANGE),
+                "lon": rng.uniform(*LON_RANGE),
+                "capacity": rng.randint(10, 40),
+                "rental_uris": {
+                    "android": "https://bikemi.com/app?station={}".format(i)
+                },
+            }
+        )
+    return {"last_updated": 0, "ttl": 10, "data": {"stations": stations}}
+
+
+def stations_page(n, seed=0):
+    """Return the bikemi.com/stazioni html, with the station availability embedded"""
+    rng = random.Random(seed + 1)
+    stations = []
+    for i in range(n):
+        station = {
+            "id": str(i),
+            "name": "{} - Via {}".format(i, _street(rng)),
+            "title": "{} - Via {}".format(i, _street(rng)),
+            "availabilityInfo": {
+                "availableVehicleCategories": [
+                    {"vehicleCategory": category, "count": rng.randint(0, 10)}
+                    for category in ("bike", "ebike", "ebike_with_childseat")
+                ],
+                "availableDocks": rng.randint(0, 30),
+                "availableVirtualDocks": 0,
+                "availablePhysicalDocks": rng.randint(0, 30),
+            },
+        }
+        stations.append(json.dumps(str(i)) + ":" + json.dumps(station))
+    return PAGE_HEAD + ",".join(stations) + "}" + PAGE_TAIL
+
+
+def station_status(n, seed=0):
+    """Return a GBFS station_status.json payload, already decoded"""
+    rng = random.Random(seed + 2)
+    stations = []
+    for i in range(n):
+        stations.append(
+            {
+                "station_id": str(i),
+                "is_installed": True,
+                "is_renting": True,
+                "is_returning": True,
+                "last_reported": 0,
+                "num_bikes_available": 0,
+                "num_docks_available": rng.randint(0, 30),
+                "vehicle_types_available": [
+                    {"vehicle_type_id": vehicle_type_id, "count": rng.randint(0, 10)}
+                    for vehicle_type_id in VEHICLE_TYPES
+                ],
+            }
+        )
+    for station in stations:
+        station["num_bikes_available"] = sum(
+            vehicles["count"] for vehicles in station["vehicle_types_available"]
+        )
+    return {"last_updated": 0, "ttl": 10, "data": {"stations": stations}}
+
+
+def vehicle_types():
+    """Return a GBFS vehicle_types.json payload, already decoded"""
+    return {
+        "last_updated": 0,
+        "ttl": 3600,
+        "data": {"vehicle_types": list(VEHICLE_TYPES.values())},
+    }
+
+
+VEHICLE_TYPES = {
+    "1": {"vehicle_type_id": "1", "form_factor": "bicycle", "propulsion_type": "human"},
+    "2": {
+        "vehicle_type_id": "2",
+        "form_factor": "bicycle",
+        "propulsion_type": "electric_assist",
+        "name": "E-bike",
+    },
+    "3": {
+        "vehicle_type_id": "3",
+        "form_factor": "bicycle",
+        "propulsion_type": "electric_assist",
+        "name": "E-bike with child seat",
+    },
+}
+
+
+def _street(rng):
+    return rng.choice(
+        [
+            "Dante",
+            "Torino",
+            "Manzoni",
+            "Garibaldi",
+            "Montenapoleone",
+            "Brera",
+            "Cadorna",
+            "Porta Romana",
+            "Città Studi",
+            "Navigli",
+        ]
+    )
@@ -0,0 +1,137 @@
+"""Load up to 20 GBFS systems from local fixtures in a SystemRegistry, and
+check that memory and refresh time grow linearly with them and that the
+nearest queries are routed to the right system; tests/test_systems.py runs
+the same checks on smaller fixtures
+
+Run with: python -m benchmarks.systems
+"""
+
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.systems import SystemRegistry
+from benchmarks import synthetic
+
+SYSTEMS = (1, 5, 10, 20)
+STATIONS = 1000
+# Systems are laid out on a grid, a degree apart
+COLUMNS = 5
+
+
+def offset(number):
+    return (number // COLUMNS) * 1.0, (number % COLUMNS) * 1.0
+
+
+def write_fixtures(directory, count, n=STATIONS):
+    """Write the feeds of "count" systems and return the registry's config"""
+    config = []
+    for number in range(count):
+        name = "system{}".format(number)
+        root = os.path.join(directory, name)
+        os.makedirs(root, exist_ok=True)
+        dlat, dlon = offset(number)
+        information = synthetic.station_information(n, seed=number)
+        for station in information["data"]["stations"]:
+            station["lat"] += dlat
+            station["lon"] += dlon
+        feeds = {
+            "station_information": information,
+            "station_status": synthetic.station_status(n, seed=number),
+            "vehicle_types": synthetic.vehicle_types(),
+        }
+        urls = {}
+        for feed, payload in feeds.items():
+            path = os.path.join(root, feed + ".json")
+            with open(path, "w") as f:
+                json.dump(payload, f)
+            urls[feed] = "file://" + path
+        discovery = {
+            "last_updated": 0,
+            "ttl": 0,
+            "data": {
+                "en": {
+                    "feeds": [{"name": feed, "url": url} for feed, url in urls.items()]
+                }
+            },
+        }
+        with open(os.path.join(root, "gbfs.json"), "w") as f:
+            json.dump(discovery, f)
+        config.append(
+            {
+                "name": name,
+                "station_info": urls["station_information"],
+                "gbfs": "file://" + os.path.join(root, "gbfs.json"),
+            }
+        )
+    path = os.path.join(directory, "systems.json")
+    with open(path, "w") as f:
+        json.dump(config, f)
+    return path
+
+
+def check_routing(registry):
+    centre_lat = sum(synthetic.LAT_RANGE) / 2
+    centre_lon = sum(synthetic.LON_RANGE) / 2
+    for number, system in enumerate(registry):
+        dlat, dlon = offset(number)
+        lat, lon = centre_lat + dlat, centre_lon + dlon
+        assert registry.route(lat, lon) == [system]
+        found = registry.nearest(lat, lon, k=3)
+        assert [item[0] for item in found] == [system] * 3
+        expected = system.snapshot().spatial.nearest(lat, lon, 3)
+        assert [item[1:] for item in found] == expected
+    # In between the systems, and far from all of them
+    assert registry.nearest(centre_lat + 0.5, centre_lon) == []
+    assert registry.nearest(0.0, 0.0) == []
+
+
+def main():
+    print(
+        "{:>8} {:>10} {:>14} {:>14} {:>16}".format(
+            "systems", "stations", "refresh (ms)", "memory (MiB)", "per system (MiB)"
+        )
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_fixtures(directory, max(SYSTEMS))
+        with open(path) as f:
+            config = json.load(f)
+        for count in SYSTEMS:
+            subset = os.path.join(directory, "systems{}.json".format(count))
+            with open(subset, "w") as f:
+                json.dump(config[:count], f)
+
+            tracemalloc.start()
+            registry = SystemRegistry.load(subset, fetcher=Fetcher(workers=8))
+            start = time.perf_counter()
+            errors = registry.refresh_all()
+            elapsed = time.perf_counter() - start
+            memory = tracemalloc.get_traced_memory()[0] / 2**20
+            tracemalloc.stop()
+            assert not errors, errors
+
+            check_routing(registry)
+            # Unchanged fixtures answer 304: nothing to parse or rebuild
+            start = time.perf_counter()
+            registry.refresh_all()
+            again = time.perf_counter() - start
+            assert all(s.snapshot().version == 1 for s in registry)
+
+            print(
+                "{:>8} {:>10} {:>14.0f} {:>14.1f} {:>16.2f}".format(
+                    count,
+                    count * STATIONS,
+                    elapsed * 1000,
+                    memory,
+                    memory / count,
+                )
+            )
+            registry.stop()
+        print("\nrefreshing 20 unchanged systems: {:.0f} ms".format(again * 1000))
+
+
+if __name__ == "__main__":
+    main()
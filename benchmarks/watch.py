@@ -0,0 +1,75 @@
+"""Compare checking the watches against each snapshot's delta, through the
+station_id index, with looking up every watched station at each refresh
+
+Run with: python -m benchmarks.watch
+"""
+
+import random
+import time
+
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.snapshot import Snapshot
+from bikemi_data_analyser.telegram_bot.watch import Outbox, Watch, WatchList
+from benchmarks.delta import fetch
+
+STATIONS = 1000
+WATCHES = (1000, 10000, 100000)
+CHURN = 0.01
+FIELDS = ("bike", "ebike", "availableDocks")
+
+
+def watches(n, stations, seed=0):
+    rng = random.Random(seed)
+    return [
+        # Out of reach, so that every watch is checked at every refresh
+        Watch(i, rng.choice(stations).station_id, rng.choice(FIELDS), 1000)
+        for i in range(n)
+    ]
+
+
+def polled(snapshot, watch_list):
+    """What polling every watched station would do: look all of them up"""
+    fired = []
+    for watch in watch_list:
+        station = snapshot.by_id.get(watch.station_id)
+        if station is not None and station.get(watch.field, 0) >= watch.minimum:
+            fired.append(watch)
+    return fired
+
+
+def main(api=BikeMiApi()):
+    previous = Snapshot(1, fetch(api, STATIONS), 0)
+    snapshot = Snapshot(2, fetch(api, STATIONS, CHURN, seed=1), 0, previous)
+    print("{:>8} {:>14} {:>14}".format("watches", "polled (ms)", "indexed (ms)"))
+    for n in WATCHES:
+        watch_list = watches(n, previous.stations)
+        index = WatchList()
+        for watch in watch_list:
+            index._insert(watch)
+
+        start = time.perf_counter()
+        polled(snapshot, watch_list)
+        poll = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.triggered(snapshot.delta)
+        indexed = time.perf_counter() - start
+        print("{:>8} {:>14.2f} {:>14.2f}".format(n, poll * 1000, indexed * 1000))
+
+    # Lines for the same chat are joined in one message
+    sent = []
+    outbox = Outbox(lambda chat_id, text: sent.append(chat_id), rate=1000)
+    for i in range(2000):
+        outbox.put(i % 100, "line {}".format(i))
+    start = time.perf_counter()
+    outbox.start()
+    outbox.stop()
+    print(
+        "\n2000 notifications for 100 chats: {} messages in {:.2f} s".format(
+            len(sent), time.perf_counter() - start
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
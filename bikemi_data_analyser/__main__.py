@@ -1,6 +1,179 @@
-from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+import argparse
+import logging
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bikemi_data_analyser")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("bot", help="run the Telegram bot (default)")
+    record = commands.add_parser(
+        "record", help="record the stations availability over time"
+    )
+    record.add_argument("path", help="directory of the history store")
+    record.add_argument(
+        "--interval", type=int, default=60, help="seconds between samples"
+    )
+    record.add_argument(
+        "--sync", action="store_true", help="fsync every sample to the disk"
+    )
+    add_system_arguments(record)
+    serve = commands.add_parser(
+        "serve", help="serve the stations over HTTP, from a shared snapshot"
+    )
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument(
+        "--ttl", type=float, default=60, help="seconds between upstream fetches"
+    )
+    serve.add_argument(
+        "--metrics-port", type=int, help="serve Prometheus metrics on this port"
+    )
+    add_system_arguments(serve)
+    compact = commands.add_parser(
+        "compact",
+        help="rewrite the history store, thinning out the old samples;"
+        " stop the recorder first",
+    )
+    compact.add_argument("path", help="directory of the history store")
+    compact.add_argument(
+        "--older-than",
+        type=float,
+        help="days after which samples are thinned out, default: all of them",
+    )
+    compact.add_argument(
+        "--interval",
+        type=int,
+        help="seconds between the samples kept, default: keep them all",
+    )
+    analyse = commands.add_parser(
+        "analyse", help="report on the recorded availability, as csv or json"
+    )
+    analyse.add_argument("path", help="directory of the history store")
+    analyse.add_argument(
+        "--report", choices=("stations", "hourly", "ranking"), default="stations"
+    )
+    analyse.add_argument("--format", choices=("csv", "json"), default="csv")
+    analyse.add_argument(
+        "--output", type=argparse.FileType("w"), default="-", help="default: stdout"
+    )
+    analyse.add_argument("--timezone", default="Europe/Rome")
+    analyse.add_argument("--top", type=int, default=10, help="stations in each ranking")
+    args = parser.parse_args(argv)
+
+    # Only import what the command needs
+    if args.command == "record":
+        record_history(args)
+    elif args.command == "serve":
+        serve_stations(args)
+    elif args.command == "compact":
+        compact_history(args)
+    elif args.command == "analyse":
+        analyse_history(args)
+    else:
+        from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+
+        TelegramBot().main()
+
+
+def add_system_arguments(parser):
+    parser.add_argument(
+        "--systems",
+        help="json list of the bike-share systems, see SystemRegistry.load()",
+    )
+    parser.add_argument(
+        "--system", default="bikemi", help="the system to use among them"
+    )
+
+
+def system_snapshots(args, ttl):
+    """The SnapshotStore of the system picked by the command's arguments"""
+    from bikemi_data_analyser.api.systems import SystemRegistry
+
+    registry = SystemRegistry.load(args.systems, names=[args.system], ttl=ttl)
+    return registry.get(args.system).snapshots
+
+
+def record_history(args):
+    from bikemi_data_analyser.history.recorder import Recorder
+    from bikemi_data_analyser.history.store import HistoryStore
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    # Fresh enough for every sample, without refetching twice for one
+    snapshots = system_snapshots(args, args.interval / 2)
+    recorder = Recorder(
+        HistoryStore(args.path, sync=args.sync, create=True), snapshots, args.interval
+    )
+    try:
+        recorder.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_stations(args):
+    from bikemi_data_analyser.api.metrics import METRICS, MetricsServer
+    from bikemi_data_analyser.api.server import StationServer
+
+    import asyncio
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    snapshots = system_snapshots(args, args.ttl)
+    server = StationServer(snapshots)
+    if args.metrics_port:
+        METRICS.enable()
+        METRICS.collect("snapshot", snapshots.stats)
+        METRICS.collect("server", server.stats)
+        MetricsServer(port=args.metrics_port).start()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+def open_history(path):
+    """The history store in "path", exiting with an error when there's none"""
+    from bikemi_data_analyser.history.store import HistoryStore
+
+    try:
+        return HistoryStore(path)
+    except FileNotFoundError as error:
+        sys.exit("bikemi_data_analyser: {}".format(error))
+
+
+def compact_history(args):
+    import time
+
+    store = open_history(args.path)
+    frames = len(store)
+    older_than = None
+    if args.older_than is not None:
+        older_than = time.time() - args.older_than * 86400
+    store.compact(older_than=older_than, interval=args.interval)
+    print("{}: {} frames, {} after compaction".format(args.path, frames, len(store)))
+
+
+def analyse_history(args):
+    from bikemi_data_analyser.history.analytics import analyse
+
+    import csv
+    import json
+
+    report = analyse(open_history(args.path), timezone=args.timezone)
+    rows = report.rows(args.report, top=args.top)
+    if args.format == "json":
+        json.dump(rows, args.output, indent=4)
+        args.output.write("\n")
+    elif rows:
+        writer = csv.DictWriter(args.output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
 
-bot = TelegramBot()
 
 if __name__ == "__main__":
-    bot.main()
+    main()
@@ -1,129 +1,156 @@
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.join import INNER, hash_join
+from bikemi_data_analyser.api.metrics import METRICS
+from bikemi_data_analyser.api.search import SearchIndex
+from bikemi_data_analyser.api.spatial import SpatialIndex
+from bikemi_data_analyser.api.station import Station
+from bikemi_data_analyser.api.status import (
+    FallbackStatus,
+    GbfsStatus,
+    ScraperStatus,
+    parse_stations_page,
+)
+
 import json
-import re
-import requests
-import unidecode
+import logging
 
-from geopy import distance
 from operator import itemgetter
 
+logger = logging.getLogger(__name__)
+
 
 class BikeMiApi:
-    def json_decoder(self, info_url):
-        """Generate a list of stations, stored as dictionaries, by using the
-        json files provided by BikeMi at https://bikemi.com/dati-aperti/"""
-        resp = requests.get(info_url)
-        raw = resp.json()
+    STATION_INFO = "https://gbfs.urbansharing.com/bikemi.com/station_information.json"
+    GBFS = "https://gbfs.urbansharing.com/bikemi.com/gbfs.json"
+    STATIONS_PAGE = "https://bikemi.com/stazioni"
+    # Seconds to wait for each source before retrying
+    INFO_TIMEOUT = 5
+    PAGE_TIMEOUT = 15
+
+    def __init__(self, fetcher=None, status=None):
+        self.fetcher = fetcher or Fetcher()
+        # Get the availability from GBFS, scrape the website only if that fails
+        self.status = status or FallbackStatus(
+            GbfsStatus(self.GBFS, timeout=self.INFO_TIMEOUT),
+            ScraperStatus(self.STATIONS_PAGE, timeout=self.PAGE_TIMEOUT),
+        )
+        # url -> merged stations, reused while neither source changes
+        self._full_info = {}
+
+    def get_stations_basic_info(self, info_url):
+        """Generate a list of stations by using the json files provided by
+        BikeMi at https://bikemi.com/dati-aperti/"""
+        return self._fetch_basic_info(info_url).value
+
+    def _fetch_basic_info(self, info_url):
+        with METRICS.span("basic_info"):
+            return self.fetcher.get(
+                info_url,
+                lambda response: self.parse_station_information(response.json()),
+                self.INFO_TIMEOUT,
+            )
+
+    def _fetch_status(self):
+        with METRICS.span("status"):
+            return self.status.fetch(self.fetcher)
+
+    def parse_station_information(self, raw):
+        """Build the stations out of the decoded station_information.json"""
         # Pick the "stations" values inside the "data" key of the "raw" dict
-        stations = raw["data"]["stations"]
-        for element in stations:
-            del element["name"]
-        # Each station is a dictionary inside the list called "stations"
-        return json.dumps(stations, indent=4)
+        stations = []
+        for element in raw["data"]["stations"]:
+            station = Station.from_dict(element)
+            # Availability sources with a title of their own override this one
+            station.title = station.name
+            station.name = None
+            stations.append(station)
+        return stations
 
-    def get_station_extra_info_json(self):
-        """Get further info (bike availability) by scraping the bikemi.com source"""
-        raw = requests.get("https://bikemi.com/stazioni").text
-        placeholder = '"stationMapPage","slug":null},'
-        start = raw.find(placeholder) + len(placeholder)
-        end = raw.find('},"baseUrl":"https://bikemi.com"')
-        station_extra_info_raw = "{" + (raw[start:end])
-        # Each station is a string inside the list called "station_list"
-        station_list = []
-        jsontxt = json.loads(station_extra_info_raw)
-        for element in jsontxt:
-            station_info = {
-                "station_id": jsontxt[element]["id"],
-                "name": jsontxt[element]["name"],
-                "title": jsontxt[element]["title"],
-                "bike": jsontxt[element]["availabilityInfo"][
-                    "availableVehicleCategories"
-                ][0]["count"],
-                "ebike": jsontxt[element]["availabilityInfo"][
-                    "availableVehicleCategories"
-                ][1]["count"],
-                "ebike_with_childseat": jsontxt[element]["availabilityInfo"][
-                    "availableVehicleCategories"
-                ][2]["count"],
-                "availableDocks": jsontxt[element]["availabilityInfo"][
-                    "availableDocks"
-                ],
-                "availableVirtualDocks": jsontxt[element]["availabilityInfo"][
-                    "availableVirtualDocks"
-                ],
-                "availablePhysicalDocks": jsontxt[element]["availabilityInfo"][
-                    "availablePhysicalDocks"
-                ],
-            }
-            station_list.append(station_info)
-
-        # Return a list containing all the stations, stored as dictionaries
-        return json.dumps(station_list, indent=4)
+    def get_station_extra_info(self):
+        """Get further info (bike availability) from the GBFS station_status feed,
+        or by scraping the bikemi.com source"""
+        return self.status.fetch(self.fetcher).value
 
-    def get_station_full_info_json(self, url):
-        """Merge basic info from the Open Data with the extra info
-        scraped from the website.
-        Note: both input files have to be in json format"""
-        get_stations_basic_info = self.json_decoder(url)
-        stations_extra_info = self.get_station_extra_info_json()
-        get_stations_basic_info_sorted = sorted(
-            json.loads(get_stations_basic_info), key=itemgetter("station_id")
-        )
-        stations_extra_info_sorted = sorted(
-            json.loads(stations_extra_info), key=itemgetter("station_id")
-        )
-        stations_full_info = [
-            a | b
-            for (a, b) in zip(
-                stations_extra_info_sorted, get_stations_basic_info_sorted
+    def parse_stations_page(self, raw):
+        """Build the stations out of the json embedded in the bikemi.com/stazioni page"""
+        return parse_stations_page(raw)
+
+    def join_stations(self, stations_basic_info, stations_extra_info, how=INNER):
+        """Join basic info from the Open Data with the availability info by
+        station_id. The JoinResult also lists the stations found in only one
+        of the two sources"""
+        return hash_join(stations_basic_info, stations_extra_info, how)
+
+    def merge_stations(self, stations_basic_info, stations_extra_info, how=INNER):
+        """Merge basic info from the Open Data with the availability info"""
+        result = self.join_stations(stations_basic_info, stations_extra_info, how)
+        if not result.complete:
+            logger.warning(
+                "Stations missing from the availability: %s, from the Open Data: %s",
+                result.left_only,
+                result.right_only,
+            )
+        return result.rows
+
+    def get_station_full_info(self, url):
+        """Get the stations with both the Open Data and the availability info,
+        fetching the two sources concurrently"""
+        with METRICS.span("fetch"):
+            basic, extra = self.fetcher.map(
+                [lambda: self._fetch_basic_info(url), self._fetch_status]
             )
-        ]
+        if basic.changed or extra.changed or url not in self._full_info:
+            with METRICS.span("merge"):
+                self._full_info[url] = self.merge_stations(basic.value, extra.value)
+        return self._full_info[url]
 
-        return json.dumps(stations_full_info, indent=4)
+    def get_served_stations(self, url):
+        """Get the stations from the /stations endpoint of a StationServer,
+        e.g. "http://127.0.0.1:8080/stations", instead of upstream"""
+        return self.fetcher.get(
+            url,
+            lambda response: [Station.from_dict(s) for s in response.json()],
+            self.INFO_TIMEOUT,
+        ).value
+
+    # json wrappers, kept for compatibility
+
+    def to_json(self, stations):
+        """Serialise a list of stations"""
+        return json.dumps([station.to_dict() for station in stations], indent=4)
+
+    def json_decoder(self, info_url):
+        """Same as get_stations_basic_info, serialised to json"""
+        return self.to_json(self.get_stations_basic_info(info_url))
+
+    def get_station_extra_info_json(self):
+        """Same as get_station_extra_info, serialised to json"""
+        return self.to_json(self.get_station_extra_info())
+
+    def get_station_full_info_json(self, url):
+        """Same as get_station_full_info, serialised to json"""
+        return self.to_json(self.get_station_full_info(url))
 
     def find_station(self, stations, user_input):
         """Search and yield stations by typing their names or their unique IDs,
-        it's meant to be used with
-        https://gbfs.urbansharing.com/bikemi.com/station_information.json"""
-        # Remove accents, all the spaces and special chars from the input
-        user_input_edit = re.sub("[^A-Za-z0-9]+", "", unidecode.unidecode(user_input))
-        found_station_list = []
-
-        for station in stations:
-            # Temporarily treat the station names like user_input
-            station_edit = re.sub(
-                "[^A-Za-z0-9]+", "", unidecode.unidecode(station["title"])
-            )
-            # Check if user_input and stations match
-            if user_input_edit != ("") and (
-                re.search(user_input_edit, station_edit, re.IGNORECASE)
-                or re.search(user_input, station["station_id"], re.IGNORECASE)
-            ):
-                found_station_list.append(station)
-            else:
-                found_station_list.append(0)
-
-        if not any(found_station_list):
+        best matches first, it's meant to be used with
+        https://gbfs.urbansharing.com/bikemi.com/station_information.json
+        Note: when searching the same stations many times, build a SearchIndex
+        once and use its search() method instead"""
+        found_station_list = SearchIndex(stations).search(user_input, k=None)
+        if not found_station_list:
             yield None
-        if any(found_station_list):
-            for element in found_station_list:
-                if element != 0:
-                    yield element
+        yield from found_station_list
 
     def sort(self, stations, key):
         """Sort all the stations by chosen key"""
         return sorted(stations, key=itemgetter(key))
 
-    def get_nearest_station(self, stations_full_info, lat, lon):
-        """Get the nearest station given latitude and longitude"""
-        distances = []
-        for station in stations_full_info:
-            coord_input = (lat, lon)
-            coord_stations = (station["lat"], station["lon"])
-            distances.append(distance.distance(coord_input, coord_stations).kilometers)
-
-        smallest = min(distances)  # Get smallest distance
-        # Get index of the specified element in the list
-        # Note: index of the smallest distance = index of
-        # said station in "stations_full_info" list
-        index = distances.index(smallest)
-        return stations_full_info[index]
+    def get_nearest_station(self, stations_full_info, lat, lon, available=None):
+        """Get the nearest station given latitude and longitude, optionally
+        with at least the "available" {field: minimum} counts, e.g.
+        {"availableDocks": 1}; None if no station has them.
+        Note: when querying the same stations many times, build a SpatialIndex
+        once and use its nearest() and within() methods instead"""
+        found = SpatialIndex(stations_full_info).nearest(lat, lon, available=available)
+        return found[0][0] if found else None
@@ -0,0 +1,103 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StationDelta:
+    """What changed between two snapshots: the stations added, the station_ids
+    removed and, for the stations in both, the {field: (old, new)} changes"""
+
+    __slots__ = ("previous_version", "version", "added", "removed", "changed")
+
+    def __init__(self, previous_version, version, added, removed, changed):
+        self.previous_version = previous_version
+        self.version = version
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    @property
+    def moved(self):
+        """True when the stations' set or coordinates changed"""
+        return bool(
+            self.added
+            or self.removed
+            or any("lat" in f or "lon" in f for f in self.changed.values())
+        )
+
+    def to_dict(self):
+        return {
+            "previous_version": self.previous_version,
+            "version": self.version,
+            "added": [station.to_dict() for station in self.added],
+            "removed": self.removed,
+            "changed": {
+                station_id: {field: new for field, (_, new) in fields.items()}
+                for station_id, fields in self.changed.items()
+            },
+        }
+
+
+def diff_stations(previous_by_id, stations, previous_version=0, version=0):
+    """Compare freshly fetched stations with the previous ones, by station_id.
+
+    Return the StationDelta and the list of stations to use from now on, where
+    the unchanged stations are the previous objects rather than the new ones.
+    """
+    added = []
+    changed = {}
+    records = []
+    seen = set()
+    for station in stations:
+        station_id = station.station_id
+        seen.add(station_id)
+        old = previous_by_id.get(station_id)
+        if old is None:
+            added.append(station)
+            records.append(station)
+            continue
+        fields = station.diff(old)
+        if fields:
+            changed[station_id] = fields
+            records.append(station)
+        else:
+            records.append(old)
+    removed = [station_id for station_id in previous_by_id if station_id not in seen]
+    delta = StationDelta(previous_version, version, added, removed, changed)
+    return delta, records
+
+
+class DeltaFeed:
+    """Event stream of the StationDelta between consecutive snapshots.
+
+    Subscribers are called, in the thread that refreshed the snapshot, with
+    each non-empty delta; they should hand heavy work off to another thread.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Call callback(delta) on every new delta, until unsubscribed"""
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not callback]
+
+    def publish(self, delta):
+        for callback in self._subscribers:
+            try:
+                callback(delta)
+            except Exception:
+                logger.exception("Delta subscriber %r failed", callback)
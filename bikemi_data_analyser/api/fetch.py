@@ -0,0 +1,167 @@
+from bikemi_data_analyser.api.metrics import METRICS, SIZE_BUCKETS
+
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+from urllib.request import url2pathname
+
+
+class FetchResult:
+    """Parsed body of a response; "changed" is False when the server answered
+    304 Not Modified and the value parsed the previous time was reused"""
+
+    __slots__ = ("url", "value", "changed")
+
+    def __init__(self, url, value, changed):
+        self.url = url
+        self.value = value
+        self.changed = changed
+
+
+class Fetcher:
+    """Upstream fetch layer.
+
+    Keeps a pooled keep-alive session for each host, sends conditional
+    requests with the ETag and Last-Modified got the last time, so that
+    unchanged feeds aren't parsed again, and retries with an exponential
+    backoff on connection errors, timeouts and server errors.
+
+    file:// urls are read from the disk, e.g. to replay local copies of the
+    feeds; their ETag is the file's size and modification time.
+
+    requests is only imported by the first fetch, so that a process starting
+    from a saved snapshot doesn't wait for it.
+    """
+
+    def __init__(self, timeout=10, retries=2, backoff=0.5, workers=4):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+        self._sessions = {}
+        # url -> (etag, last modified, parsed value)
+        self._validators = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def get(self, url, parse, timeout=None):
+        """Fetch "url" and return a FetchResult with parse(response) as value"""
+        headers = {}
+        cached = self._validators.get(url)
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = self._request(url, headers, timeout or self.timeout)
+        if response.status_code == 304 and cached is not None:
+            return FetchResult(url, cached[2], False)
+        response.raise_for_status()
+
+        value = parse(response)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self._validators[url] = (etag, last_modified, value)
+        else:
+            self._validators.pop(url, None)
+        return FetchResult(url, value, True)
+
+    def get_many(self, calls):
+        """Run the get() calls, given as (url, parse, timeout) tuples, concurrently
+        and return their results in the same order"""
+        return self.map([lambda call=call: self.get(*call) for call in calls])
+
+    def map(self, functions):
+        """Run the functions, which take no arguments, concurrently and return
+        their results in the same order"""
+        futures = [self._executor().submit(function) for function in functions]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _request(self, url, headers, timeout):
+        import requests
+
+        if url.startswith("file:"):
+            return self._read_file(url, headers)
+        session = self._session(url)
+        labels = (("host", urlsplit(url).netloc),)
+        for attempt in range(self.retries + 1):
+            try:
+                response = session.get(url, headers=headers, timeout=timeout)
+                if response.status_code >= 500:
+                    raise requests.HTTPError(
+                        "{} Server Error for url: {}".format(response.status_code, url),
+                        response=response,
+                    )
+                if response.status_code == 304:
+                    METRICS.inc("bikemi_upstream_not_modified_total", labels)
+                else:
+                    METRICS.observe(
+                        "bikemi_upstream_response_bytes",
+                        len(response.content),
+                        labels,
+                        SIZE_BUCKETS,
+                    )
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+                METRICS.inc("bikemi_upstream_errors_total", labels)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+
+    def _read_file(self, url, headers):
+        import requests
+
+        path = url2pathname(unquote(urlsplit(url).path))
+        response = requests.Response()
+        response.url = url
+        response.encoding = "utf-8"
+        stat = os.stat(path)
+        etag = '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+        response.headers["ETag"] = etag
+        if headers.get("If-None-Match") == etag:
+            response.status_code = 304
+            response._content = b""
+            return response
+        with open(path, "rb") as f:
+            response._content = f.read()
+        response.status_code = 200
+        return response
+
+    def _session(self, url):
+        import requests
+
+        from requests.adapters import HTTPAdapter
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="bikemi-fetch"
+                )
+            return self._pool
@@ -0,0 +1,162 @@
+from bikemi_data_analyser.api.search import SearchIndex
+from bikemi_data_analyser.api.snapshot import Snapshot
+from bikemi_data_analyser.api.spatial import SpatialIndex
+from bikemi_data_analyser.api.station import Station
+
+import json
+import math
+import mmap
+import os
+import time
+
+import numpy as np
+
+MAGIC = b"BKMIIMG1"
+# Arrays start at multiples of this many bytes, so they can be mapped as they are
+ALIGN = 64
+# Missing values of the integer fields
+MISSING = np.iinfo(np.int64).min
+
+
+def save_image(path, snapshot, extra=None):
+    """Write a snapshot and its indexes to a single file at "path", along
+    with "extra", anything that can be dumped as json, e.g. other caches.
+
+    The file is a json header with the strings, followed by the numbers as
+    aligned arrays: load_image() maps them back instead of parsing them, so
+    a process can answer from the image as soon as it starts. The file is
+    replaced atomically.
+    """
+    header = {
+        "version": snapshot.version,
+        # Wall clock time, unlike fetched_at, which is only valid in this process
+        "fetched": time.time() - snapshot.age(),
+        "cell_size": snapshot.spatial.cell_size,
+        "fields": {},
+        "extra": extra,
+    }
+    arrays = {}
+    stations = snapshot.stations
+    for field in Station.FIELDS:
+        values = [getattr(station, field) for station in stations]
+        kind = _kind(values)
+        if kind is int:
+            arrays["station." + field] = np.array(
+                [MISSING if value is None else value for value in values], np.int64
+            )
+        elif kind is float:
+            arrays["station." + field] = np.array(
+                [math.nan if value is None else value for value in values], float
+            )
+        else:
+            header["fields"][field] = values
+    if any(station.extra for station in stations):
+        header["fields"]["extra"] = [station.extra for station in stations]
+    header["spatial"], spatial = snapshot.spatial.to_arrays()
+    for name, array in spatial.items():
+        arrays["spatial." + name] = array
+    header["search"], search = snapshot.search.to_arrays()
+    for name, array in search.items():
+        arrays["search." + name] = array
+
+    header["arrays"] = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = arrays[name] = np.ascontiguousarray(array)
+        header["arrays"][name] = (offset, array.dtype.str, array.shape)
+        offset = _aligned(offset + array.nbytes)
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        start = _aligned(f.tell())
+        for name, array in arrays.items():
+            f.seek(start + header["arrays"][name][0])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(temporary, path)
+
+
+def load_image(path):
+    """Map back the image written by save_image() at "path" and return the
+    snapshot and the "extra" saved with it. The snapshot's arrays are
+    read-only views of the file. Raise ValueError if it isn't an image"""
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a stations image: {}".format(path))
+    length = int.from_bytes(buffer[len(MAGIC) : len(MAGIC) + 8], "little")
+    first = len(MAGIC) + 8
+    header = json.loads(buffer[first : first + length])
+    start = _aligned(first + length)
+    arrays = {
+        name: np.frombuffer(
+            buffer, dtype, count=math.prod(shape), offset=start + offset
+        ).reshape(shape)
+        for name, (offset, dtype, shape) in header["arrays"].items()
+    }
+
+    columns = dict(header["fields"])
+    for field in Station.FIELDS:
+        array = arrays.get("station." + field)
+        if array is None:
+            continue
+        if array.dtype == np.int64:
+            columns[field] = [
+                None if value == MISSING else value for value in array.tolist()
+            ]
+        else:
+            columns[field] = [
+                None if value != value else value for value in array.tolist()
+            ]
+    count = len(columns[Station.FIELDS[0]])
+    extras = columns.pop("extra", None) or [None] * count
+    stations = []
+    for values in zip(*(columns[field] for field in Station.FIELDS), extras):
+        station = Station.__new__(Station)
+        for field, value in zip(Station.__slots__, values):
+            setattr(station, field, value)
+        stations.append(station)
+
+    spatial = SpatialIndex.from_arrays(
+        {station.station_id: station for station in stations},
+        header["spatial"],
+        {
+            name[len("spatial.") :]: array
+            for name, array in arrays.items()
+            if name.startswith("spatial.")
+        },
+        header["cell_size"],
+    )
+    search = SearchIndex.from_arrays(
+        stations,
+        header["search"],
+        {
+            name[len("search.") :]: array
+            for name, array in arrays.items()
+            if name.startswith("search.")
+        },
+    )
+    fetched_at = time.monotonic() - (time.time() - header["fetched"])
+    snapshot = Snapshot.restore(
+        header["version"], stations, fetched_at, search, spatial
+    )
+    return snapshot, header["extra"]
+
+
+def _kind(values):
+    """Return int or float when all the values fit in an array of them"""
+    present = [value for value in values if value is not None]
+    if all(type(value) is int for value in present):
+        return int
+    if all(type(value) in (int, float) for value in present):
+        return float
+    return None
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
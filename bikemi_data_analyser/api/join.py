@@ -0,0 +1,58 @@
+from operator import attrgetter
+
+INNER = "inner"
+LEFT = "left"
+OUTER = "outer"
+
+
+class JoinResult:
+    """Rows produced by a join, along with the keys found only on one side"""
+
+    __slots__ = ("rows", "left_only", "right_only")
+
+    def __init__(self, rows, left_only, right_only):
+        self.rows = rows
+        self.left_only = left_only
+        self.right_only = right_only
+
+    @property
+    def complete(self):
+        """True when every key was found on both sides"""
+        return not self.left_only and not self.right_only
+
+
+def hash_join(left, right, how=INNER, key=attrgetter("station_id"), combine=None):
+    """Join two sequences of records on "key" in linear time.
+
+    Rows sharing the same key are merged with combine(left_row, right_row),
+    by default left_row.merge(right_row). "how" picks what happens to the
+    unmatched rows: INNER drops them, LEFT keeps the ones from "left" and
+    OUTER keeps both, the ones from "right" being appended at the end.
+    Keys are supposed to be unique on each side.
+    """
+    if how not in (INNER, LEFT, OUTER):
+        raise ValueError("Unknown join: {!r}".format(how))
+    if combine is None:
+        combine = _merge
+
+    unmatched = {key(row): row for row in right}
+    rows = []
+    left_only = []
+    for row in left:
+        row_key = key(row)
+        other = unmatched.pop(row_key, None)
+        if other is None:
+            left_only.append(row_key)
+            if how != INNER:
+                rows.append(row)
+        else:
+            rows.append(combine(row, other))
+
+    right_only = list(unmatched)
+    if how == OUTER:
+        rows.extend(unmatched.values())
+    return JoinResult(rows, left_only, right_only)
+
+
+def _merge(left_row, right_row):
+    return left_row.merge(right_row)
@@ -0,0 +1,476 @@
+import functools
+import logging
+import sys
+import threading
+
+from collections import Counter, deque
+from itertools import chain, repeat
+from time import perf_counter
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds and in bytes
+LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = tuple(1024 * 4**i for i in range(8))
+# Share of the time of the stages and handlers that timing them may cost:
+# the ones that take less than the cost of a timing / BUDGET are only timed
+# once every few runs, see Histogram.record()
+BUDGET = 0.0002
+# Runs a sample stands for, at most
+MAX_EVERY = 256
+# Gate of the histograms while nothing is recorded: every run is skipped
+SKIP = repeat(True)
+
+HELP = {
+    "bikemi_span_seconds": ("histogram", "Time spent in each stage"),
+    "bikemi_handler_seconds": ("histogram", "Latency of the bot handlers"),
+    "bikemi_handler_errors_total": ("counter", "Bot handlers that raised"),
+    "bikemi_upstream_response_bytes": ("histogram", "Size of the upstream bodies"),
+    "bikemi_upstream_not_modified_total": ("counter", "Upstream 304 responses"),
+    "bikemi_upstream_errors_total": ("counter", "Failed upstream requests"),
+}
+
+
+class Histogram:
+    """Values are appended to a deque, which needs no lock, and only counted
+    in the buckets, all at once, when "fold" of them piled up or the
+    histogram is exported.
+
+    The timings are sampled: next(gate) is False for the runs to time, one
+    every "every", and each value recorded counts for that many runs. A
+    value of "elapsed" seconds sets "every" to what keeps the cost of
+    timing below BUDGET of the runs like it, so the stages taking
+    milliseconds are all timed, and the ones taking microseconds only once
+    in a while.
+    """
+
+    # Seconds under which the runs are sampled, set by Metrics.enable()
+    threshold = 0.0
+
+    __slots__ = (
+        "buckets",
+        "counts",
+        "sum",
+        "count",
+        "pending",
+        "fold",
+        "every",
+        "gate",
+        "_lock",
+    )
+
+    def __init__(self, buckets, fold=4096, enabled=False):
+        self.buckets = buckets
+        self.every = 1
+        # The last one counts the values above every bucket
+        self.counts = np.zeros(len(buckets) + 1, np.int64)
+        self.sum = 0.0
+        self.count = 0
+        # (value, runs it counts for) tuples
+        self.pending = deque()
+        self.fold = fold
+        self.open(enabled)
+        self._lock = threading.Lock()
+
+    def open(self, enabled=True):
+        """Start timing the runs again, as often as before, or stop"""
+        self.gate = _gate(self.every) if enabled else SKIP
+
+    def add(self, value, weight=1):
+        self.pending.append((value, weight))
+        if len(self.pending) > self.fold:
+            self.collapse()
+
+    def record(self, elapsed):
+        """Add the timing of a run let through by the gate, and pick how
+        many runs the next one will stand for"""
+        every = self.every
+        self.pending.append((elapsed, every))
+        if len(self.pending) > self.fold:
+            self.collapse()
+        runs = int(self.threshold / elapsed) if elapsed > 0 else MAX_EVERY
+        # Rounded down to a power of two, so that the gate is seldom replaced
+        following = min(1 << (runs.bit_length() - 1), MAX_EVERY) if runs else 1
+        if following != every:
+            self.every = following
+            # Unless metrics were disabled in the meantime
+            if self.gate is not SKIP:
+                self.gate = _gate(following)
+
+    def collapse(self):
+        """Count the pending values in the buckets"""
+        with self._lock:
+            pending = self.pending
+            items = [pending.popleft() for _ in range(len(pending))]
+            if not items:
+                return
+            values, weights = zip(*items)
+            self.counts += np.bincount(
+                np.searchsorted(self.buckets, values),
+                weights,
+                minlength=len(self.counts),
+            ).astype(np.int64)
+            self.sum += float(np.dot(values, weights))
+            self.count += sum(weights)
+
+    def reset(self):
+        with self._lock:
+            self.pending.clear()
+            self.counts[:] = 0
+            self.sum = 0.0
+            self.count = 0
+
+
+class Metrics:
+    """Process-wide counters and histograms, exported in the Prometheus text
+    format by render().
+
+    Nothing is recorded until enable() is called: span() and timed() then
+    cost a couple of perf_counter() calls and a deque append, on the runs
+    their histograms sample, and a next() on the others. Components
+    that already count things, like the SnapshotStore or the GeocodeCache,
+    are added with collect() and their stats() are read at export time.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # (name, labels) -> Histogram or count
+        self._histograms = {}
+        self._counters = {}
+        # stage -> Histogram of bikemi_span_seconds
+        self._spans = {}
+        # prefix -> stats() function
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        if enabled and not Histogram.threshold:
+            Histogram.threshold = _timing_cost() / BUDGET
+        with self._lock:
+            self.enabled = enabled
+            for histogram in self._histograms.values():
+                histogram.open(enabled)
+
+    def histogram(self, name, labels=(), buckets=LATENCY_BUCKETS):
+        """Return the histogram "name" with the (key, value) "labels" """
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(
+                        buckets, enabled=self.enabled
+                    )
+        return histogram
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        if self.enabled:
+            self.histogram(name, labels, buckets).add(value)
+
+    def inc(self, name, labels=(), value=1):
+        if not self.enabled:
+            return
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def span(self, stage):
+        """Context manager timing a stage in bikemi_span_seconds. Like in
+        timed(), the runs that aren't sampled cost the same whether metrics
+        are enabled or not"""
+        histogram = self._spans.get(stage)
+        if histogram is None:
+            histogram = self._spans[stage] = self.histogram(
+                "bikemi_span_seconds", (("stage", stage),)
+            )
+        if next(histogram.gate):
+            return NO_SPAN
+        return Span(histogram)
+
+    def timed(self, handler):
+        """Decorator timing a bot handler in bikemi_handler_seconds, and
+        counting the times it raised. The runs the histogram doesn't sample
+        go through the same next(gate) whether metrics are enabled or not"""
+        labels = (("handler", handler),)
+        histogram = self.histogram("bikemi_handler_seconds", labels)
+
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if next(histogram.gate):
+                    try:
+                        return function(*args, **kwargs)
+                    except Exception:
+                        self.inc("bikemi_handler_errors_total", labels)
+                        raise
+                start = perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                except Exception:
+                    self.inc("bikemi_handler_errors_total", labels)
+                    raise
+                finally:
+                    histogram.record(perf_counter() - start)
+
+            return wrapper
+
+        return decorate
+
+    def collect(self, prefix, stats):
+        """Export the numbers returned by stats() as bikemi_<prefix>_<key> gauges"""
+        self._collectors[prefix] = stats
+
+    def reset(self):
+        with self._lock:
+            for histogram in self._histograms.values():
+                histogram.reset()
+            self._counters = {}
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        for key, histogram in histograms.items():
+            histogram.collapse()
+            histograms[key] = (
+                histogram.counts.tolist(),
+                histogram.sum,
+                histogram.count,
+                histogram.buckets,
+            )
+        lines = []
+        seen = set()
+
+        def header(name, kind=None, text=None):
+            if name not in seen:
+                seen.add(name)
+                kind, text = HELP.get(name, (kind, text))
+                lines.append("# HELP {} {}".format(name, text))
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter", name)
+            lines.append("{}{} {}".format(name, _labels(labels), value))
+        for (name, labels), (counts, total, count, buckets) in sorted(
+            histograms.items()
+        ):
+            header(name, "histogram", name)
+            cumulative = 0
+            for bound, bucket in zip(buckets + (float("inf"),), counts):
+                cumulative += bucket
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        name, _labels(labels + (("le", _number(bound)),)), cumulative
+                    )
+                )
+            lines.append("{}_sum{} {}".format(name, _labels(labels), _number(total)))
+            lines.append("{}_count{} {}".format(name, _labels(labels), count))
+        for prefix, stats in sorted(self._collectors.items()):
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("Couldn't collect the %s stats", prefix)
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = "bikemi_{}_{}".format(prefix, key)
+                header(name, "gauge", "{} {}".format(prefix, key))
+                lines.append("{} {}".format(name, _number(value)))
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(perf_counter() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_SPAN = _NoSpan()
+# Shared by the whole process
+METRICS = Metrics()
+
+
+class SamplingProfiler:
+    """Opt-in statistical profiler: a thread samples the stack of every other
+    thread each "interval" seconds and counts them, folded as
+    "outer;inner;innermost" lines, the input of flame graph tools"""
+
+    def __init__(self, interval=0.01, depth=64):
+        self.interval = interval
+        self.depth = depth
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def folded(self, reset=False):
+        """Return the samples as folded stacks, most frequent first"""
+        with self._lock:
+            samples = self.samples
+            if reset:
+                self.samples = Counter()
+        return "".join(
+            "{} {}\n".format(stack, count) for stack, count in samples.most_common()
+        )
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.depth:
+                    code = frame.f_code
+                    names.append(
+                        "{}:{}".format(
+                            code.co_filename.rsplit("/", 1)[-1], code.co_name
+                        )
+                    )
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(names)))
+            with self._lock:
+                self.samples.update(stacks)
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving GET /metrics and, with a profiler,
+    GET /profile (add ?reset=1 to start the samples over)"""
+
+    def __init__(self, metrics=METRICS, host="127.0.0.1", port=9108, profiler=None):
+        # Only imported when metrics are served, every process imports this module
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.metrics = metrics
+        self.profiler = profiler
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/metrics":
+                    body = server.metrics.render()
+                    content_type = "text/plain; version=0.0.4"
+                elif url.path == "/profile" and server.profiler is not None:
+                    reset = parse_qs(url.query).get("reset") == ["1"]
+                    body = server.profiler.folded(reset)
+                    content_type = "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _timing_cost(runs=1000):
+    """Return the seconds it takes to time a span, on this machine"""
+    histogram = Histogram(LATENCY_BUCKETS, enabled=True)
+    best = float("inf")
+    for _ in range(3):
+        start = perf_counter()
+        for _ in range(runs):
+            with Span(histogram):
+                pass
+        best = min(best, (perf_counter() - start) / runs)
+        histogram.reset()
+    return best
+
+
+def _gate(every):
+    """Return an endless iterator, False once every "every" items"""
+    # Unlike cycle(), it doesn't copy the items the first time round
+    return chain.from_iterable(repeat((True,) * (every - 1) + (False,)))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
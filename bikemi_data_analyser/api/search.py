@@ -0,0 +1,206 @@
+import re
+import unidecode
+
+from collections import Counter
+
+import numpy as np
+
+NON_ALPHANUMERIC = re.compile("[^a-z0-9]+")
+
+
+def normalise(text):
+    """Remove accents, case, all the spaces and special chars from the text"""
+    return NON_ALPHANUMERIC.sub("", unidecode.unidecode(text).lower())
+
+
+def trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def swaps(text):
+    """The texts with two adjacent chars of "text" swapped"""
+    return {
+        text[:i] + text[i + 1] + text[i] + text[i + 2 :]
+        for i in range(len(text) - 1)
+        if text[i] != text[i + 1]
+    }
+
+
+class SearchIndex:
+    """Text index over the station titles, meant to be built once per snapshot.
+
+    Titles are normalised up front and split in trigrams, so a query only
+    scores the stations sharing at least a trigram with it instead of
+    scanning all of them. Queries shorter than a trigram use an index of
+    every one and two chars substring instead. Everything is keyed by
+    station_id, so that updated() can patch the index of a new snapshot.
+    """
+
+    # Trigrams a typo can break, and a swap of two adjacent chars
+    TYPO_COST = 3
+    SWAP_COST = 4
+
+    def __init__(self, stations):
+        # station_id -> station and normalised title
+        self._stations = {}
+        self._titles = {}
+        # Trigram or short substring -> station_ids
+        self._grams = {}
+        self._short = {}
+        self._owned = None
+        for station in stations:
+            self._add(station)
+
+    @property
+    def stations(self):
+        return list(self._stations.values())
+
+    def updated(self, delta, stations_by_id):
+        """Return a new index for the stations of a snapshot, given the
+        StationDelta from the ones of this index. Only the postings of the
+        added, removed and renamed stations are copied and changed, the
+        rest is shared with this index"""
+        index = SearchIndex.__new__(SearchIndex)
+        index._stations = dict(self._stations)
+        index._titles = dict(self._titles)
+        index._grams = dict(self._grams)
+        index._short = dict(self._short)
+        index._owned = set()
+        for station_id in delta.removed:
+            index._remove(station_id)
+        for station_id, fields in delta.changed.items():
+            if "title" in fields:
+                index._remove(station_id)
+                index._add(stations_by_id[station_id])
+            else:
+                index._stations[station_id] = stations_by_id[station_id]
+        for station in delta.added:
+            index._add(station)
+        index._owned = None
+        return index
+
+    def to_arrays(self):
+        """Return the station_ids, their normalised titles and the keys of the
+        postings, which can be dumped as json, and the postings themselves as
+        flat arrays of positions in the station_ids; see from_arrays()"""
+        ids = list(self._stations)
+        positions = {station_id: i for i, station_id in enumerate(ids)}
+        keys = {"ids": ids, "titles": [self._titles[i] for i in ids]}
+        arrays = {}
+        for name, postings in (("grams", self._grams), ("short", self._short)):
+            items = [(key, posting) for key, posting in postings.items() if posting]
+            keys[name] = [key for key, _ in items]
+            arrays[name + "_offsets"] = np.cumsum([0] + [len(p) for _, p in items])
+            arrays[name + "_members"] = np.fromiter(
+                (positions[i] for _, posting in items for i in posting), np.int32
+            )
+        return keys, arrays
+
+    @classmethod
+    def from_arrays(cls, stations, keys, arrays):
+        """Rebuild the index to_arrays() was called on, given its stations,
+        without normalising and splitting the titles again"""
+        by_id = {str(station["station_id"]): station for station in stations}
+        ids = keys["ids"]
+        index = cls.__new__(cls)
+        index._stations = {station_id: by_id[station_id] for station_id in ids}
+        index._titles = dict(zip(ids, keys["titles"]))
+        index._owned = None
+        for name in ("grams", "short"):
+            offsets = arrays[name + "_offsets"].tolist()
+            members = [ids[i] for i in arrays[name + "_members"].tolist()]
+            postings = {
+                key: set(members[offsets[i] : offsets[i + 1]])
+                for i, key in enumerate(keys[name])
+            }
+            setattr(index, "_" + name, postings)
+        return index
+
+    def get(self, station_id):
+        """Return the station with the given ID, or None"""
+        return self._stations.get(str(station_id).strip())
+
+    def search(self, query, k=10):
+        """Return up to "k" stations (all of them if k is None) matching the
+        query, best first. The query is matched against the station IDs and,
+        tolerating a typo every few chars or two swapped chars, against
+        their titles"""
+        text = normalise(query)
+        if not text:
+            return []
+        scores = {}
+
+        if len(text) < 3:
+            for station_id in self._short.get(text, ()):
+                scores[station_id] = 1.0
+        else:
+            grams = trigrams(text)
+            # Let a typo every 5 chars break a few trigrams of the query
+            typos = len(text) // 5
+            required = max(1, len(grams) - self.TYPO_COST * typos)
+            # A swap breaks one more trigram: the titles short of just that
+            # match if they contain the query with two chars swapped back
+            short = max(1, required - (self.SWAP_COST - self.TYPO_COST))
+            variants = None
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._grams.get(gram, ()))
+            for station_id, count in shared.items():
+                if count < required:
+                    if count < short or not typos:
+                        continue
+                    if variants is None:
+                        variants = swaps(text)
+                    title = self._titles[station_id]
+                    if not any(variant in title for variant in variants):
+                        continue
+                scores[station_id] = count / len(grams)
+
+        for station_id in scores:
+            title = self._titles[station_id]
+            if text in title:
+                # Exact substrings always rank above the fuzzy matches
+                scores[station_id] += 1.0 + (0.5 if title.startswith(text) else 0.0)
+
+        if query.strip() in self._stations:
+            scores[query.strip()] = 3.0
+
+        ranked = sorted(
+            scores,
+            key=lambda i: (-scores[i], len(self._titles[i]), self._titles[i], i),
+        )
+        if k is not None:
+            ranked = ranked[:k]
+        return [self._stations[station_id] for station_id in ranked]
+
+    def _add(self, station):
+        station_id = str(station["station_id"])
+        title = normalise(station.get("title", ""))
+        self._stations[station_id] = station
+        self._titles[station_id] = title
+        for gram in trigrams(title):
+            self._posting(self._grams, gram).add(station_id)
+        for size in (1, 2):
+            for i in range(len(title) - size + 1):
+                self._posting(self._short, title[i : i + size]).add(station_id)
+
+    def _remove(self, station_id):
+        del self._stations[station_id]
+        title = self._titles.pop(station_id)
+        for gram in trigrams(title):
+            self._posting(self._grams, gram).discard(station_id)
+        for size in (1, 2):
+            for i in range(len(title) - size + 1):
+                self._posting(self._short, title[i : i + size]).discard(station_id)
+
+    def _posting(self, postings, key):
+        """Return the station_ids for "key", copied first when they're still
+        shared with the index this one was updated from"""
+        posting = postings.get(key)
+        if posting is None:
+            posting = postings[key] = set()
+        elif self._owned is not None and (id(postings), key) not in self._owned:
+            posting = postings[key] = set(posting)
+        if self._owned is not None:
+            self._owned.add((id(postings), key))
+        return posting
@@ -0,0 +1,357 @@
+from bikemi_data_analyser.api.delta import StationDelta, diff_stations
+from bikemi_data_analyser.api.search import normalise
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    410: "Gone",
+    503: "Service Unavailable",
+}
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN = 1024
+# Longest request or header line, and most header lines, of a request
+MAX_LINE = 8192
+MAX_HEADERS = 100
+
+
+class Payload:
+    """A json response serialised once: the body, its gzipped copy and the
+    ETag of each, as they're different representations"""
+
+    __slots__ = ("status", "body", "gzipped", "etag", "gzipped_etag")
+
+    def __init__(self, data, status=200):
+        self.status = status
+        self.body = json.dumps(data, separators=(",", ":")).encode()
+        self.gzipped = (
+            gzip.compress(self.body, compresslevel=6)
+            if len(self.body) >= GZIP_MIN
+            else None
+        )
+        tag = hashlib.blake2b(self.body, digest_size=12).hexdigest()
+        self.etag = '"{}"'.format(tag)
+        self.gzipped_etag = '"{}-gz"'.format(tag)
+
+    def representation(self, gzipped):
+        """The body and ETag sent to a client accepting gzip or not"""
+        if gzipped and self.gzipped is not None:
+            return self.gzipped, self.gzipped_etag
+        return self.body, self.etag
+
+
+def error(status, message, **extra):
+    return Payload(dict(error=message, **extra), status)
+
+
+class Payloads:
+    """The payloads of a snapshot version, built the first time they're asked for.
+
+    The per-station ones of the stations a delta doesn't touch are kept for
+    the next version; searches, nearest queries and diffs are cached in a
+    "size" entries LRU, emptied at every version.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.version = None
+        self.stations = None
+        # station_id -> Payload
+        self._station = {}
+        # (endpoint, arguments) -> Payload
+        self._queries = OrderedDict()
+
+    def use(self, snapshot):
+        """Make the payloads follow the snapshot, if it's a new version"""
+        if snapshot.version == self.version:
+            return
+        delta = snapshot.delta
+        if self.version is not None and delta.previous_version == self.version:
+            for station_id in delta.removed:
+                self._station.pop(station_id, None)
+            for station_id in delta.changed:
+                self._station.pop(station_id, None)
+        else:
+            self._station = {}
+        self.stations = None
+        self._queries = OrderedDict()
+        self.version = snapshot.version
+
+    def all_stations(self, snapshot):
+        if self.stations is None:
+            self.stations = Payload(
+                [station.to_dict() for station in snapshot.stations]
+            )
+        return self.stations
+
+    def station(self, snapshot, station_id):
+        payload = self._station.get(station_id)
+        if payload is None:
+            station = snapshot.by_id.get(station_id)
+            if station is None:
+                return error(404, "No such station", station_id=station_id)
+            payload = self._station[station_id] = Payload(station.to_dict())
+        return payload
+
+    def query(self, key, build):
+        """Return the cached payload of "key", or build() it"""
+        payload = self._queries.get(key)
+        if payload is not None:
+            self._queries.move_to_end(key)
+            return payload
+        payload = self._queries[key] = build()
+        while len(self._queries) > self.size:
+            self._queries.popitem(last=False)
+        return payload
+
+
+class StationServer:
+    """Read-only HTTP/1.1 json service over the snapshots of a SnapshotStore.
+
+    GET /stations, /stations/{id}, /search?q=&k=, /nearest?lat=&lon=&k= and
+    /diff?since=<version>. Every payload is serialised once per snapshot
+    version and sent gzipped when the client accepts it; clients repeating
+    a request with If-None-Match get a bodiless 304. Responses carry the
+    snapshot version in X-Snapshot-Version: /diff answers with the changes
+    since any of the last "history" versions the server served.
+
+    The store should be refreshed in the background: serve() starts its
+    refresher, so handlers never wait for upstream.
+    """
+
+    def __init__(self, snapshots, history=64, cache_size=1024, max_k=100):
+        self.snapshots = snapshots
+        self.max_k = max_k
+        self.payloads = Payloads(cache_size)
+        # version -> snapshot, for /diff
+        self._history = OrderedDict()
+        self.history = history
+        self.routes = {
+            "stations": self.stations,
+            "search": self.search,
+            "nearest": self.nearest,
+            "diff": self.diff,
+        }
+        # Counters
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        """Fetch the first snapshot, start the refresher and serve until cancelled"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.snapshots.get)
+        self.snapshots.start()
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        logger.info("Serving the stations on %s:%s", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.snapshots.stop()
+
+    def snapshot(self):
+        snapshot = self.snapshots.get()
+        if snapshot.version not in self._history:
+            self._history[snapshot.version] = snapshot
+            while len(self._history) > self.history:
+                self._history.popitem(last=False)
+        self.payloads.use(snapshot)
+        return snapshot
+
+    async def handle(self, reader, writer):
+        """Answer the requests of a connection, keeping it alive if asked to"""
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ValueError as exception:
+                    writer.write(self.response(error(400, str(exception)), False))
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    if version == "HTTP/1.1"
+                    else headers.get("connection", "").lower() == "keep-alive"
+                )
+                writer.write(self.respond(method, target, headers, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Read the request line and the headers of the next request; return
+        (method, target, version, headers), None once the client is done, or
+        raise ValueError when they're malformed or too long"""
+        request = await self._read_line(reader)
+        if not request:
+            return None
+        try:
+            method, target, version = request.decode("ascii").split()
+        except ValueError:
+            raise ValueError("Malformed request")
+        headers = {}
+        for _ in range(MAX_HEADERS + 1):
+            line = await self._read_line(reader)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, colon, value = line.decode("latin-1").partition(":")
+            if not colon or not name or name != name.strip():
+                raise ValueError("Malformed header")
+            headers[name.lower()] = value.strip()
+        else:
+            raise ValueError("Too many headers")
+        return method, target, version, headers
+
+    async def _read_line(self, reader):
+        try:
+            line = await reader.readline()
+        except (asyncio.LimitOverrunError, ValueError):
+            raise ValueError("Line too long")
+        if len(line) > MAX_LINE:
+            raise ValueError("Line too long")
+        return line
+
+    def respond(self, method, target, headers, keep_alive=True):
+        """Return the raw response to a request"""
+        self.requests += 1
+        if method not in ("GET", "HEAD"):
+            payload = error(405, "Only GET and HEAD are supported")
+        else:
+            payload = self.route(target)
+        gzipped = "gzip" in headers.get("accept-encoding", "")
+        if payload.status >= 400:
+            self.errors += 1
+        elif payload.representation(gzipped)[1] in _etags(headers.get("if-none-match")):
+            self.not_modified += 1
+            return self.response(
+                payload, keep_alive, gzipped, not_modified=True, head=method == "HEAD"
+            )
+        return self.response(payload, keep_alive, gzipped, head=method == "HEAD")
+
+    def route(self, target):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        handler = self.routes.get(parts[0])
+        if handler is None:
+            return error(404, "No such endpoint")
+        try:
+            return handler(self.snapshot(), parts[1:], parse_qs(url.query))
+        except (KeyError, ValueError) as exception:
+            return error(400, "Invalid parameter: {}".format(exception))
+        except Exception:
+            logger.exception("Couldn't answer %s", target)
+            return error(503, "Stations unavailable")
+
+    def response(
+        self, payload, keep_alive=True, gzipped=False, not_modified=False, head=False
+    ):
+        status = 304 if not_modified else payload.status
+        body, etag = payload.representation(gzipped)
+        lines = [
+            "HTTP/1.1 {} {}".format(status, REASONS[status]),
+            "Content-Type: application/json",
+            "ETag: " + etag,
+            "Cache-Control: no-cache",
+            "Vary: Accept-Encoding",
+            "X-Snapshot-Version: {}".format(self.payloads.version or 0),
+            "Connection: " + ("keep-alive" if keep_alive else "close"),
+        ]
+        if not_modified:
+            body = b""
+        else:
+            if body is payload.gzipped:
+                lines.append("Content-Encoding: gzip")
+            lines.append("Content-Length: {}".format(len(body)))
+        header = "\r\n".join(lines).encode() + b"\r\n\r\n"
+        return header if head or not_modified else header + body
+
+    # Endpoints
+
+    def stations(self, snapshot, path, query):
+        if not path or path == [""]:
+            return self.payloads.all_stations(snapshot)
+        return self.payloads.station(snapshot, path[0])
+
+    def search(self, snapshot, path, query):
+        text = query["q"][0]
+        k = self._k(query, 10)
+        return self.payloads.query(
+            ("search", normalise(text), k),
+            lambda: Payload(
+                [station.to_dict() for station in snapshot.search.search(text, k=k)]
+            ),
+        )
+
+    def nearest(self, snapshot, path, query):
+        lat = float(query["lat"][0])
+        lon = float(query["lon"][0])
+        k = self._k(query, 1)
+        return self.payloads.query(
+            ("nearest", lat, lon, k),
+            lambda: Payload(
+                [
+                    {"station": station.to_dict(), "distance": round(distance, 1)}
+                    for station, distance in snapshot.spatial.nearest(lat, lon, k)
+                ]
+            ),
+        )
+
+    def diff(self, snapshot, path, query):
+        since = int(query["since"][0])
+        return self.payloads.query(("diff", since), lambda: self._diff(snapshot, since))
+
+    def _diff(self, snapshot, since):
+        if since == snapshot.version:
+            return Payload(StationDelta(since, since, [], [], {}).to_dict())
+        if since == snapshot.delta.previous_version:
+            return Payload(snapshot.delta.to_dict())
+        old = self._history.get(since)
+        if old is None:
+            return error(
+                410,
+                "Version too old, get /stations again",
+                version=snapshot.version,
+            )
+        delta, _ = diff_stations(old.by_id, snapshot.stations, since, snapshot.version)
+        return Payload(delta.to_dict())
+
+    def _k(self, query, default):
+        k = int(query.get("k", [default])[0])
+        if not 1 <= k <= self.max_k:
+            raise ValueError("k must be between 1 and {}".format(self.max_k))
+        return k
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "version": self.payloads.version,
+        }
+
+
+def _etags(header):
+    """The ETags listed in an If-None-Match header"""
+    if not header:
+        return ()
+    return {tag.strip().replace("W/", "", 1) for tag in header.split(",")}
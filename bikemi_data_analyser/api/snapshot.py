@@ -0,0 +1,258 @@
+from bikemi_data_analyser.api.delta import DeltaFeed, StationDelta, diff_stations
+from bikemi_data_analyser.api.metrics import METRICS
+from bikemi_data_analyser.api.search import SearchIndex
+from bikemi_data_analyser.api.spatial import SpatialIndex
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """Immutable view of all the stations pulled from upstream at a given time,
+    along with the indexes built on top of them.
+
+    When built from the "previous" snapshot, only the stations that changed
+    are new objects and the indexes are patched rather than rebuilt; "delta"
+    holds what changed. If nothing did, the version stays the same.
+    """
+
+    __slots__ = (
+        "version",
+        "stations",
+        "by_id",
+        "fetched_at",
+        "delta",
+        "search",
+        "spatial",
+    )
+
+    def __init__(self, version, stations, fetched_at, previous=None):
+        if previous is None:
+            stations = tuple(stations)
+            by_id = {station.station_id: station for station in stations}
+            delta = StationDelta(0, version, list(stations), [], {})
+            search = SearchIndex(stations)
+            spatial = SpatialIndex(stations)
+        else:
+            delta, records = diff_stations(
+                previous.by_id, stations, previous.version, version
+            )
+            if delta:
+                stations = tuple(records)
+                by_id = {station.station_id: station for station in stations}
+                search = previous.search.updated(delta, by_id)
+                spatial = previous.spatial.updated(delta, by_id)
+            else:
+                version = previous.version
+                stations = previous.stations
+                by_id = previous.by_id
+                delta = previous.delta
+                search = previous.search
+                spatial = previous.spatial
+
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "stations", stations)
+        object.__setattr__(self, "by_id", by_id)
+        object.__setattr__(self, "fetched_at", fetched_at)
+        object.__setattr__(self, "delta", delta)
+        object.__setattr__(self, "search", search)
+        object.__setattr__(self, "spatial", spatial)
+
+    @classmethod
+    def restore(cls, version, stations, fetched_at, search, spatial):
+        """Return a snapshot of "stations" with the indexes already built for
+        them, e.g. mapped back from an image; its delta adds every station"""
+        snapshot = cls.__new__(cls)
+        stations = tuple(stations)
+        values = {
+            "version": version,
+            "stations": stations,
+            "by_id": {station.station_id: station for station in stations},
+            "fetched_at": fetched_at,
+            "delta": StationDelta(0, version, list(stations), [], {}),
+            "search": search,
+            "spatial": spatial,
+        }
+        for name, value in values.items():
+            object.__setattr__(snapshot, name, value)
+        return snapshot
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is read-only")
+
+    def age(self):
+        """Seconds elapsed since the stations were fetched"""
+        return time.monotonic() - self.fetched_at
+
+
+class _Flight:
+    """A fetch in progress, shared by every caller that missed at the same time"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.snapshot = None
+        self.error = None
+
+
+class SnapshotStore:
+    """Process-wide store of the latest station snapshot.
+
+    Readers get the current Snapshot with no I/O as long as it's younger than
+    "ttl" seconds. A background thread, started with start(), refreshes it
+    every "refresh_interval" seconds; concurrent misses share a single fetch.
+    Each refresh that changes something is published on "deltas".
+
+    Instead of its own thread, the store can be refreshed by a "scheduler"
+    shared with other stores, e.g. a SystemRegistry: start() and stop() then
+    start and stop the scheduler, and the store counts as running as long
+    as the scheduler does.
+    """
+
+    def __init__(self, fetch, ttl=60, refresh_interval=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval or ttl
+        self.scheduler = None
+        self._snapshot = None
+        self._version = 0
+        self._flight = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Subscribe to get what changed at each refresh
+        self.deltas = DeltaFeed()
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get(self):
+        """Return the latest snapshot, fetching it only when there's none yet or
+        it's stale and no background refresher is keeping it up to date"""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.age() <= self.ttl:
+            self._count("hits")
+            return snapshot
+        if snapshot is not None and self.running:
+            # The refresher is behind (e.g. upstream is down): serve the old data
+            self._count("stale")
+            return snapshot
+        self._count("misses")
+        try:
+            return self.refresh()
+        except Exception:
+            if snapshot is None:
+                raise
+            logger.exception("Couldn't refresh the stations snapshot")
+            self._count("stale")
+            return snapshot
+
+    def refresh(self):
+        """Fetch a new snapshot; callers arriving while a fetch is in flight
+        wait for it instead of starting their own"""
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if leader:
+            try:
+                stations = self.fetch()
+                previous = self._snapshot
+                # Only one fetch at a time gets here, so the version can't race
+                with METRICS.span("snapshot"):
+                    flight.snapshot = Snapshot(
+                        self._version + 1, stations, time.monotonic(), previous
+                    )
+                with self._lock:
+                    self._version = flight.snapshot.version
+                    self._snapshot = flight.snapshot
+                    self.refreshes += 1
+                if previous is None or flight.snapshot.version != previous.version:
+                    self.deltas.publish(flight.snapshot.delta)
+            except Exception as error:
+                flight.error = error
+                self._count("errors")
+            finally:
+                with self._lock:
+                    self._flight = None
+                flight.done.set()
+
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.snapshot
+
+    def peek(self):
+        """Return the current snapshot, or None, without ever fetching"""
+        return self._snapshot
+
+    def seed(self, snapshot):
+        """Start from a snapshot got elsewhere, e.g. saved by the previous
+        process, unless one was already fetched; return whether it was used.
+        Its deltas aren't published: the subscribers saw them already"""
+        with self._lock:
+            if self._snapshot is not None:
+                return False
+            self._snapshot = snapshot
+            self._version = snapshot.version
+            return True
+
+    @property
+    def running(self):
+        if self.scheduler is not None and self.scheduler.running:
+            return True
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background refresher thread, or the scheduler refreshing the store"""
+        if self.scheduler is not None:
+            self.scheduler.start()
+            return
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresher thread, or the scheduler refreshing the store"""
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """Return the cache counters, along with the current snapshot's version and age"""
+        snapshot = self._snapshot
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "version": snapshot.version if snapshot else 0,
+            "age": snapshot.age() if snapshot else None,
+        }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Couldn't refresh the stations snapshot")
+            if self._stop.wait(self.refresh_interval):
+                break
@@ -0,0 +1,308 @@
+import copy
+import math
+
+import numpy as np
+
+# Mean radius of the Earth, in meters
+EARTH_RADIUS = 6371008.8
+# Distances are computed with the haversine formula on a sphere, so they differ
+# from geopy's geodesic (WGS-84) ones by at most this relative error (~0.2% at
+# Milan's latitude). Two stations whose distances are closer than that may be
+# ranked the other way around compared to the geodesic answer.
+TOLERANCE = 0.005
+# Counts the queries can ask a minimum of
+AVAILABILITY = ("bike", "ebike", "ebike_with_childseat", "availableDocks")
+
+
+class SpatialIndex:
+    """Grid index over the coordinates of the stations, meant to be built once
+    per snapshot.
+
+    Coordinates are projected on a plane tangent to the centre of the system
+    and bucketed in square cells of "cell_size" meters. Queries only look at
+    the cells around the given point, then rank the candidates with a
+    vectorised haversine.
+
+    Queries can ask for stations with at least some of the AVAILABILITY
+    counts, e.g. available={"ebike": 2}: the grid is then filtered once per
+    combination asked for, so the search only visits matching stations.
+    """
+
+    # Queries farther than this many cells from the grid just scan every station
+    FAR_RINGS = 64
+    # Filtered grids kept at once
+    FILTERS = 16
+
+    def __init__(self, stations, cell_size=500):
+        self.stations = [
+            station
+            for station in stations
+            if station.get("lat") is not None and station.get("lon") is not None
+        ]
+        self.cell_size = cell_size
+        self._lat = np.radians(np.array([s["lat"] for s in self.stations], float))
+        self._lon = np.radians(np.array([s["lon"] for s in self.stations], float))
+        self._cos_lat = np.cos(self._lat)
+        # Equirectangular projection around the centre of the system
+        origin = float(self._lat.mean()) if self.stations else 0.0
+        self._kx = EARTH_RADIUS * math.cos(origin)
+        cx = np.floor(self._lon * self._kx / cell_size).astype(int)
+        cy = np.floor(self._lat * EARTH_RADIUS / cell_size).astype(int)
+
+        cells = {}
+        for index, cell in enumerate(zip(cx.tolist(), cy.tolist())):
+            cells.setdefault(cell, []).append(index)
+        self._cells = {cell: np.array(indices) for cell, indices in cells.items()}
+        if self.stations:
+            self._bounds = (int(cx.min()), int(cx.max()), int(cy.min()), int(cy.max()))
+        self._positions = {
+            station["station_id"]: index for index, station in enumerate(self.stations)
+        }
+        self._counts = {
+            field: np.array([s.get(field) or 0 for s in self.stations], int)
+            for field in AVAILABILITY
+        }
+        # Sorted (field, minimum) items -> (cells, number of stations) of the matching ones
+        self._filtered = {}
+
+    def __len__(self):
+        return len(self.stations)
+
+    @property
+    def bounds(self):
+        """The (min lat, min lon, max lat, max lon) box around the stations, in
+        degrees, or None when there's none"""
+        if not self.stations:
+            return None
+        return (
+            math.degrees(float(self._lat.min())),
+            math.degrees(float(self._lon.min())),
+            math.degrees(float(self._lat.max())),
+            math.degrees(float(self._lon.max())),
+        )
+
+    @property
+    def centre(self):
+        """The (lat, lon) centre of the box around the stations, or None when
+        there's none"""
+        bounds = self.bounds
+        if bounds is None:
+            return None
+        min_lat, min_lon, max_lat, max_lon = bounds
+        return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+    def to_arrays(self):
+        """Return the station_ids, in the order of the index, which can be
+        dumped as json, and the coordinates and the grid as flat arrays;
+        see from_arrays()"""
+        cells = list(self._cells.items())
+        members = [indices for _, indices in cells]
+        keys = {"ids": [station["station_id"] for station in self.stations]}
+        return keys, {
+            "lat": self._lat,
+            "lon": self._lon,
+            "cells": np.array([cell for cell, _ in cells], np.int64).reshape(-1, 2),
+            "offsets": np.cumsum([0] + [len(indices) for indices in members]),
+            "members": np.concatenate(members) if members else np.zeros(0, np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, stations_by_id, keys, arrays, cell_size=500):
+        """Rebuild the index to_arrays() was called on from the stations
+        with its station_ids, without computing the grid again. The arrays
+        can be read-only, e.g. mapped from a file: the cells are slices of
+        "members" and are never written to"""
+        index = cls.__new__(cls)
+        # The grid refers to the stations by position: keep the index's
+        # order, which updated() keeps even when upstream reorders them
+        index.stations = [stations_by_id[station_id] for station_id in keys["ids"]]
+        index.cell_size = cell_size
+        index._lat = arrays["lat"]
+        index._lon = arrays["lon"]
+        index._cos_lat = np.cos(index._lat)
+        origin = float(index._lat.mean()) if index.stations else 0.0
+        index._kx = EARTH_RADIUS * math.cos(origin)
+        cells = arrays["cells"]
+        offsets = arrays["offsets"].tolist()
+        members = arrays["members"]
+        index._cells = {
+            cell: members[offsets[i] : offsets[i + 1]]
+            for i, cell in enumerate(map(tuple, cells.tolist()))
+        }
+        if index.stations:
+            index._bounds = (
+                int(cells[:, 0].min()),
+                int(cells[:, 0].max()),
+                int(cells[:, 1].min()),
+                int(cells[:, 1].max()),
+            )
+        index._positions = {
+            station["station_id"]: i for i, station in enumerate(index.stations)
+        }
+        index._counts = {
+            field: np.array([s.get(field) or 0 for s in index.stations], int)
+            for field in AVAILABILITY
+        }
+        index._filtered = {}
+        return index
+
+    def updated(self, delta, stations_by_id):
+        """Return the index for the stations of a snapshot, given the
+        StationDelta from the ones of this index. The grid is shared as long
+        as no station was added, removed or moved, else it's rebuilt"""
+        if delta.moved:
+            return SpatialIndex(stations_by_id.values(), self.cell_size)
+        index = copy.copy(self)
+        index.stations = [
+            stations_by_id[station["station_id"]] for station in self.stations
+        ]
+        index._counts = dict(self._counts)
+        for field in AVAILABILITY:
+            # Stations with no coordinates aren't indexed
+            changed = [
+                station_id
+                for station_id, fields in delta.changed.items()
+                if field in fields and station_id in self._positions
+            ]
+            if changed:
+                counts = index._counts[field] = self._counts[field].copy()
+                for station_id in changed:
+                    counts[self._positions[station_id]] = (
+                        stations_by_id[station_id].get(field) or 0
+                    )
+        index._filtered = {}
+        return index
+
+    def nearest(self, lat, lon, k=1, available=None):
+        """Return the "k" nearest stations to the given point, as a list of
+        (station, distance in meters) tuples sorted by distance. With
+        "available", only the stations with at least the given
+        {field: minimum} counts are considered"""
+        cells, size = self._filter(available)
+        k = min(k, size)
+        if k < 1:
+            return []
+        cx, cy = self._cell(lat, lon)
+        min_cx, max_cx, min_cy, max_cy = self._bounds
+        # Rings closer than "first" lie entirely outside the grid
+        first = max(min_cx - cx, cx - max_cx, min_cy - cy, cy - max_cy, 0)
+        last = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy)
+        if first > self.FAR_RINGS:
+            return self._rank(lat, lon, np.concatenate(list(cells.values())), k)
+
+        found = []
+        count = 0
+        for ring in range(first, last + 1):
+            for cell in self._ring(cx, cy, ring):
+                indices = cells.get(cell)
+                if indices is not None:
+                    found.append(indices)
+                    count += len(indices)
+            if count >= k:
+                candidates = np.concatenate(found)
+                distances = self._haversine(lat, lon, candidates)
+                farthest = np.partition(distances, k - 1)[k - 1]
+                # The cells of the next rings are at least "ring" cells away
+                if farthest <= ring * self.cell_size * (1 - TOLERANCE):
+                    return self._rank(lat, lon, candidates, k, distances)
+        return self._rank(lat, lon, np.concatenate(found), k)
+
+    def within(self, lat, lon, radius_m, available=None):
+        """Return the stations at most "radius_m" meters away from the given
+        point, as a list of (station, distance in meters) tuples sorted by
+        distance. "available" filters them like in nearest()"""
+        cells, size = self._filter(available)
+        if not size:
+            return []
+        cx, cy = self._cell(lat, lon)
+        reach = math.ceil(radius_m * (1 + TOLERANCE) / self.cell_size)
+        if (2 * reach + 1) ** 2 < len(cells):
+            found = [
+                cells[cell]
+                for cell in (
+                    (x, y)
+                    for x in range(cx - reach, cx + reach + 1)
+                    for y in range(cy - reach, cy + reach + 1)
+                )
+                if cell in cells
+            ]
+        else:
+            found = [
+                indices
+                for (x, y), indices in cells.items()
+                if abs(x - cx) <= reach and abs(y - cy) <= reach
+            ]
+        if not found:
+            return []
+        candidates = np.concatenate(found)
+        distances = self._haversine(lat, lon, candidates)
+        inside = distances <= radius_m
+        return self._rank(lat, lon, candidates[inside], None, distances[inside])
+
+    def _filter(self, available):
+        """Return the grid of the stations with at least the "available"
+        counts, and how many they are"""
+        if not available:
+            return self._cells, len(self.stations)
+        key = tuple(sorted(available.items()))
+        filtered = self._filtered.get(key)
+        if filtered is not None:
+            return filtered
+        for field, minimum in key:
+            if field not in AVAILABILITY:
+                raise ValueError("Unknown availability: {!r}".format(field))
+        mask = np.ones(len(self.stations), bool)
+        for field, minimum in key:
+            mask &= self._counts[field] >= minimum
+        cells = {}
+        for cell, indices in self._cells.items():
+            indices = indices[mask[indices]]
+            if len(indices):
+                cells[cell] = indices
+        filtered = (cells, int(mask.sum()))
+        if len(self._filtered) < self.FILTERS:
+            self._filtered[key] = filtered
+        return filtered
+
+    def _cell(self, lat, lon):
+        return (
+            math.floor(math.radians(lon) * self._kx / self.cell_size),
+            math.floor(math.radians(lat) * EARTH_RADIUS / self.cell_size),
+        )
+
+    def _ring(self, cx, cy, ring):
+        """Yield the cells at exactly "ring" cells (Chebyshev distance) from (cx, cy)"""
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            yield (x, cy - ring)
+            yield (x, cy + ring)
+        for y in range(cy - ring + 1, cy + ring):
+            yield (cx - ring, y)
+            yield (cx + ring, y)
+
+    def _haversine(self, lat, lon, indices):
+        lat = math.radians(lat)
+        lon = math.radians(lon)
+        a = (
+            np.sin((self._lat[indices] - lat) / 2) ** 2
+            + math.cos(lat)
+            * self._cos_lat[indices]
+            * np.sin((self._lon[indices] - lon) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def _rank(self, lat, lon, candidates, k, distances=None):
+        if distances is None:
+            distances = self._haversine(lat, lon, candidates)
+        if k is not None and k < len(candidates):
+            top = np.argpartition(distances, k - 1)[:k]
+            candidates, distances = candidates[top], distances[top]
+        order = np.argsort(distances, kind="stable")
+        return [
+            (self.stations[index], distance)
+            for index, distance in zip(
+                candidates[order].tolist(), distances[order].tolist()
+            )
+        ]
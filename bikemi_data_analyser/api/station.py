@@ -0,0 +1,113 @@
+from operator import attrgetter
+
+
+class Station:
+    """Compact record of a BikeMi station.
+
+    Fields are stored in slots rather than in a per-station dict; the ones
+    the upstream sources don't provide are left to None. Unknown keys coming
+    from the Open Data end up in "extra". Stations can still be read like
+    dictionaries, i.e. station["title"], and converted back with to_dict().
+    """
+
+    FIELDS = (
+        "station_id",
+        "name",
+        "title",
+        "address",
+        "lat",
+        "lon",
+        "capacity",
+        "bike",
+        "ebike",
+        "ebike_with_childseat",
+        "availableDocks",
+        "availableVirtualDocks",
+        "availablePhysicalDocks",
+    )
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.pop(field, None))
+        self.extra = fields or None
+
+    @classmethod
+    def from_dict(cls, station):
+        return cls(**station)
+
+    def to_dict(self):
+        """Return the station as a dictionary, leaving out the missing fields"""
+        station = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                station[field] = value
+        if self.extra:
+            station.update(self.extra)
+        return station
+
+    def merge(self, other):
+        """Return a new station with the fields of "other" added on top of these
+        ones, like merging the two dictionaries with "|" would"""
+        merged = Station.__new__(Station)
+        for field in self.FIELDS:
+            value = getattr(other, field)
+            setattr(merged, field, getattr(self, field) if value is None else value)
+        if self.extra and other.extra:
+            merged.extra = self.extra | other.extra
+        else:
+            merged.extra = self.extra or other.extra
+        return merged
+
+    def diff(self, other):
+        """Return the {field: (other's value, this value)} dictionary of the
+        fields that differ between "other" and this station"""
+        if _values(self) == _values(other) and self.extra == other.extra:
+            return {}
+        changes = {}
+        for field in self.FIELDS:
+            old = getattr(other, field)
+            new = getattr(self, field)
+            if old != new:
+                changes[field] = (old, new)
+        if self.extra != other.extra:
+            for key in (self.extra or {}).keys() | (other.extra or {}).keys():
+                old = other.extra.get(key) if other.extra else None
+                new = self.extra.get(key) if self.extra else None
+                if old != new:
+                    changes[key] = (old, new)
+        return changes
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+        elif self.extra:
+            value = self.extra.get(key)
+        else:
+            value = None
+        return default if value is None else value
+
+    def __eq__(self, other):
+        if not isinstance(other, Station):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "Station(station_id={!r}, title={!r})".format(
+            self.station_id, self.title
+        )
+
+
+# Get all the fields of a station at once
+_values = attrgetter(*Station.FIELDS)
@@ -0,0 +1,198 @@
+from bikemi_data_analyser.api.fetch import FetchResult
+from bikemi_data_analyser.api.station import Station
+
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Vehicle categories counted for each station
+CATEGORIES = ("bike", "ebike", "ebike_with_childseat")
+
+
+class StatusBackend:
+    """Source of the stations availability.
+
+    fetch() returns a FetchResult whose value is a list of stations with only
+    the station_id and the availability fields filled in; "changed" is False
+    when they're the same as the previous time.
+    """
+
+    def fetch(self, fetcher):
+        raise NotImplementedError
+
+
+class GbfsStatus(StatusBackend):
+    """Availability from the GBFS station_status.json feed.
+
+    The feeds are discovered through gbfs.json and none of them is requested
+    again before its "ttl" expires. Vehicles are counted by their type id,
+    mapped to a category through vehicle_types.json, or "vehicle_types" when
+    given as a {vehicle_type_id: category} dictionary.
+    """
+
+    def __init__(self, discovery_url, language="en", vehicle_types=None, timeout=5):
+        self.discovery_url = discovery_url
+        self.language = language
+        self.vehicle_types = vehicle_types
+        self.timeout = timeout
+        # url -> (FetchResult, monotonic time it expires at)
+        self._feeds = {}
+        self._stations = None
+        # Categories the stations were counted with
+        self._vehicle_types = None
+
+    def fetch(self, fetcher):
+        feeds = self.feed_urls(fetcher)
+        vehicle_types = self.vehicle_types
+        if vehicle_types is None and "vehicle_types" in feeds:
+            vehicle_types = vehicle_categories(
+                self._get(fetcher, feeds["vehicle_types"]).value
+            )
+        vehicle_types = vehicle_types or {}
+        status = self._get(fetcher, feeds["station_status"])
+        # The counts change with the categories too, even when the status doesn't
+        changed = (
+            status.changed
+            or self._stations is None
+            or vehicle_types != self._vehicle_types
+        )
+        if changed:
+            self._stations = parse_station_status(status.value, vehicle_types)
+            self._vehicle_types = vehicle_types
+        return FetchResult(status.url, self._stations, changed)
+
+    def feed_urls(self, fetcher):
+        """Return the {feed name: url} dictionary listed in gbfs.json"""
+        data = self._get(fetcher, self.discovery_url).value["data"]
+        # Feeds are grouped by language: prefer ours, else take the first one
+        feeds = data.get(self.language) or next(iter(data.values()))
+        return {feed["name"]: feed["url"] for feed in feeds["feeds"]}
+
+    def _get(self, fetcher, url):
+        """Get a decoded feed, reusing it until its ttl expires"""
+        cached = self._feeds.get(url)
+        if cached is not None and time.monotonic() < cached[1]:
+            return FetchResult(url, cached[0].value, False)
+        result = fetcher.get(url, lambda response: response.json(), self.timeout)
+        self._feeds[url] = (result, time.monotonic() + result.value.get("ttl", 0))
+        return result
+
+
+class ScraperStatus(StatusBackend):
+    """Availability scraped from the json embedded in the bikemi.com/stazioni page"""
+
+    def __init__(self, page_url, timeout=15):
+        self.page_url = page_url
+        self.timeout = timeout
+
+    def fetch(self, fetcher):
+        return fetcher.get(
+            self.page_url,
+            lambda response: parse_stations_page(response.text),
+            self.timeout,
+        )
+
+
+class FallbackStatus(StatusBackend):
+    """Try the backends in order, falling back to the next one when a backend
+    can't be reached or its data can't be parsed"""
+
+    def __init__(self, *backends):
+        self.backends = backends
+        self._last = None
+
+    def fetch(self, fetcher):
+        for backend in self.backends:
+            try:
+                result = backend.fetch(fetcher)
+            except Exception:
+                if backend is self.backends[-1]:
+                    raise
+                logger.warning(
+                    "%s failed, falling back", type(backend).__name__, exc_info=True
+                )
+                continue
+            if backend is not self._last:
+                # Data from another backend is new to whoever got the last one
+                result = FetchResult(result.url, result.value, True)
+                self._last = backend
+            return result
+
+
+def vehicle_categories(raw):
+    """Map the vehicle type ids of a decoded vehicle_types.json to CATEGORIES"""
+    categories = {}
+    for vehicle_type in raw["data"]["vehicle_types"]:
+        name = (vehicle_type.get("name") or "").lower()
+        if vehicle_type.get("propulsion_type") == "human":
+            category = "bike"
+        elif "child" in name or "seggiolino" in name:
+            category = "ebike_with_childseat"
+        else:
+            category = "ebike"
+        categories[vehicle_type["vehicle_type_id"]] = category
+    return categories
+
+
+def parse_station_status(raw, vehicle_types):
+    """Build the stations out of a decoded station_status.json"""
+    stations = []
+    for element in raw["data"]["stations"]:
+        counts = dict.fromkeys(CATEGORIES, 0)
+        available = element.get("vehicle_types_available")
+        if available:
+            for vehicle in available:
+                category = vehicle_types.get(vehicle["vehicle_type_id"])
+                if category is not None:
+                    counts[category] += vehicle["count"]
+        else:
+            # Feeds without vehicle types only have the total
+            counts["bike"] = element["num_bikes_available"]
+        stations.append(
+            Station(
+                station_id=element["station_id"],
+                availableDocks=element["num_docks_available"],
+                availablePhysicalDocks=element["num_docks_available"],
+                **counts,
+            )
+        )
+    return stations
+
+
+def parse_stations_page(raw):
+    """Build the stations out of the json embedded in the bikemi.com/stazioni page"""
+    placeholder = '"stationMapPage","slug":null},'
+    start = raw.find(placeholder) + len(placeholder)
+    end = raw.find('},"baseUrl":"https://bikemi.com"')
+    station_extra_info_raw = "{" + (raw[start:end])
+    station_list = []
+    jsontxt = json.loads(station_extra_info_raw)
+    for element in jsontxt.values():
+        availability = element["availabilityInfo"]
+        station_list.append(
+            Station(
+                station_id=element["id"],
+                name=element["name"],
+                title=element["title"],
+                availableDocks=availability["availableDocks"],
+                availableVirtualDocks=availability["availableVirtualDocks"],
+                availablePhysicalDocks=availability["availablePhysicalDocks"],
+                **_scraped_counts(availability["availableVehicleCategories"]),
+            )
+        )
+    return station_list
+
+
+def _scraped_counts(available):
+    counts = dict.fromkeys(CATEGORIES, 0)
+    for position, vehicle_category in enumerate(available):
+        category = vehicle_category.get("vehicleCategory")
+        if category not in counts:
+            # Without a known category id, rely on the order the page lists them in
+            if position >= len(CATEGORIES):
+                continue
+            category = CATEGORIES[position]
+        counts[category] += vehicle_category["count"]
+    return counts
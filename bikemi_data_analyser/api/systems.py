@@ -0,0 +1,235 @@
+from bikemi_data_analyser.api.bikemi import BikeMiApi
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.snapshot import SnapshotStore
+from bikemi_data_analyser.api.status import GbfsStatus
+
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Meters a point can be outside a system's stations and still be routed to it
+MARGIN = 2000
+# Meters in a degree of latitude
+DEGREE = 111195
+
+
+class System:
+    """A bike-share system: its feeds and the SnapshotStore of its stations,
+    each snapshot with its own search and spatial indexes"""
+
+    def __init__(self, name, api, station_info, ttl=60, margin=MARGIN):
+        self.name = name
+        self.api = api
+        self.station_info = station_info
+        self.margin = margin
+        self.snapshots = SnapshotStore(
+            partial(api.get_station_full_info, station_info), ttl=ttl
+        )
+
+    @property
+    def ttl(self):
+        return self.snapshots.refresh_interval
+
+    def snapshot(self):
+        return self.snapshots.get()
+
+    def contains(self, lat, lon):
+        """True when the point is within "margin" meters of the box around
+        the stations; False until the first snapshot is fetched"""
+        snapshot = self.snapshots.peek()
+        bounds = snapshot.spatial.bounds if snapshot is not None else None
+        if bounds is None:
+            return False
+        min_lat, min_lon, max_lat, max_lon = bounds
+        dlat = self.margin / DEGREE
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        return (
+            min_lat - dlat <= lat <= max_lat + dlat
+            and min_lon - dlon <= lon <= max_lon + dlon
+        )
+
+    def __repr__(self):
+        return "System({!r})".format(self.name)
+
+
+class SystemRegistry:
+    """The bike-share systems served side by side, by name.
+
+    Systems are GBFS feeds, or a BikeMiApi like the default one falling back
+    to the scraper. All of them share a Fetcher, and a single scheduler
+    thread, started with start(), refreshes each one every "ttl" seconds on
+    a pool of "workers" threads, so the systems due at once are refreshed
+    in parallel. Queries about a point are routed to the systems whose
+    stations are around it.
+    """
+
+    def __init__(self, fetcher=None, workers=4):
+        self.fetcher = fetcher or Fetcher()
+        self.workers = workers
+        self._systems = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    @classmethod
+    def load(cls, path=None, names=None, ttl=60, **options):
+        """Build a registry from a json list of {"name", "station_info", "gbfs"}
+        objects, with an optional "ttl" each, or with BikeMi alone when there's
+        no "path"; {"name": "bikemi"} stands for BikeMi with its scraper
+        fallback. Only the systems in "names" are added when it's given"""
+        registry = cls(**options)
+        systems = [{"name": "bikemi"}]
+        if path is not None:
+            with open(path) as f:
+                systems = json.load(f)
+        if names is not None:
+            missing = set(names) - {system["name"] for system in systems}
+            if missing:
+                raise ValueError(
+                    "Unknown systems: {}".format(", ".join(sorted(missing)))
+                )
+            systems = [system for system in systems if system["name"] in names]
+        for system in systems:
+            if system["name"] == "bikemi" and "gbfs" not in system:
+                registry.add_bikemi(ttl=system.get("ttl", ttl))
+                continue
+            registry.add_gbfs(
+                system["name"],
+                system["station_info"],
+                system["gbfs"],
+                ttl=system.get("ttl", ttl),
+            )
+        return registry
+
+    def add(self, name, api, station_info, ttl=60):
+        """Add a system reading its stations through a BikeMiApi"""
+        system = System(name, api, station_info, ttl)
+        system.snapshots.scheduler = self
+        with self._lock:
+            if name in self._systems:
+                raise ValueError("System {!r} already registered".format(name))
+            self._systems[name] = system
+        self._wake.set()
+        return system
+
+    def add_gbfs(self, name, station_info, gbfs, ttl=60):
+        """Add a system reading its availability from the GBFS feeds listed at
+        the "gbfs" discovery url"""
+        api = BikeMiApi(self.fetcher, GbfsStatus(gbfs, timeout=BikeMiApi.INFO_TIMEOUT))
+        return self.add(name, api, station_info, ttl)
+
+    def add_bikemi(self, ttl=60):
+        """Add BikeMi, with the scraper as fallback"""
+        return self.add("bikemi", BikeMiApi(self.fetcher), BikeMiApi.STATION_INFO, ttl)
+
+    def get(self, name):
+        return self._systems[name]
+
+    def __iter__(self):
+        return iter(list(self._systems.values()))
+
+    def __len__(self):
+        return len(self._systems)
+
+    def refresh_all(self):
+        """Refresh every system in parallel; return the {name: error} of the
+        ones that failed"""
+        systems = list(self)
+        futures = [self._executor().submit(s.snapshots.refresh) for s in systems]
+        errors = {}
+        for system, future in zip(systems, futures):
+            try:
+                future.result()
+            except Exception as exception:
+                errors[system.name] = exception
+        return errors
+
+    def route(self, lat, lon):
+        """Return the systems a point belongs to"""
+        return [system for system in self if system.contains(lat, lon)]
+
+    def nearest(self, lat, lon, k=1, available=None):
+        """Return the "k" nearest stations to the point among the systems it
+        belongs to, as (system, station, distance in meters) tuples sorted by
+        distance; "available" is passed to SpatialIndex.nearest()"""
+        found = []
+        for system in self.route(lat, lon):
+            spatial = system.snapshot().spatial
+            for station, distance in spatial.nearest(lat, lon, k, available):
+                found.append((system, station, distance))
+        found.sort(key=lambda item: item[2])
+        return found[:k]
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._schedule_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread, once the refreshes in flight are done"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def stats(self):
+        return {system.name: system.snapshots.stats() for system in self}
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="bikemi-refresh"
+                )
+            return self._pool
+
+    def _schedule_loop(self):
+        # (monotonic time it's due at, name) of every system
+        due = []
+        scheduled = set()
+        in_flight = set()
+        while not self._stop.is_set():
+            self._wake.clear()
+            for system in self:
+                if system.name not in scheduled:
+                    heapq.heappush(due, (time.monotonic(), system.name))
+                    scheduled.add(system.name)
+            now = time.monotonic()
+            while due and due[0][0] <= now:
+                _, name = heapq.heappop(due)
+                system = self._systems[name]
+                heapq.heappush(due, (now + system.ttl, name))
+                if name not in in_flight:
+                    in_flight.add(name)
+                    self._executor().submit(self._refresh, system, in_flight)
+            self._wake.wait(due[0][0] - now if due else None)
+
+    def _refresh(self, system, in_flight):
+        try:
+            system.snapshots.refresh()
+        except Exception:
+            logger.exception("Couldn't refresh the %s stations", system.name)
+        finally:
+            in_flight.discard(system.name)
@@ -0,0 +1,185 @@
+from bikemi_data_analyser.history.store import FIELDS, MISSING
+
+import numpy as np
+
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+HOURS_PER_WEEK = 7 * 24
+# Occupancy is binned by percent
+OCCUPANCY_BINS = 101
+
+
+def hour_of_week(timestamps, timezone=None):
+    """Return the local hour of the week, 0 being Monday at midnight, of each
+    timestamp (seconds since the epoch)"""
+    timestamps = np.asarray(timestamps, np.int64)
+    hours = timestamps // 3600
+    if timezone is not None:
+        # The UTC offset only changes on the hour: look it up once per hour
+        zone = ZoneInfo(timezone)
+        unique, inverse = np.unique(hours, return_inverse=True)
+        offsets = np.array(
+            [
+                datetime.fromtimestamp(hour * 3600, zone).utcoffset().total_seconds()
+                for hour in unique.tolist()
+            ],
+            np.int64,
+        )
+        hours = hours + offsets[inverse.ravel()] // 3600
+    # The epoch was a Thursday
+    return (hours + 3 * 24) % HOURS_PER_WEEK
+
+
+class AvailabilityReport:
+    """Per station aggregates over the recorded history, as computed by analyse()"""
+
+    def __init__(self, station_ids, stations):
+        self.station_ids = list(station_ids)
+        self.samples = np.zeros(stations, np.int64)
+        self.empty = np.zeros(stations, np.int64)
+        self.full = np.zeros(stations, np.int64)
+        self.departures = np.zeros(stations, np.int64)
+        self.arrivals = np.zeros(stations, np.int64)
+        # (hour of week, station, occupancy percent) -> samples
+        self.occupancy = np.zeros((HOURS_PER_WEEK, stations, OCCUPANCY_BINS), np.int32)
+
+    @property
+    def empty_ratio(self):
+        """Share of the samples each station had no bike at all"""
+        return self.empty / np.maximum(self.samples, 1)
+
+    @property
+    def full_ratio(self):
+        """Share of the samples each station had no free dock"""
+        return self.full / np.maximum(self.samples, 1)
+
+    def occupancy_percentiles(self, q=(10, 50, 90), weekly=True):
+        """Return the occupancy percentiles, between 0 and 1, as an array of
+        shape (hours of the week, stations, len(q)), or (stations, len(q))
+        when not "weekly". NaN where there's no sample"""
+        histogram = self.occupancy if weekly else self.occupancy.sum(axis=0)
+        cumulative = np.cumsum(histogram, axis=-1)
+        total = cumulative[..., -1:]
+        result = []
+        for percentile in q:
+            reached = cumulative >= total * (percentile / 100)
+            result.append(np.argmax(reached, axis=-1) / (OCCUPANCY_BINS - 1))
+        result = np.stack(result, axis=-1)
+        result[total[..., 0] == 0] = np.nan
+        return result
+
+    def rows(self, kind="stations", top=10):
+        """Return the report as a list of dictionaries: one per station for the
+        "stations" kind, per station and hour of the week for "hourly", and
+        per station among the "top" most often empty and full for "ranking"."""
+        if kind == "stations":
+            percentiles = self.occupancy_percentiles(weekly=False)
+            return [
+                {
+                    "station_id": station_id,
+                    "samples": int(self.samples[i]),
+                    "empty_ratio": round(float(self.empty_ratio[i]), 4),
+                    "full_ratio": round(float(self.full_ratio[i]), 4),
+                    "departures": int(self.departures[i]),
+                    "arrivals": int(self.arrivals[i]),
+                    "occupancy_p10": _number(percentiles[i, 0]),
+                    "occupancy_p50": _number(percentiles[i, 1]),
+                    "occupancy_p90": _number(percentiles[i, 2]),
+                }
+                for i, station_id in enumerate(self.station_ids)
+            ]
+        if kind == "hourly":
+            percentiles = self.occupancy_percentiles()
+            samples = self.occupancy.sum(axis=-1)
+            hours, slots = np.nonzero(samples)
+            return [
+                {
+                    "station_id": self.station_ids[i],
+                    "hour_of_week": int(hour),
+                    "samples": int(samples[hour, i]),
+                    "occupancy_p10": _number(percentiles[hour, i, 0]),
+                    "occupancy_p50": _number(percentiles[hour, i, 1]),
+                    "occupancy_p90": _number(percentiles[hour, i, 2]),
+                }
+                for hour, i in zip(hours.tolist(), slots.tolist())
+            ]
+        if kind == "ranking":
+            return [
+                {"by": by, "rank": rank, "station_id": station_id, "ratio": ratio}
+                for by in ("empty", "full")
+                for rank, (station_id, ratio) in enumerate(self.rank(by, top), 1)
+            ]
+        raise ValueError("Unknown report: {!r}".format(kind))
+
+    def rank(self, by="empty", n=10):
+        """Return the station_ids of the "n" stations most often empty, or
+        full, along with their ratio"""
+        ratio = self.empty_ratio if by == "empty" else self.full_ratio
+        order = np.argsort(-ratio, kind="stable")[:n]
+        return [(self.station_ids[i], float(ratio[i])) for i in order]
+
+
+def analyse(store, timezone="Europe/Rome", max_gap=None, chunk=16384):
+    """Compute an AvailabilityReport over all the frames of a HistoryStore.
+
+    Frames are processed "chunk" at a time, so months of history never have
+    to fit in memory at once. Departures and arrivals are inferred from the
+    drop and rise of the bikes at each station between consecutive frames,
+    ignoring the ones more than "max_gap" seconds apart.
+    """
+    stations = len(store.station_ids)
+    report = AvailabilityReport(store.station_ids, stations)
+    times = store.times()
+    columns = [store.column(field)[:, :stations] for field in FIELDS]
+    slot = np.arange(stations)
+    previous = None
+
+    for start in range(0, len(times), chunk):
+        end = min(start + chunk, len(times))
+        bike, ebike, childseat, docks = (
+            np.asarray(column[start:end], np.int16) for column in columns
+        )
+        valid = (
+            (bike != MISSING)
+            & (ebike != MISSING)
+            & (childseat != MISSING)
+            & (docks != MISSING)
+        )
+        bikes = bike + ebike + childseat
+        report.samples += valid.sum(axis=0)
+        report.empty += (valid & (bikes == 0)).sum(axis=0)
+        report.full += (valid & (docks == 0)).sum(axis=0)
+
+        # Occupancy histogram by hour of week
+        capacity = bikes + docks
+        counted = valid & (capacity > 0)
+        percent = np.rint(
+            bikes * (OCCUPANCY_BINS - 1) / np.maximum(capacity, 1)
+        ).astype(np.int64)
+        hours = hour_of_week(times[start:end], timezone)
+        cells = (hours[:, None] * stations + slot) * OCCUPANCY_BINS + percent
+        report.occupancy += np.bincount(
+            cells[counted], minlength=report.occupancy.size
+        ).reshape(report.occupancy.shape)
+
+        # Departures and arrivals, chaining with the last frame of the previous chunk
+        chunk_times = np.asarray(times[start:end])
+        if previous is not None:
+            bikes = np.vstack([previous[0], bikes])
+            valid = np.vstack([previous[1], valid])
+            chunk_times = np.concatenate([[previous[2]], chunk_times])
+        change = np.diff(bikes, axis=0)
+        paired = valid[1:] & valid[:-1]
+        if max_gap is not None:
+            paired &= (np.diff(chunk_times) <= max_gap)[:, None]
+        change = np.where(paired, change, 0)
+        report.departures += np.maximum(-change, 0).sum(axis=0)
+        report.arrivals += np.maximum(change, 0).sum(axis=0)
+        previous = (bikes[-1:], valid[-1:], chunk_times[-1])
+
+    return report
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 2)
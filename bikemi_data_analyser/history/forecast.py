@@ -0,0 +1,346 @@
+from bikemi_data_analyser.history.analytics import hour_of_week
+from bikemi_data_analyser.history.store import FIELDS, MISSING
+
+import bisect
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Minutes ahead the counts are forecast
+HORIZONS = (5, 10, 15, 20, 30)
+# The week is split in slots of this many minutes, each with its own baseline
+SLOT_MINUTES = 15
+SLOTS = 7 * 24 * 60 // SLOT_MINUTES
+# Minutes back the recent trend is measured over
+TREND = 5
+# Weight, in squared counts, pulling the trend coefficients towards
+# persistence while a station has few samples
+PENALTY = 10.0
+# Sums of the trend regression: samples, r², r·d, d², r·y, d·y
+STATS = 6
+
+
+def slot_of_week(timestamps, timezone=None):
+    """Return the local SLOT_MINUTES slot of the week of each timestamp"""
+    timestamps = np.asarray(timestamps, np.int64)
+    minutes = timestamps % 3600 // (SLOT_MINUTES * 60)
+    return hour_of_week(timestamps, timezone) * (60 // SLOT_MINUTES) + minutes
+
+
+class Forecaster:
+    """Forecast the FIELDS counts of every station HORIZONS minutes ahead.
+
+    A count is its station's mean for the slot of the week, the seasonal
+    baseline, plus a residual. The residual in "h" minutes is predicted
+    from the current one, r, and the change of the count over the last
+    TREND minutes, d, as a·r + b·d with a and b fitted by least squares for
+    each station, field and horizon.
+
+    Both models are kept as sums, so they're trained incrementally: fit()
+    folds in the frames of a HistoryStore, append() a frame of live
+    stations, and neither refits anything. Forecasts are computed for all
+    the stations at once for each appended frame, so predict() only looks
+    one up.
+    """
+
+    # Seconds after which the last frame is too old to forecast from
+    MAX_AGE = 600
+
+    def __init__(self, timezone="Europe/Rome", horizons=HORIZONS, penalty=PENALTY):
+        self.timezone = timezone
+        self.horizons = tuple(horizons)
+        self.penalty = penalty
+        self.station_ids = []
+        self.slots = {}
+        # Timestamp of the last frame folded in
+        self.trained_until = None
+        self._sums = np.zeros((len(FIELDS), SLOTS, 0), np.float32)
+        self._counts = np.zeros((len(FIELDS), SLOTS, 0), np.int32)
+        self._stats = np.zeros((STATS, len(FIELDS), len(self.horizons), 0))
+        self._coefficients = None
+        # timestamp -> (counts, residuals, trends) of the recent frames
+        self._recent = {}
+        # (timestamp, slots, (fields, horizons, stations) forecasts)
+        self._latest = None
+        self._lock = threading.Lock()
+
+    # Training
+
+    def fit(self, store, since=None, chunk=4096):
+        """Fold in the frames of a HistoryStore recorded after "since", e.g.
+        the trained_until of a model trained on it before, "chunk" frames
+        at a time"""
+        times = store.times()
+        if not len(times):
+            return
+        with self._lock:
+            indices = self._indices(store.station_ids)
+            columns = [store.column(field)[:, : len(indices)] for field in FIELDS]
+            after = 0 if since is None else int(np.searchsorted(times, since, "right"))
+            for start in range(after, len(times), chunk):
+                self._fit_baselines(times, columns, indices, start, start + chunk)
+            means = self._means(np.arange(SLOTS))[..., indices].astype(np.float32)
+            # Pairs whose target is a new frame can start in the older ones
+            first = after
+            if since is not None:
+                first = int(np.searchsorted(times, since - max(self.horizons) * 60))
+            for start in range(first, len(times), chunk):
+                self._fit_trends(
+                    times, columns, indices, means, start, start + chunk, since
+                )
+            self.trained_until = max(int(times[-1]), self.trained_until or 0)
+            self._coefficients = None
+
+    def append(self, timestamp, stations):
+        """Fold in the counts of "stations" at "timestamp", and forecast from
+        them; frames are expected on the minute, like the Recorder takes them"""
+        counts = np.array(
+            [[station.get(field, np.nan) for station in stations] for field in FIELDS],
+            np.float32,
+        )
+        self.observe(timestamp, [station.station_id for station in stations], counts)
+
+    def observe(self, timestamp, station_ids, counts):
+        """Fold in a (fields, stations) array of the counts of "station_ids"
+        at "timestamp", NaN when unknown"""
+        with self._lock:
+            indices = self._indices(station_ids)
+            x = np.full((len(FIELDS), len(self.station_ids)), np.nan, np.float32)
+            x[:, indices] = counts
+            slot = int(slot_of_week([timestamp], self.timezone)[0])
+
+            # The forecasts made h minutes ago for now
+            y = x - self._means([slot])[:, 0]
+            for h, minutes in enumerate(self.horizons):
+                origin = self._recent.get(timestamp - minutes * 60)
+                if origin is not None:
+                    terms = self._pair_terms(
+                        self._padded(origin[1]), self._padded(origin[2])
+                    )
+                    self._stats[:, :, h] += self._pair_sums(terms, y)
+
+            valid = ~np.isnan(x)
+            self._sums[:, slot] += np.where(valid, x, 0)
+            self._counts[:, slot] += valid
+            residuals = x - self._means([slot])[:, 0]
+            previous = self._recent.get(timestamp - TREND * 60)
+            trends = np.zeros_like(x)
+            if previous is not None:
+                trends = np.nan_to_num(x - self._padded(previous[0]))
+            self._recent[timestamp] = (x, residuals, trends)
+            oldest = timestamp - max(max(self.horizons), TREND) * 60
+            for key in [key for key in self._recent if key < oldest]:
+                del self._recent[key]
+            self.trained_until = max(timestamp, self.trained_until or 0)
+            self._coefficients = None
+            self._latest = (
+                timestamp,
+                dict(self.slots),
+                self._forecast(timestamp, x, residuals, trends),
+            )
+
+    def close(self):
+        """Nothing to release: lets a Recorder feed the forecaster like a store"""
+
+    # Forecasting
+
+    def horizon(self, minutes):
+        """Return the first of the horizons at least "minutes" away, or the
+        farthest one"""
+        h = min(bisect.bisect_left(self.horizons, minutes), len(self.horizons) - 1)
+        return self.horizons[h]
+
+    def predict(self, station_id, minutes=15):
+        """Return the {field: count} forecast for a station horizon(minutes)
+        minutes after the last frame appended; None when there's none recent
+        enough"""
+        latest = self._latest
+        if latest is None or time.time() - latest[0] > self.MAX_AGE:
+            return None
+        _, slots, table = latest
+        slot = slots.get(station_id)
+        if slot is None:
+            return None
+        h = min(bisect.bisect_left(self.horizons, minutes), len(self.horizons) - 1)
+        return {
+            field: None if value != value else value
+            for field, value in zip(FIELDS, table[:, h, slot].tolist())
+        }
+
+    def forecast(self, timestamp, counts, previous=None):
+        """Return the (fields, horizons, stations) forecasts from the counts
+        at "timestamp", and those TREND minutes before, both (fields,
+        stations) arrays over all the station_ids, without folding them in"""
+        with self._lock:
+            x = np.asarray(counts, np.float32)
+            slot = int(slot_of_week([timestamp], self.timezone)[0])
+            residuals = x - self._means([slot])[:, 0]
+            trends = np.zeros_like(x)
+            if previous is not None:
+                trends = np.nan_to_num(x - previous)
+            return self._forecast(timestamp, x, residuals, trends)
+
+    def coefficients(self):
+        """Return the (fields, horizons, stations) a and b of the trend models"""
+        coefficients = self._coefficients
+        if coefficients is None:
+            _, rr, rd, dd, ry, dy = self._stats
+            # Solve the 2x2 normal equations, shrunk towards a = 1 and b = 0
+            rr = rr + self.penalty
+            dd = dd + self.penalty
+            ry = ry + self.penalty
+            determinant = rr * dd - rd * rd
+            coefficients = self._coefficients = (
+                (ry * dd - rd * dy) / determinant,
+                (rr * dy - rd * ry) / determinant,
+            )
+        return coefficients
+
+    # Persistence
+
+    def save(self, path):
+        """Write the model to "path", atomically"""
+        with self._lock:
+            meta = {
+                "timezone": self.timezone,
+                "horizons": self.horizons,
+                "penalty": self.penalty,
+                "station_ids": self.station_ids,
+                "trained_until": self.trained_until,
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temporary = "{}.{}.tmp".format(path, os.getpid())
+            with open(temporary, "wb") as f:
+                np.savez(
+                    f,
+                    meta=np.array(json.dumps(meta)),
+                    sums=self._sums,
+                    counts=self._counts,
+                    stats=self._stats,
+                )
+            os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            forecaster = cls(meta["timezone"], meta["horizons"], meta["penalty"])
+            forecaster._indices(meta["station_ids"])
+            forecaster._sums = arrays["sums"]
+            forecaster._counts = arrays["counts"]
+            forecaster._stats = arrays["stats"]
+        forecaster.trained_until = meta["trained_until"]
+        return forecaster
+
+    # Internals
+
+    def _indices(self, station_ids):
+        """Return the indices of the stations, adding the new ones"""
+        new = [station_id for station_id in station_ids if station_id not in self.slots]
+        if new:
+            for station_id in new:
+                self.slots[station_id] = len(self.station_ids)
+                self.station_ids.append(station_id)
+            grow = [(0, 0)] * (self._sums.ndim - 1) + [(0, len(new))]
+            self._sums = np.pad(self._sums, grow)
+            self._counts = np.pad(self._counts, grow)
+            self._stats = np.pad(self._stats, [(0, 0)] * 3 + [(0, len(new))])
+            self._coefficients = None
+        return np.array([self.slots[station_id] for station_id in station_ids], int)
+
+    def _padded(self, values):
+        """Widen the arrays of a recent frame to the stations added since"""
+        missing = len(self.station_ids) - values.shape[-1]
+        if not missing:
+            return values
+        return np.pad(values, [(0, 0), (0, missing)], constant_values=np.nan)
+
+    def _means(self, slots):
+        """Return the (fields, slots, stations) baselines, each station's mean
+        over the whole week where a slot has no sample, NaN if it has none"""
+        sums = self._sums[:, slots]
+        counts = self._counts[:, slots]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            overall = self._sums.sum(axis=1) / self._counts.sum(axis=1)
+            return np.where(counts > 0, sums / np.maximum(counts, 1), overall[:, None])
+
+    def _pair_terms(self, residuals, trends):
+        """Return the residuals and trends with 0 where they're unknown, and
+        the terms of the regression sums that don't depend on the targets"""
+        known = ~np.isnan(residuals)
+        r = np.where(known, residuals, 0).astype(np.float32)
+        d = np.where(known, trends, 0).astype(np.float32)
+        return r, d, (known.astype(np.float32), r * r, r * d, d * d)
+
+    def _pair_sums(self, terms, targets):
+        """Return the (STATS, fields, stations) sums of the trend regression,
+        given the _pair_terms() of (fields, [frames,] stations) residuals and
+        trends, and the residuals some minutes later they're meant to predict"""
+        r, d, products = terms
+        known = ~np.isnan(targets)
+        y = np.where(known, targets, 0).astype(np.float32)
+        known = known.astype(np.float32)
+        pairs = [(term, known) for term in products] + [(r, y), (d, y)]
+        if r.ndim == 2:
+            return np.stack([a * b for a, b in pairs])
+        return np.stack([np.einsum("frs,frs->fs", a, b) for a, b in pairs])
+
+    def _forecast(self, timestamp, x, residuals, trends):
+        a, b = self.coefficients()
+        slots = slot_of_week(
+            [timestamp + minutes * 60 for minutes in self.horizons], self.timezone
+        )
+        forecast = self._means(slots) + a * residuals[:, None] + b * trends[:, None]
+        # No baseline yet: the count stays the same
+        forecast = np.where(np.isnan(forecast), x[:, None], forecast)
+        # A station can't hold more than it's got bikes and free docks
+        capacity = np.nansum(x, axis=0)
+        return np.clip(forecast, 0, capacity)
+
+    def _fit_baselines(self, times, columns, indices, start, end):
+        slots = slot_of_week(times[start:end], self.timezone)
+        cells = (slots[:, None] * len(self.station_ids) + indices).ravel()
+        size = SLOTS * len(self.station_ids)
+        for f, column in enumerate(columns):
+            values = np.asarray(column[start:end]).ravel()
+            valid = values != MISSING
+            self._sums[f] += np.bincount(
+                cells[valid], values[valid], minlength=size
+            ).reshape(SLOTS, -1)
+            self._counts[f] += np.bincount(cells[valid], minlength=size).reshape(
+                SLOTS, -1
+            )
+
+    def _fit_trends(self, times, columns, indices, means, start, end, since):
+        """Add the pairs of frames starting between "start" and "end" to the
+        trend regression; frames are paired by timestamp, so gaps are fine"""
+        end = min(end, len(times))
+        first = int(np.searchsorted(times, times[start] - TREND * 60))
+        last = int(
+            np.searchsorted(times, times[end - 1] + max(self.horizons) * 60, "right")
+        )
+        window = np.asarray(times[first:last])
+        x = np.stack([np.asarray(column[first:last], np.float32) for column in columns])
+        x[x == MISSING] = np.nan
+        residuals = x - means[:, slot_of_week(window, self.timezone)]
+        origins = np.arange(start - first, end - first)
+
+        def paired(seconds):
+            """Index in the window of the frame "seconds" after each origin,
+            and whether there's one"""
+            wanted = window[origins] + seconds
+            found = np.minimum(np.searchsorted(window, wanted), len(window) - 1)
+            return found, window[found] == wanted
+
+        back, recent = paired(-TREND * 60)
+        trends = np.where(recent[:, None], np.nan_to_num(x[:, origins] - x[:, back]), 0)
+        terms = self._pair_terms(residuals[:, origins], trends)
+        for h, minutes in enumerate(self.horizons):
+            ahead, found = paired(minutes * 60)
+            if since is not None:
+                found &= window[ahead] > since
+            targets = np.where(found[:, None], residuals[:, ahead], np.nan)
+            self._stats[:, :, h, indices] += self._pair_sums(terms, targets)
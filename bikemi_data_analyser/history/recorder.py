@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Recorder:
+    """Append the stations of the latest snapshot to a HistoryStore every
+    "interval" seconds, on the interval boundaries.
+
+    Snapshots older than "max_age" seconds, twice the interval by default,
+    are skipped: they're the ones kept while upstream is down, and their
+    counts aren't the ones at the time of the sample.
+    """
+
+    def __init__(self, store, snapshots, interval=60, max_age=None):
+        self.store = store
+        self.snapshots = snapshots
+        self.interval = interval
+        self.max_age = max_age or 2 * interval
+        self.stopped = threading.Event()
+
+    def record(self, timestamp=None):
+        """Append the current snapshot to the store, unless it's too old;
+        return it, or None when it was skipped"""
+        snapshot = self.snapshots.get()
+        if snapshot.age() > self.max_age:
+            return None
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        self.store.append(timestamp, snapshot.stations)
+        return snapshot
+
+    def run(self):
+        """Record until stop() is called"""
+        try:
+            while True:
+                now = time.time()
+                sample_at = (now // self.interval + 1) * self.interval
+                if self.stopped.wait(sample_at - now):
+                    break
+                try:
+                    snapshot = self.record(sample_at)
+                    if snapshot is None:
+                        logger.warning("Skipped a sample: the stations are too old")
+                        continue
+                    logger.info(
+                        "Recorded %d stations (version %d)",
+                        len(snapshot.stations),
+                        snapshot.version,
+                    )
+                except Exception:
+                    # Skip this sample, the next one may go better
+                    logger.exception("Couldn't record the stations")
+        finally:
+            self.store.close()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,204 @@
+import json
+import os
+
+import numpy as np
+
+# Counts recorded for each station
+FIELDS = ("bike", "ebike", "ebike_with_childseat", "availableDocks")
+# Value of a station that's missing from a sample, counts are capped below it
+MISSING = 255
+
+
+class HistoryStore:
+    """Append-only columnar store of the station counts over time.
+
+    Each sample is a frame: one timestamp, in the "time" column, and one
+    uint8 per station slot in each of the FIELDS columns, so a column is a
+    (frames, width) matrix on disk that readers memory-map without copying.
+    Stations get the next free slot the first time they're seen; the
+    station_ids of the slots are kept in meta.json.
+
+    Appends write the field columns first and the time column last: frames
+    past the end of the time column are leftovers of a crash and are
+    truncated the next time the store is opened for writing. compact()
+    rewrites the columns in a new generation of files, wider if needed, and
+    only switches meta.json to it once they're complete.
+
+    A store is only created, "width" slots wide, when "create" is set:
+    otherwise opening a directory without one raises FileNotFoundError,
+    rather than reading an empty history out of a mistyped path.
+    """
+
+    def __init__(self, path, width=64, sync=False, create=False):
+        self.path = path
+        self.sync = sync
+        meta = os.path.join(path, "meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                self.meta = json.load(f)
+        elif create:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {"generation": 0, "width": width, "stations": []}
+            self._save_meta()
+        else:
+            raise FileNotFoundError("No history store in {}".format(path))
+        self.slots = {
+            station_id: slot for slot, station_id in enumerate(self.meta["stations"])
+        }
+        self._files = None
+
+    @property
+    def width(self):
+        return self.meta["width"]
+
+    @property
+    def station_ids(self):
+        return self.meta["stations"]
+
+    def __len__(self):
+        """Number of complete frames"""
+        return _size(self._file("time")) // 8
+
+    # Writing
+
+    def append(self, timestamp, stations):
+        """Record a frame with the counts of "stations" at "timestamp"
+        (seconds since the epoch)"""
+        columns = {
+            field: np.array([[station.get(field, -1) for station in stations]])
+            for field in FIELDS
+        }
+        self.extend([timestamp], [station.station_id for station in stations], columns)
+
+    def extend(self, timestamps, station_ids, columns):
+        """Record several frames at once: "columns" maps each of the FIELDS to
+        a (frames, stations) array with the counts of "station_ids" at each of
+        the "timestamps", negative when unknown"""
+        new = [station_id for station_id in station_ids if station_id not in self.slots]
+        if new:
+            self._add_stations(new)
+        if self._files is None:
+            self._open_files()
+
+        slots = np.array([self.slots[station_id] for station_id in station_ids], int)
+        for field in FIELDS:
+            counts = np.asarray(columns[field])
+            block = np.full((len(timestamps), self.width), MISSING, np.uint8)
+            block[:, slots] = np.where(
+                counts < 0, MISSING, np.minimum(counts, MISSING - 1)
+            )
+            self._write(field, block.tobytes())
+        # The frames only exist once their timestamps are written
+        self._write("time", np.asarray(timestamps, np.int64).tobytes())
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+    def compact(self, older_than=None, interval=None, width=None):
+        """Rewrite the store in a new generation of files, "width" slots wide.
+        When "interval" is given, frames older than "older_than" (a timestamp,
+        by default all of them) are thinned out to at most one every
+        "interval" seconds"""
+        self.close()
+        times = np.array(self.times())
+        keep = np.ones(len(times), bool)
+        if interval and len(times):
+            if older_than is None:
+                keep[:] = False
+            else:
+                keep = times >= older_than
+            buckets = times // interval
+            # Keep the first frame of each bucket
+            keep[0] = True
+            keep[1:] |= buckets[1:] != buckets[:-1]
+
+        width = width or self.width
+        shared = min(width, self.width)
+        generation = self.meta["generation"] + 1
+        columns = {"time": times[keep]}
+        for field in FIELDS:
+            values = np.full((int(keep.sum()), width), MISSING, np.uint8)
+            values[:, :shared] = self.column(field)[keep, :shared]
+            columns[field] = values
+        for name, values in columns.items():
+            with open(self._file(name, generation), "wb") as f:
+                f.write(values.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        previous = self.meta["generation"]
+        self.meta["generation"] = generation
+        self.meta["width"] = width
+        self._save_meta()
+        for name in ("time",) + FIELDS:
+            if os.path.exists(self._file(name, previous)):
+                os.remove(self._file(name, previous))
+
+    # Reading
+
+    def times(self):
+        """Timestamps of the frames, memory-mapped"""
+        return self._map("time", np.int64, (len(self),))
+
+    def column(self, field):
+        """(frames, width) matrix of a field, memory-mapped; MISSING marks the
+        slots without a station at that time"""
+        return self._map(field, np.uint8, (len(self), self.width))
+
+    def _map(self, name, dtype, shape):
+        if not shape[0]:
+            return np.empty(shape, dtype)
+        return np.memmap(self._file(name), dtype, "r", shape=shape)
+
+    # Internals
+
+    def _file(self, name, generation=None):
+        if generation is None:
+            generation = self.meta["generation"]
+        extension = "i8" if name == "time" else "u1"
+        return os.path.join(self.path, "{}.{}.{}".format(name, generation, extension))
+
+    def _open_files(self):
+        """Open the columns for appending, dropping any half-written frame"""
+        frames = len(self)
+        self._files = {}
+        for name in ("time",) + FIELDS:
+            size = frames * (8 if name == "time" else self.width)
+            f = open(self._file(name), "ab")
+            f.truncate(size)
+            self._files[name] = f
+
+    def _write(self, name, data):
+        f = self._files[name]
+        f.write(data)
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+
+    def _add_stations(self, station_ids):
+        self.meta["stations"] = self.meta["stations"] + station_ids
+        for station_id in station_ids:
+            self.slots[station_id] = len(self.slots)
+        if len(self.slots) > self.width:
+            # Make room for the new stations, and a few more
+            self.compact(width=len(self.slots) + len(self.slots) // 8 + 16)
+        else:
+            self._save_meta()
+
+    def _save_meta(self):
+        temporary = os.path.join(self.path, "meta.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, os.path.join(self.path, "meta.json"))
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
@@ -1,13 +1,37 @@
 from bikemi_data_analyser.api.bikemi import BikeMiApi
-from bikemi_data_analyser.telegram_bot.tools import Tools
+from bikemi_data_analyser.api.image import load_image, save_image
+from bikemi_data_analyser.api.metrics import METRICS, MetricsServer, SamplingProfiler
+from bikemi_data_analyser.api.snapshot import SnapshotStore
+from bikemi_data_analyser.api.systems import SystemRegistry
+from bikemi_data_analyser.history.forecast import Forecaster
+from bikemi_data_analyser.history.recorder import Recorder
+from bikemi_data_analyser.history.store import HistoryStore
+from bikemi_data_analyser.telegram_bot.cards import (
+    StationCards,
+    card_text,
+    forecast_text,
+)
+from bikemi_data_analyser.telegram_bot.geocode import (
+    GAZETTEER,
+    GeocodeCache,
+    LazyGeocoder,
+    load_gazetteer,
+    place_key,
+)
+from bikemi_data_analyser.telegram_bot.results import SearchResults
+from bikemi_data_analyser.telegram_bot.tools import (
+    AVAILABILITY_NAMES,
+    NEAREST_WITH,
+    Tools,
+)
+from bikemi_data_analyser.telegram_bot.watch import Outbox, Watch, WatchList
+from bikemi_data_analyser.telegram_bot.workers import FULL, ChatPool
 
 import os
 import logging
 import sys
-import json
 
 from emojis import encode
-from geopy.geocoders import MapBox
 from telegram import (
     ChatAction,
     Update,
@@ -21,14 +45,98 @@ from telegram.ext import (
     MessageHandler,
     Updater,
 )
+from functools import partial
 from threading import Thread
 
+logger = logging.getLogger(__name__)
+
+# Heading of a page of search results, followed by its numbered lines
+SEARCH_PAGE = encode(":mag_right: Found {} stations, page {} of {}\n")
+
 
 class TelegramBot:
-    STATION_INFO = "https://gbfs.urbansharing.com/bikemi.com/station_information.json"
+    # Json list of the bike-share systems as read by SystemRegistry.load(), and
+    # the one the bot serves; BikeMi alone when there's no list
+    SYSTEMS = os.environ.get("BIKEMI_SYSTEMS")
+    SYSTEM = os.environ.get("BIKEMI_SYSTEM", "bikemi")
+    # /stations of a running "serve" command, to share its fetch with it
+    API_URL = os.environ.get("BIKEMI_API_URL")
+    # Seconds before the stations snapshot is considered stale
+    SNAPSHOT_TTL = float(os.environ.get("BIKEMI_SNAPSHOT_TTL", 60))
+    # Seconds after which a snapshot kept while upstream is down no longer
+    # counts as the current availability: it isn't forecast from, and the
+    # watches don't take its counts for the ones right now
+    SNAPSHOT_MAX_AGE = 2 * SNAPSHOT_TTL
+    # Maximum number of stations found by a search, and shown in each page
+    SEARCH_RESULTS = 50
+    PAGE_SIZE = 5
+    # Where the geocoded places are kept across restarts
+    GEOCODE_CACHE = os.environ.get(
+        "BIKEMI_GEOCODE_CACHE",
+        os.path.expanduser("~/.cache/bikemi_data_analyser/geocode.sqlite3"),
+    )
+    # Handlers running at once, and messages each chat can have waiting
+    WORKERS = int(os.environ.get("BIKEMI_WORKERS", 8))
+    CHAT_QUEUE = int(os.environ.get("BIKEMI_CHAT_QUEUE", 4))
+    # Where the /watch subscriptions are kept across restarts
+    WATCHES = os.environ.get(
+        "BIKEMI_WATCHES",
+        os.path.expanduser("~/.cache/bikemi_data_analyser/watches.json"),
+    )
+    # Json file of well known places answered offline, empty to disable it
+    GAZETTEER = os.environ.get("BIKEMI_GAZETTEER", GAZETTEER)
+    # Port of the local Prometheus endpoint, none to record no metrics
+    METRICS_PORT = os.environ.get("BIKEMI_METRICS_PORT")
+    # Set to 1 to sample the stacks, served at /profile by the metrics endpoint
+    PROFILE = os.environ.get("BIKEMI_PROFILE") == "1"
+    # Where the snapshot and the geocoded places are saved on restart, to be
+    # answered from right away by the next process; empty to disable it
+    IMAGE = os.environ.get(
+        "BIKEMI_IMAGE",
+        os.path.expanduser("~/.cache/bikemi_data_analyser/warm.img"),
+    )
+    # Seconds after which a saved image is too old to start from
+    IMAGE_MAX_AGE = float(os.environ.get("BIKEMI_IMAGE_MAX_AGE", 600))
+    # History store written by the "record" command, to forecast the counts
+    # from; none to show no forecast
+    HISTORY = os.environ.get("BIKEMI_HISTORY")
+    # Where the forecasting model is kept across restarts
+    FORECAST = os.environ.get(
+        "BIKEMI_FORECAST",
+        os.path.expanduser("~/.cache/bikemi_data_analyser/forecast.npz"),
+    )
+    # Meters walked in a minute, to forecast the counts for when the user gets there
+    WALKING_SPEED = 80
+    # Places are geocoded near the centre of the system's stations, near this
+    # one (the Duomo) until there's a snapshot
+    PROXIMITY = (45.464228552423435, 9.191557965278111)
 
     tools = Tools()
-    api = BikeMiApi()
+    # Rendered once per snapshot version
+    cards = StationCards(tools)
+    # Refreshes the system's snapshots once main() runs
+    systems = SystemRegistry.load(SYSTEMS, names=[SYSTEM], ttl=SNAPSHOT_TTL)
+    # Shared by every handler
+    snapshots = (
+        SnapshotStore(
+            partial(BikeMiApi().get_served_stations, API_URL), ttl=SNAPSHOT_TTL
+        )
+        if API_URL
+        else systems.get(SYSTEM).snapshots
+    )
+    # Opened by main(), so that importing the bot doesn't create the database
+    geocoder = None
+    # Whether the geocoder is biased towards the centre of the stations yet
+    centred = False
+    # Results of the recent searches, browsed a page at a time
+    results = SearchResults(limit=SEARCH_RESULTS)
+    # Stations watched by the chats, checked against each snapshot's delta;
+    # loaded by main(), so that importing the bot doesn't touch WATCHES
+    watches = None
+    # Runs the handlers that reach upstream, off the dispatcher thread
+    pool = ChatPool(WORKERS, CHAT_QUEUE)
+    # Trained in the background once main() runs, when there's a history
+    forecaster = None
 
     # Logging
     logging.basicConfig(
@@ -48,86 +156,122 @@ class TelegramBot:
     # BikeMi time
 
     def pull_stations(self):
-        """Access the API and create vars"""
-        stations_full_info = json.loads(
-            self.api.get_station_full_info_json(self.STATION_INFO)
-        )
-        return stations_full_info
+        """Get the stations from the latest shared snapshot"""
+        return self.snapshots.get().stations
 
     def print_result(self, station_raw):
         """Display station's info"""
-        stationInfo = (
-            encode(":busstop: Name: ")
-            + station_raw["title"]
-            + "\n"
-            + encode(":round_pushpin: Address: ")
-            + station_raw["address"]
-            + "\n"
-            + encode(":bike: Bikes: ")
-            + str(station_raw["bike"])
-            + "\n"
-            + encode(":zap: Electric Bikes: ")
-            + str(station_raw["ebike"])
-            + "\n"
-            + encode(":seat: Electric Bikes with Child Seat: ")
-            + str(station_raw["ebike_with_childseat"])
-            + "\n"
-            + encode(":parking: Available docks: ")
-            + str(station_raw["availableDocks"])
+        return card_text(station_raw)
+
+    def submit(self, update, handler, *args, key=None):
+        """Run handler(update, *args) on the pool, in the queue of the update's
+        chat, or right away if the pool isn't running"""
+        if not self.pool.running:
+            handler(update, *args)
+            return
+        status = self.pool.submit(
+            update.effective_chat.id, handler, update, *args, key=key
         )
-        return stationInfo
+        if status == FULL:
+            update.message.reply_text(
+                encode(
+                    ":hourglass: Still working on your previous messages, please wait"
+                )
+            )
+
+    def search_page(self, snapshot, token, stations, page):
+        """Return the text and the Inline Keyboard Buttons of a page of search
+        results, from the lines rendered once per snapshot version"""
+        pages = (len(stations) + self.PAGE_SIZE - 1) // self.PAGE_SIZE
+        first = page * self.PAGE_SIZE
+        text = SEARCH_PAGE.format(len(stations), page + 1, pages) + "".join(
+            "\n{}. {}".format(number, self.cards.line(snapshot, station))
+            for number, station in enumerate(
+                stations[first : first + self.PAGE_SIZE], first + 1
+            )
+        )
+        reply_markup = self.tools.search_page_buttons(
+            stations[first : first + self.PAGE_SIZE], token, page, pages, first + 1
+        )
+        return text, reply_markup
 
+    @METRICS.timed("search_station")
     def search_station(self, update, context, place):
         # Typing...
         context.bot.send_chat_action(
             chat_id=update.effective_chat.id, action=ChatAction.TYPING
         )
-        stations_full_info = self.pull_stations()
-
-        for station_raw in self.api.find_station(stations_full_info, place):
-            if station_raw != None:
-                station = self.print_result(station_raw)
-                reply_markup = self.tools.inline_keyboard_buttons(station_raw)
-                # Send Text
-                update.message.reply_text(
-                    station,
-                    reply_markup=reply_markup,
-                )
-            else:
-                update.message.reply_text(
-                    encode(
-                        ":x: This BikeMi station doesn't exist, please choose a new command"
-                    ),
-                    reply_markup=self.tools.custom_keyboard(),
-                )
+        snapshot = self.snapshots.get()
+        with METRICS.span("search"):
+            token, found_station_list = self.results.search(snapshot, place)
 
-    def search_nearest(self, update, context, place):
+        if not found_station_list:
+            update.message.reply_text(
+                encode(
+                    ":x: This BikeMi station doesn't exist, please choose a new command"
+                ),
+                reply_markup=self.tools.custom_keyboard(),
+            )
+            return
+        # A single message, whatever the number of stations found
+        with METRICS.span("render"):
+            text, reply_markup = self.search_page(
+                snapshot, token, found_station_list, 0
+            )
+        with METRICS.span("telegram"):
+            update.message.reply_text(text, reply_markup=reply_markup)
+
+    @METRICS.timed("search_page_callback")
+    def search_page_callback(self, update, context):
+        """Show another page of search results in place of the current one"""
+        query = update.callback_query
+        _, token, page = query.data.split(":")
+        snapshot = self.snapshots.get()
+        found_station_list = self.results.get(snapshot, token)
+        if not found_station_list:
+            query.answer("This search expired, please search again")
+            return
+        query.answer()
+        page = min(int(page), (len(found_station_list) - 1) // self.PAGE_SIZE)
+        text, reply_markup = self.search_page(snapshot, token, found_station_list, page)
+        query.edit_message_text(text, reply_markup=reply_markup)
+
+    @METRICS.timed("station_callback")
+    def station_callback(self, update, context):
+        """Send the details of a station picked among the search results"""
+        query = update.callback_query
+        station_id = query.data.split(":", 1)[1]
+        snapshot = self.snapshots.get()
+        station_raw = snapshot.by_id.get(station_id)
+        if station_raw is None:
+            query.answer("This station doesn't exist anymore")
+            return
+        query.answer()
+        station, reply_markup = self.cards.get(snapshot, station_raw)
+        station += self.forecast_line(station_raw)
+        context.bot.send_message(
+            chat_id=update.effective_chat.id, text=station, reply_markup=reply_markup
+        )
+
+    @METRICS.timed("search_nearest")
+    def search_nearest(self, update, context, place, available=None):
         # Typing...
         context.bot.send_chat_action(
             chat_id=update.effective_chat.id, action=ChatAction.TYPING
         )
-        # Setup MapBox
-        mapbox_token = os.environ.get("MAPBOX_TOKEN")
-        geolocator = MapBox(mapbox_token)
-        proximity = (45.464228552423435, 9.191557965278111)  # Duomo
-        location = geolocator.geocode(place, proximity=proximity)
-
-        stations_full_info = self.pull_stations()
-        station_raw = self.api.get_nearest_station(
-            stations_full_info, location.latitude, location.longitude
-        )
-        reply_markup = self.tools.inline_keyboard_buttons(station_raw)
-
-        # Generate Text Message
-        station = self.print_result(station_raw)
-        nearest_station = "The nearest station is: \n" + station
-        # Send text
-        update.message.reply_text(
-            nearest_station,
-            reply_markup=reply_markup,
-        )
+        self.centre_geocoder()
+        with METRICS.span("geocode"):
+            location = self.geocoder.geocode(place)
+        if location is None:
+            update.message.reply_text(
+                encode(":x: I couldn't find this place, please choose a new command"),
+                reply_markup=self.tools.custom_keyboard(),
+            )
+            return
+        self.reply_nearest(update, *location, available)
 
-    def get_location(self, update, context):
+    @METRICS.timed("get_location")
+    def get_location(self, update, context, available=None):
         # Typing...
         context.bot.send_chat_action(
             chat_id=update.effective_chat.id, action=ChatAction.TYPING
@@ -136,26 +280,246 @@ class TelegramBot:
         user_location = update.message["location"]
         latitude = float(user_location["latitude"])
         longitude = float(user_location["longitude"])
-
-        stations_full_info = self.pull_stations()
-        station_raw = self.api.get_nearest_station(
-            stations_full_info, latitude, longitude
-        )
-        reply_markup = self.tools.inline_keyboard_buttons(station_raw)
+        self.reply_nearest(update, latitude, longitude, available)
+
+    def reply_nearest(self, update, latitude, longitude, available=None):
+        """Send the nearest station to a point, with at least the "available"
+        counts if given"""
+        snapshot = self.snapshots.get()
+        with METRICS.span("nearest"):
+            found = snapshot.spatial.nearest(latitude, longitude, available=available)
+        if not found:
+            if available:
+                text = encode(":x: No station has {} right now").format(
+                    self.tools.describe_availability(available)
+                )
+            else:
+                text = encode(":x: There are no stations right now, please try later")
+            update.message.reply_text(text, reply_markup=self.tools.custom_keyboard())
+            return
+        station_raw, distance = found[0]
+        station, reply_markup = self.cards.get(snapshot, station_raw)
+        station += self.forecast_line(station_raw, distance / self.WALKING_SPEED)
 
         # Generate Text Message
-        station = self.print_result(station_raw)
-        nearest_station = "The nearest station is: \n" + station
+        if available:
+            nearest_station = "The nearest station with {} is: \n".format(
+                self.tools.describe_availability(available)
+            )
+        else:
+            nearest_station = "The nearest station is: \n"
+        nearest_station += station
         # Send text
+        with METRICS.span("telegram"):
+            update.message.reply_text(
+                nearest_station,
+                reply_markup=reply_markup,
+            )
+
+    @METRICS.timed("watch_command")
+    def watch_command(self, update, context):
+        """/watch <station>: pick what to be notified of at a station"""
+        place = " ".join(context.args)
+        if not place:
+            watches = self.watches.for_chat(update.effective_chat.id)
+            snapshot = self.snapshots.get()
+            lines = [encode(":mag_right: Send /watch followed by a station")]
+            for watch in watches:
+                station = snapshot.by_id.get(watch.station_id)
+                lines.append(
+                    encode(":eyes: {}: {}").format(
+                        station["title"] if station else watch.station_id,
+                        self.tools.describe_availability({watch.field: watch.minimum}),
+                    )
+                )
+            if watches:
+                lines.append("/unwatch to stop watching them")
+            update.message.reply_text("\n".join(lines))
+            return
+        found = self.snapshots.get().search.search(place, k=1)
+        if not found:
+            update.message.reply_text(
+                encode(":x: This BikeMi station doesn't exist"),
+            )
+            return
         update.message.reply_text(
-            nearest_station,
-            reply_markup=reply_markup,
+            encode(":bell: Notify me when {} has:").format(found[0]["title"]),
+            reply_markup=self.tools.watch_buttons(found[0]),
+        )
+
+    @METRICS.timed("watch_callback")
+    def watch_callback(self, update, context):
+        """Start watching the station and field picked with the watch buttons"""
+        query = update.callback_query
+        station_id, field = query.data.split(":", 1)[1].rsplit(":", 1)
+        snapshot = self.snapshots.get()
+        station_raw = snapshot.by_id.get(station_id)
+        if station_raw is None:
+            query.answer("This station doesn't exist anymore")
+            return
+        query.answer()
+        wanted = self.tools.describe_availability({field: 1})
+        age = snapshot.age()
+        if station_raw.get(field, 0) >= 1 and age <= self.SNAPSHOT_MAX_AGE:
+            text = encode(":white_check_mark: {} already has {} right now").format(
+                station_raw["title"], wanted
+            )
+        elif self.watches.add(Watch(update.effective_chat.id, station_id, field)):
+            text = encode(":bell: I'll tell you when {} has {}").format(
+                station_raw["title"], wanted
+            )
+            if age > self.SNAPSHOT_MAX_AGE:
+                text += " (the latest counts I have are {} minutes old)".format(
+                    round(age / 60)
+                )
+        else:
+            text = encode(
+                ":x: You're watching too many stations, /unwatch some of them first"
+            )
+        query.edit_message_text(text)
+
+    def unwatch_command(self, update, context):
+        """/unwatch: stop watching every station"""
+        removed = self.watches.remove(update.effective_chat.id)
+        update.message.reply_text(
+            encode(":thumbsup: Stopped watching {} stations").format(removed)
+        )
+
+    def notify_watchers(self, delta):
+        """Queue a notification for each watch the delta fulfils"""
+        fired = self.watches.triggered(delta)
+        if not fired:
+            return
+        snapshot = self.snapshots.get()
+        for watch, count in fired:
+            station = snapshot.by_id.get(watch.station_id)
+            _, singular, plural = AVAILABILITY_NAMES[watch.field]
+            self.outbox.put(
+                watch.chat_id,
+                encode(":bell: {} now has {} {}").format(
+                    station["title"] if station else watch.station_id,
+                    count,
+                    singular if count == 1 else plural,
+                ),
+            )
+
+    def forecast_line(self, station, minutes=15):
+        """Card line with the counts forecast at the station in about
+        "minutes" minutes, empty until there's a forecast or while the
+        snapshot is too old to forecast from"""
+        snapshot = self.snapshots.peek()
+        if snapshot is None or snapshot.age() > self.SNAPSHOT_MAX_AGE:
+            return ""
+        forecaster = self.forecaster
+        forecast = forecaster and forecaster.predict(station.station_id, minutes)
+        if not forecast:
+            return ""
+        return forecast_text(forecast, forecaster.horizon(minutes))
+
+    def start_forecasts(self):
+        """Train the forecasts on the recorded history in the background,
+        starting from the saved model if any, then fold the snapshot in
+        every minute"""
+
+        def train():
+            forecaster = None
+            if os.path.exists(self.FORECAST):
+                try:
+                    forecaster = Forecaster.load(self.FORECAST)
+                except Exception:
+                    logger.exception("Couldn't load the forecasts at %s", self.FORECAST)
+            forecaster = forecaster or Forecaster()
+            try:
+                store = HistoryStore(self.HISTORY)
+            except FileNotFoundError:
+                # Still learn from the snapshots from now on
+                logger.exception("Couldn't train the forecasts on the history")
+            else:
+                forecaster.fit(store, since=forecaster.trained_until)
+                store.close()
+                logger.info("Forecasts trained until %s", forecaster.trained_until)
+            self.forecaster = forecaster
+            Recorder(forecaster, self.snapshots, max_age=self.SNAPSHOT_MAX_AGE).run()
+
+        Thread(target=train, daemon=True).start()
+
+    def save_forecasts(self):
+        if self.forecaster is None:
+            return
+        try:
+            self.forecaster.save(self.FORECAST)
+        except Exception:
+            logger.exception("Couldn't save the forecasts at %s", self.FORECAST)
+
+    def open_geocoder(self, places=()):
+        """Build the geocoder, with the places kept in GEOCODE_CACHE and the
+        "places" saved by load_image() in memory. Nothing is fetched: places
+        are biased towards PROXIMITY until centre_geocoder() sees a snapshot"""
+        self.geocoder = GeocodeCache(
+            LazyGeocoder("MapBox", os.environ.get("MAPBOX_TOKEN")),
+            path=self.GEOCODE_CACHE,
+            gazetteer=load_gazetteer(self.GAZETTEER) if self.GAZETTEER else None,
+            proximity=self.PROXIMITY,
         )
+        self.centred = False
+        self.centre_geocoder()
+        self.geocoder.preload(places)
+
+    def centre_geocoder(self):
+        """Bias the geocoder towards the centre of the system's stations, once
+        there's a snapshot with some"""
+        if self.centred:
+            return
+        snapshot = self.snapshots.peek()
+        centre = snapshot and snapshot.spatial.centre
+        if centre:
+            self.geocoder.options["proximity"] = centre
+            self.centred = True
+
+    def save_image(self):
+        """Save the current snapshot and the geocoded places in memory"""
+        snapshot = self.snapshots.peek()
+        if not self.IMAGE or snapshot is None:
+            return
+        try:
+            save_image(self.IMAGE, snapshot, {"geocode": self.geocoder.entries()})
+        except Exception:
+            logger.exception("Couldn't save the image at %s", self.IMAGE)
+
+    def load_image(self):
+        """Start from the image saved by the previous process, when there's a
+        recent enough one; return the geocoded places saved along with it,
+        for open_geocoder(), none when it wasn't used"""
+        if not self.IMAGE or not os.path.exists(self.IMAGE):
+            return ()
+        try:
+            snapshot, extra = load_image(self.IMAGE)
+        except Exception:
+            logger.exception("Couldn't load the image at %s", self.IMAGE)
+            return ()
+        if snapshot.age() > self.IMAGE_MAX_AGE or not self.snapshots.seed(snapshot):
+            return ()
+        return extra.get("geocode", ())
+
+    def start_metrics(self, port):
+        """Record the metrics and serve them on a local Prometheus endpoint"""
+        METRICS.enable()
+        METRICS.collect("snapshot", self.snapshots.stats)
+        METRICS.collect("geocode", self.geocoder.stats)
+        METRICS.collect("pool", self.pool.stats)
+        METRICS.collect("outbox", self.outbox.stats)
+        METRICS.collect("watches", lambda: {"count": len(self.watches)})
+        profiler = None
+        if self.PROFILE:
+            profiler = SamplingProfiler()
+            profiler.start()
+        MetricsServer(port=port, profiler=profiler).start()
 
     # Start ConversationHandler functions
     HANDLE_COMMAND = range(1)
 
     def read_command(self, update: Update, context: CallbackContext) -> int:
+        context.user_data.pop("available", None)
 
         if update.message.text == "/search" or update.message.text == encode(
             ":mag_right: Search Station"
@@ -175,6 +539,19 @@ class TelegramBot:
             )
             context.user_data["command"] = "nearest"
 
+        elif self.nearest_with(update.message.text):
+            # e.g. "/nearest_ebike 2" for the nearest station with 2 e-bikes
+            field, minimum = self.nearest_with(update.message.text)
+            update.message.reply_text(
+                encode(
+                    ":walking: Enter a place, or share your location, to get the"
+                    " nearest station with {} \n \n /cancel"
+                ).format(self.tools.describe_availability({field: minimum})),
+                reply_markup=self.tools.custom_keyboard(),
+            )
+            context.user_data["command"] = "nearest"
+            context.user_data["available"] = {field: minimum}
+
         elif update.message.text == "/location":
             reply_markup = self.tools.custom_keyboard()
             update.message.reply_text(
@@ -205,19 +582,47 @@ class TelegramBot:
 
         return self.HANDLE_COMMAND
 
+    def nearest_with(self, text):
+        """Return the (field, minimum) asked for by a "nearest station with"
+        command or button, or None"""
+        command, _, argument = text.strip().partition(" ")
+        for name, (field, button) in NEAREST_WITH.items():
+            if command == "/" + name or (button and text == encode(button)):
+                minimum = int(argument) if argument.strip().isdigit() else 1
+                return field, max(minimum, 1)
+        return None
+
     def handle_command(self, update: Update, context: CallbackContext) -> int:
         context.user_data["place"] = update.message.text
         place = context.user_data["place"]
         context.user_data["location"] = update.message["location"]
 
+        # The replies are sent from the pool, the conversation ends right away
         if context.user_data["command"] == "search":
-            self.search_station(update, context, place)
+            self.submit(
+                update,
+                self.search_station,
+                context,
+                place,
+                key=("search", place_key(place)),
+            )
 
         if context.user_data["command"] == "nearest":
-            self.search_nearest(update, context, place)
+            available = context.user_data.get("available")
+            if update.message.location:
+                self.submit(update, self.get_location, context, available)
+            else:
+                self.submit(
+                    update,
+                    self.search_nearest,
+                    context,
+                    place,
+                    available,
+                    key=("nearest", place_key(place), str(available)),
+                )
 
         if context.user_data["command"] == "location":
-            self.get_location(update, context)
+            self.submit(update, self.get_location, context)
 
         return ConversationHandler.END
 
@@ -242,6 +647,9 @@ class TelegramBot:
     # End ConversationHandler functions
 
     def main(self):
+        # Answer from the previous process' snapshot until the first refresh
+        self.open_geocoder(self.load_image())
+        self.watches = WatchList(self.WATCHES)
         telegram_token = os.environ.get("TELEGRAM_TOKEN")
         updater = Updater(token=telegram_token, use_context=True)
 
@@ -256,6 +664,12 @@ class TelegramBot:
         def stop_and_restart():
             """Gracefully stop the Updater and replace the current process with a new one"""
             updater.stop()
+            self.pool.stop()
+            self.snapshots.deltas.unsubscribe(self.notify_watchers)
+            self.outbox.stop()
+            self.snapshots.stop()
+            self.save_image()
+            self.save_forecasts()
             os.execl(sys.executable, sys.executable, *sys.argv)
 
         # Function to stop the bot from the chat
@@ -268,6 +682,19 @@ class TelegramBot:
             CommandHandler("r", restart, filters=Filters.user(username="@zzkW35"))
         )
 
+        # Station watches, before the conversation catches any text
+        self.dispatcher.add_handler(CommandHandler("watch", self.watch_command))
+        self.dispatcher.add_handler(CommandHandler("unwatch", self.unwatch_command))
+        self.dispatcher.add_handler(
+            CallbackQueryHandler(self.watch_callback, pattern="^watch:")
+        )
+
+        # "Nearest station with" commands and buttons
+        nearest_with_commands = list(NEAREST_WITH)
+        nearest_with_buttons = Filters.regex(
+            "|".join(encode(button) for _, button in NEAREST_WITH.values() if button)
+        )
+
         # Build conv handler
         conv_handler = ConversationHandler(
             entry_points=[
@@ -281,6 +708,8 @@ class TelegramBot:
                     Filters.regex(encode(":walking: Nearest Station")),
                     self.read_command,
                 ),
+                CommandHandler(nearest_with_commands, self.read_command),
+                MessageHandler(nearest_with_buttons, self.read_command),
                 CommandHandler("location", self.read_command),
                 MessageHandler(
                     Filters.text
@@ -291,6 +720,7 @@ class TelegramBot:
                         | Filters.regex("/location")
                         | Filters.regex(encode(":mag_right: Search Station"))
                         | Filters.regex(encode(":walking: Nearest Station"))
+                        | nearest_with_buttons
                     ),
                     self.read_command,
                 ),
@@ -303,6 +733,7 @@ class TelegramBot:
                             Filters.command
                             | Filters.regex(encode(":mag_right: Search Station"))
                             | Filters.regex(encode(":walking: Nearest Station"))
+                            | nearest_with_buttons
                         ),
                         self.handle_command,
                     )
@@ -320,6 +751,8 @@ class TelegramBot:
                     Filters.regex(encode(":walking: Nearest Station")),
                     self.wrong_input,
                 ),
+                CommandHandler(nearest_with_commands, self.wrong_input),
+                MessageHandler(nearest_with_buttons, self.wrong_input),
                 CommandHandler("location", self.wrong_input),
             ],
         )
@@ -327,19 +760,46 @@ class TelegramBot:
         self.dispatcher.add_handler(conv_handler)
 
         # Get Location handler
-        get_location_handler = MessageHandler(Filters.location, self.get_location)
+        get_location_handler = MessageHandler(
+            Filters.location,
+            lambda update, context: self.submit(update, self.get_location, context),
+        )
         self.dispatcher.add_handler(get_location_handler)
 
+        # Search results buttons
+        self.dispatcher.add_handler(
+            CallbackQueryHandler(self.search_page_callback, pattern="^search:")
+        )
+        self.dispatcher.add_handler(
+            CallbackQueryHandler(self.station_callback, pattern="^station:")
+        )
+
         # Callback query handler
         main_menu_handler = CallbackQueryHandler(self.tools.callback_query)
         self.dispatcher.add_handler(main_menu_handler)
 
+        # Notify the watchers as the snapshots change, within Telegram's limits
+        self.outbox = Outbox(updater.bot.send_message)
+        self.outbox.start()
+        self.snapshots.deltas.subscribe(self.notify_watchers)
+
+        # Keep the stations snapshot fresh in the background
+        self.snapshots.start()
+        self.pool.start()
+        if self.HISTORY:
+            self.start_forecasts()
+
+        if self.METRICS_PORT:
+            self.start_metrics(int(self.METRICS_PORT))
+
         # Start Bot
         updater.start_polling()
         # Run the bot until you press Ctrl-C or the process receives SIGINT,
         # SIGTERM or SIGABRT. This should be used most of the time, since
         # start_polling() is non-blocking and will stop the bot gracefully.
         updater.idle()
+        self.save_image()
+        self.save_forecasts()
 
 
 bot = TelegramBot()
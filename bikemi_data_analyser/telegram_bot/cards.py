@@ -0,0 +1,155 @@
+import threading
+
+from emojis import encode
+
+# Encoded once: only the station's values change from a card to the other
+CARD = encode(
+    ":busstop: Name: {title}\n"
+    ":round_pushpin: Address: {address}\n"
+    ":bike: Bikes: {bike}\n"
+    ":zap: Electric Bikes: {ebike}\n"
+    ":seat: Electric Bikes with Child Seat: {ebike_with_childseat}\n"
+    ":parking: Available docks: {availableDocks}"
+)
+
+# A station in a page of search results, after its number there
+RESULT = encode("{title}\n    :bike: {bike}  :zap: {ebike}  :parking: {availableDocks}")
+
+FORECAST = encode(
+    "\n:crystal_ball: In {minutes} min: {bike} bikes, {ebike} electric bikes, "
+    "{availableDocks} free docks"
+)
+
+
+def card_text(station):
+    """Display station's info"""
+    return CARD.format(
+        title=station["title"],
+        address=station["address"],
+        bike=station["bike"],
+        ebike=station["ebike"],
+        ebike_with_childseat=station["ebike_with_childseat"],
+        availableDocks=station["availableDocks"],
+    )
+
+
+def result_text(station):
+    """Line of a station in a page of search results, without its number"""
+    return RESULT.format(
+        title=station["title"],
+        bike=station.get("bike", "?"),
+        ebike=station.get("ebike", "?"),
+        availableDocks=station.get("availableDocks", "?"),
+    )
+
+
+def forecast_text(forecast, minutes):
+    """Line added to a card with the counts forecast in "minutes" minutes"""
+    return FORECAST.format(
+        minutes=minutes,
+        **{
+            field: "?" if forecast[field] is None else round(forecast[field])
+            for field in ("bike", "ebike", "availableDocks")
+        }
+    )
+
+
+class StationCards:
+    """Card text and Inline Keyboard Buttons of every station, and its line in
+    the search results, rendered once per snapshot version.
+
+    When the snapshot follows the one rendered last, only the stations in
+    its delta are rendered again, and their buttons only if they moved;
+    everything else is shared with the previous version.
+    """
+
+    def __init__(self, tools):
+        self.tools = tools
+        self._version = None
+        # station_id -> (text, reply_markup)
+        self._cards = {}
+        # station_id -> result_text()
+        self._lines = {}
+        self._lock = threading.Lock()
+
+    def get(self, snapshot, station):
+        """Return the (text, reply_markup) of a station of the snapshot"""
+        if not self._current(snapshot):
+            return self._card(station)
+        card = self._cards.get(station.station_id)
+        if card is None:
+            # Not part of the snapshot, or missing some of the fields
+            return self._card(station)
+        return card
+
+    def line(self, snapshot, station):
+        """Return the result_text() of a station of the snapshot"""
+        if not self._current(snapshot):
+            return result_text(station)
+        line = self._lines.get(station.station_id)
+        if line is None:
+            return result_text(station)
+        return line
+
+    def _current(self, snapshot):
+        """Render the snapshot unless it is already; return False for an older
+        one than the last rendered, still held by some handler"""
+        if self._version != snapshot.version:
+            if self._version is not None and snapshot.version < self._version:
+                return False
+            self._render(snapshot)
+        return True
+
+    def _render(self, snapshot):
+        with self._lock:
+            if self._version is not None and snapshot.version <= self._version:
+                return
+            delta = snapshot.delta
+            if self._version is not None and delta.previous_version == self._version:
+                cards = dict(self._cards)
+                lines = dict(self._lines)
+                for station_id in delta.removed:
+                    cards.pop(station_id, None)
+                    lines.pop(station_id, None)
+                for station_id, fields in delta.changed.items():
+                    station = snapshot.by_id[station_id]
+                    lines[station_id] = result_text(station)
+                    card = cards.get(station_id)
+                    if card is None or "lat" in fields or "lon" in fields:
+                        cards[station_id] = self._try_card(station)
+                    else:
+                        text = self._try_text(station)
+                        cards[station_id] = text and (text, card[1])
+                for station in delta.added:
+                    cards[station.station_id] = self._try_card(station)
+                    lines[station.station_id] = result_text(station)
+            else:
+                cards = {
+                    station.station_id: self._try_card(station)
+                    for station in snapshot.stations
+                }
+                lines = {
+                    station.station_id: result_text(station)
+                    for station in snapshot.stations
+                }
+            # Cards first: readers seeing the new version must find its cards and lines
+            self._cards = cards
+            self._lines = lines
+            self._version = snapshot.version
+
+    def _card(self, station):
+        return card_text(station), self.tools.inline_keyboard_buttons(station)
+
+    def _try_card(self, station):
+        """Render the card, or None if the station lacks some fields"""
+        try:
+            return self._card(station)
+        except KeyError:
+            return None
+
+    def _try_text(self, station):
+        """Render the card text, or None if the station lacks some fields"""
+        try:
+            return card_text(station)
+        except KeyError:
+            return None
@@ -0,0 +1,187 @@
+from bikemi_data_analyser.telegram_bot.workers import SingleFlight
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unidecode
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Places shipped with the bot, see load_gazetteer()
+GAZETTEER = os.path.join(os.path.dirname(__file__), "gazetteer.json")
+WORDS = re.compile("[a-z0-9]+")
+# City and country qualifiers, which don't change where a query points to
+# since it's biased towards Milan anyway, when they end it
+QUALIFIERS = {"milano", "milan", "mi", "italia", "italy"}
+# Words tying a qualifier to the name, as in "Politecnico di Milano"
+LINKS = {"di", "del", "della", "de"}
+
+
+def place_key(text):
+    """Normalise a place typed by a user, so that the different ways of writing
+    the same one share a key: "Piazza  Duomo, Milano" -> "piazza duomo".
+
+    Only the trailing qualifiers are dropped, and only as long as two words
+    remain, as they can be part of the name: "Corso Italia", "Via Milano"
+    and "Duomo di Milano" are kept whole, "Corso Italia Milano" is "corso
+    italia". A qualifier after a comma is always dropped: "Duomo, Milano"
+    is "duomo".
+    """
+    text = unidecode.unidecode(text).lower()
+    parts = [WORDS.findall(part) for part in text.split(",")]
+    parts = [words for words in parts if words]
+    while len(parts) > 1 and all(word in QUALIFIERS for word in parts[-1]):
+        parts.pop()
+    words = [word for part in parts for word in part]
+    while len(words) > 2 and words[-1] in QUALIFIERS and words[-2] not in LINKS:
+        words.pop()
+    return " ".join(words)
+
+
+def load_gazetteer(path=GAZETTEER):
+    """Read a {place_key: (lat, lon)} dictionary out of a json file listing
+    places as {"name": ..., "aliases": [...], "lat": ..., "lon": ...}"""
+    with open(path) as f:
+        places = json.load(f)
+    gazetteer = {}
+    for place in places:
+        for name in [place["name"]] + place.get("aliases", []):
+            gazetteer[place_key(name)] = (place["lat"], place["lon"])
+    return gazetteer
+
+
+class LazyGeocoder:
+    """The geopy geocoder called "name", e.g. "MapBox", only imported and
+    built for the first place nothing else knows: importing geopy takes
+    longer than answering most queries from the caches"""
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self._geocoder = None
+
+    def geocode(self, query, **options):
+        if self._geocoder is None:
+            from geopy import geocoders
+
+            self._geocoder = getattr(geocoders, self.name)(*self.args, **self.kwargs)
+        return self._geocoder.geocode(query, **options)
+
+
+class GeocodeCache:
+    """Memoise a geopy geocoder, returning (lat, lon) tuples or None.
+
+    Queries are keyed by place_key(), so they're answered, in order, by:
+    the "gazetteer" dictionary, the "size" most recently used results kept
+    in memory, the results persisted in the sqlite database at "path", and
+    only then by the "geocoder", called with the extra "options"; concurrent
+    misses for the same key share one call. Places not found are only
+    remembered in memory, they may just be typos.
+    """
+
+    def __init__(self, geocoder, size=1024, path=None, gazetteer=None, **options):
+        self.geocoder = geocoder
+        self.size = size
+        self.gazetteer = gazetteer or {}
+        self.options = options
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS places "
+                "(key TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL)"
+            )
+            self._db.commit()
+        # Counters
+        self.gazetteer_hits = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def geocode(self, query):
+        key = place_key(query)
+        if key in self.gazetteer:
+            self._count("gazetteer_hits")
+            return self.gazetteer[key]
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT lat, lon FROM places WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._remember(key, row)
+                    return row
+
+        # Don't hold the lock while waiting for the network
+        return self._flights.do(key, self._lookup, key, query)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def entries(self):
+        """Return the results in memory, as [key, result] pairs from the least
+        to the most recently used, see preload()"""
+        with self._lock:
+            return [[key, result] for key, result in self._memory.items()]
+
+    def preload(self, entries):
+        """Fill the memory with the entries() of another cache"""
+        with self._lock:
+            for key, result in entries:
+                self._remember(key, None if result is None else tuple(result))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return {
+            "gazetteer_hits": self.gazetteer_hits,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._memory),
+        }
+
+    def _lookup(self, key, query):
+        self._count("misses")
+        location = self.geocoder.geocode(query, **self.options)
+        result = None if location is None else (location.latitude, location.longitude)
+        with self._lock:
+            self._remember(key, result)
+            if result is not None and self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO places VALUES (?, ?, ?)", (key,) + result
+                )
+                self._db.commit()
+        return result
+
+    def _remember(self, key, result):
+        """Add a result to the memory cache, evicting the least recently used"""
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
@@ -0,0 +1,65 @@
+from bikemi_data_analyser.api.search import normalise
+
+import itertools
+import threading
+
+from collections import OrderedDict
+
+
+class SearchResults:
+    """Cache of the search results browsed a page at a time.
+
+    Each query gets a short token, small enough to fit in the callback data
+    of the page buttons along with the page number. The station_ids found
+    are cached by token and snapshot version, so turning pages doesn't
+    search again until the snapshot changes. Only the "size" most recently
+    used queries are kept: older tokens expire.
+    """
+
+    def __init__(self, size=256, limit=50):
+        self.size = size
+        self.limit = limit
+        # token -> query, and normalised query -> token
+        self._queries = OrderedDict()
+        self._tokens = {}
+        # (token, snapshot version) -> station_ids
+        self._results = OrderedDict()
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def search(self, snapshot, query):
+        """Return the token of the query and the stations it matches in the snapshot"""
+        key = normalise(query)
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is None:
+                token = format(next(self._counter), "x")
+                self._tokens[key] = token
+            self._queries[token] = query
+            self._queries.move_to_end(token)
+            while len(self._queries) > self.size:
+                _, old = self._queries.popitem(last=False)
+                self._tokens.pop(normalise(old), None)
+        return token, self.get(snapshot, token)
+
+    def get(self, snapshot, token):
+        """Return the stations matched by the query of a token in the snapshot,
+        or None if the token expired"""
+        with self._lock:
+            query = self._queries.get(token)
+            if query is None:
+                return None
+            station_ids = self._results.get((token, snapshot.version))
+            if station_ids is not None:
+                self._results.move_to_end((token, snapshot.version))
+
+        if station_ids is None:
+            station_ids = [
+                station.station_id
+                for station in snapshot.search.search(query, k=self.limit)
+            ]
+            with self._lock:
+                self._results[(token, snapshot.version)] = station_ids
+                while len(self._results) > self.size:
+                    self._results.popitem(last=False)
+        return [snapshot.by_id[station_id] for station_id in station_ids]
@@ -7,8 +7,37 @@ from telegram import (
     InlineKeyboardMarkup,
 )
 
+# Command -> (field, keyboard button) of the "nearest station with" flows
+NEAREST_WITH = {
+    "nearest_bike": ("bike", ":bike: Nearest Bike"),
+    "nearest_ebike": ("ebike", ":zap: Nearest E-Bike"),
+    "nearest_childseat": ("ebike_with_childseat", None),
+    "nearest_dock": ("availableDocks", ":parking: Nearest Free Dock"),
+}
+# How the counts read in a sentence: article, singular and plural
+AVAILABILITY_NAMES = {
+    "bike": ("a", "bike", "bikes"),
+    "ebike": ("an", "electric bike", "electric bikes"),
+    "ebike_with_childseat": (
+        "an",
+        "electric bike with child seat",
+        "electric bikes with child seat",
+    ),
+    "availableDocks": ("a", "free dock", "free docks"),
+}
+
 
 class Tools:
+    def __init__(self):
+        # The menus never change: build them once
+        self._custom_keyboard = self.build_custom_keyboard()
+        self._main_menu_button = InlineKeyboardButton(
+            text=encode(":gear: Main Menu"),
+            callback_data="main_menu_callback",
+        )
+        self._open_in_maps = encode(":round_pushpin: Open in Maps")
+        self._menu_text = encode(":arrow_down: Choose a function from the menu below")
+
     def build_menu(self, buttons, n_cols, header_buttons=None, footer_buttons=None):
         """Function to build the Inline Keyboard Button menu"""
         menu = [buttons[i : i + n_cols] for i in range(0, len(buttons), n_cols)]
@@ -27,20 +56,33 @@ class Tools:
         if query.data == "main_menu_callback":
             context.bot.send_message(
                 chat_id=update.effective_chat.id,
-                text=encode(":arrow_down: Choose a function from the menu below"),
+                text=self._menu_text,
                 reply_markup=reply_markup,
             )
 
     def custom_keyboard(self):
+        """Keyboard Button menu"""
+        return self._custom_keyboard
+
+    def build_custom_keyboard(self):
         """Function to setup the Keyboard Button menu"""
         search_keyboard = KeyboardButton(text=encode(":mag_right: Search Station"))
         nearest_keyboard = KeyboardButton(text=encode(":walking: Nearest Station"))
+        nearest_with_keyboard = [
+            KeyboardButton(text=encode(button))
+            for _, button in NEAREST_WITH.values()
+            if button is not None
+        ]
         location_keyboard = KeyboardButton(
             text=encode(":round_pushpin: Send current location"),
             request_location=True,
         )
 
-        custom_keyboard = [[search_keyboard] + [nearest_keyboard], [location_keyboard]]
+        custom_keyboard = [
+            [search_keyboard] + [nearest_keyboard],
+            nearest_with_keyboard,
+            [location_keyboard],
+        ]
         return ReplyKeyboardMarkup(
             custom_keyboard,
             resize_keyboard=True,
@@ -50,7 +92,6 @@ class Tools:
 
     def inline_keyboard_buttons(self, station_raw):
         """Display Inline Keyboard Buttons for the Map coordinates and to go back to Main Menu"""
-        button_list = []
         # Add the GMaps location button to the button list
         location_link = (
             "https://www.google.com/maps/search/?api=1&query="
@@ -58,17 +99,62 @@ class Tools:
             + ","
             + str(station_raw["lon"])
         )
-        text = encode(":round_pushpin: Open in Maps")
-        button_list.append(InlineKeyboardButton(text=text, url=location_link))
-        # Add the main menu button to the button list
-        reply_markup = self.custom_keyboard()
-        button_list.append(
-            InlineKeyboardButton(
-                text=encode(":gear: Main Menu"),
-                callback_data="main_menu_callback",
-            )
-        )
+        button_list = [
+            InlineKeyboardButton(text=self._open_in_maps, url=location_link),
+            self._main_menu_button,
+        ]
         reply_markup = InlineKeyboardMarkup(
             self.build_menu(button_list, n_cols=1)
         )  # n_cols = 1 is for single column and mutliple rows
         return reply_markup
+
+    def search_page_buttons(self, stations, token, page, pages, first=1):
+        """Inline Keyboard Buttons to open each of the stations in a page of
+        search results, and to go to the previous and next pages"""
+        button_list = [
+            InlineKeyboardButton(
+                text="{}. {}".format(number, station["title"]),
+                callback_data="station:{}".format(station["station_id"]),
+            )
+            for number, station in enumerate(stations, first)
+        ]
+        footer_buttons = []
+        if page > 0:
+            footer_buttons.append(
+                InlineKeyboardButton(
+                    text=encode(":arrow_left: Previous"),
+                    callback_data="search:{}:{}".format(token, page - 1),
+                )
+            )
+        if page < pages - 1:
+            footer_buttons.append(
+                InlineKeyboardButton(
+                    text=encode("Next :arrow_right:"),
+                    callback_data="search:{}:{}".format(token, page + 1),
+                )
+            )
+        return InlineKeyboardMarkup(
+            self.build_menu(button_list, n_cols=1, footer_buttons=footer_buttons)
+        )
+
+    def describe_availability(self, available):
+        """Describe {field: minimum} counts, e.g. "at least 2 electric bikes" """
+        parts = []
+        for field, minimum in available.items():
+            article, singular, plural = AVAILABILITY_NAMES[field]
+            if minimum == 1:
+                parts.append("{} {}".format(article, singular))
+            else:
+                parts.append("at least {} {}".format(minimum, plural))
+        return " and ".join(parts)
+
+    def watch_buttons(self, station_raw):
+        """Inline Keyboard Buttons to pick what to be notified of at a station"""
+        button_list = [
+            InlineKeyboardButton(
+                text=self.describe_availability({field: 1}).capitalize(),
+                callback_data="watch:{}:{}".format(station_raw["station_id"], field),
+            )
+            for field in AVAILABILITY_NAMES
+        ]
+        return InlineKeyboardMarkup(self.build_menu(button_list, n_cols=2))
@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Watch:
+    """A chat waiting for a station to have at least "minimum" of a field"""
+
+    __slots__ = ("chat_id", "station_id", "field", "minimum")
+
+    def __init__(self, chat_id, station_id, field, minimum=1):
+        self.chat_id = chat_id
+        self.station_id = station_id
+        self.field = field
+        self.minimum = minimum
+
+    def crossed(self, old, new):
+        """True when a change of the field from "old" to "new" reaches the minimum"""
+        return (old or 0) < self.minimum <= (new or 0)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if not isinstance(other, Watch):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "Watch({chat_id!r}, {station_id!r}, {field!r}, {minimum!r})".format(
+            **self.to_dict()
+        )
+
+
+class WatchList:
+    """The watches of every chat, indexed by station_id so that a delta only
+    looks at the stations that changed.
+
+    Watches fire once: triggered() removes them. With a "path", they're
+    saved to that json file at every change and loaded back on start.
+    """
+
+    def __init__(self, path=None, per_chat=10):
+        self.path = path
+        self.per_chat = per_chat
+        # station_id -> watches
+        self._stations = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for watch in json.load(f):
+                    self._insert(Watch(**watch))
+
+    def add(self, watch):
+        """Add a watch, replacing the chat's one on the same station and field.
+        Return False if the chat has too many already"""
+        with self._lock:
+            self._discard(watch.chat_id, watch.station_id, watch.field)
+            if len(self._for_chat(watch.chat_id)) >= self.per_chat:
+                return False
+            self._insert(watch)
+            self._save()
+        return True
+
+    def remove(self, chat_id, station_id=None):
+        """Remove the watches of a chat, on a station or all of them; return
+        how many were removed"""
+        with self._lock:
+            removed = 0
+            station_ids = (
+                [station_id] if station_id is not None else list(self._stations)
+            )
+            for station_id in station_ids:
+                watches = self._stations.get(station_id, [])
+                kept = [watch for watch in watches if watch.chat_id != chat_id]
+                removed += len(watches) - len(kept)
+                self._replace(station_id, kept)
+            if removed:
+                self._save()
+        return removed
+
+    def for_chat(self, chat_id):
+        with self._lock:
+            return self._for_chat(chat_id)
+
+    def __len__(self):
+        return sum(len(watches) for watches in self._stations.values())
+
+    def triggered(self, delta):
+        """Remove and return the watches the StationDelta fulfils, along with
+        the new count; the watches of removed stations are dropped"""
+        fired = []
+        with self._lock:
+            changed = False
+            for station_id, fields in delta.changed.items():
+                watches = self._stations.get(station_id)
+                if not watches:
+                    continue
+                kept = []
+                for watch in watches:
+                    change = fields.get(watch.field)
+                    if change is not None and watch.crossed(*change):
+                        fired.append((watch, change[1]))
+                    else:
+                        kept.append(watch)
+                if len(kept) < len(watches):
+                    self._replace(station_id, kept)
+                    changed = True
+            for station_id in delta.removed:
+                if self._stations.pop(station_id, None):
+                    changed = True
+            if changed:
+                self._save()
+        return fired
+
+    def _insert(self, watch):
+        self._stations.setdefault(watch.station_id, []).append(watch)
+
+    def _replace(self, station_id, watches):
+        if watches:
+            self._stations[station_id] = watches
+        else:
+            self._stations.pop(station_id, None)
+
+    def _discard(self, chat_id, station_id, field):
+        self._replace(
+            station_id,
+            [
+                watch
+                for watch in self._stations.get(station_id, [])
+                if watch.chat_id != chat_id or watch.field != field
+            ],
+        )
+
+    def _for_chat(self, chat_id):
+        return [
+            watch
+            for watches in self._stations.values()
+            for watch in watches
+            if watch.chat_id == chat_id
+        ]
+
+    def _save(self):
+        if self.path is None:
+            return
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump([w.to_dict() for ws in self._stations.values() for w in ws], f)
+        os.replace(temporary, self.path)
+
+
+class Outbox:
+    """Queue of messages sent by a background thread within Telegram's limits.
+
+    Lines queued for the same chat are joined in a single message, and
+    messages go out at most "rate" per second overall and one every
+    "chat_interval" seconds per chat.
+    """
+
+    def __init__(self, send, rate=25, chat_interval=1.0):
+        self.send = send
+        self.rate = rate
+        self.chat_interval = chat_interval
+        # chat_id -> lines waiting, in the order the chats were queued
+        self._pending = OrderedDict()
+        # chat_id -> monotonic time of the last message sent to it
+        self._last_sent = {}
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        # Counters
+        self.sent = 0
+        self.batched = 0
+        self.errors = 0
+
+    def put(self, chat_id, line):
+        with self._condition:
+            lines = self._pending.get(chat_id)
+            if lines is None:
+                self._pending[chat_id] = [line]
+            else:
+                lines.append(line)
+                self.batched += 1
+            self._condition.notify()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._send_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sender thread, once it sent what's queued"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "batched": self.batched,
+            "errors": self.errors,
+            "pending": len(self._pending),
+        }
+
+    def _next(self):
+        """Wait for a chat that can be sent to, and pop its lines"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for chat_id in self._pending:
+                    ready = self._last_sent.get(chat_id, 0) + self.chat_interval
+                    if ready <= now:
+                        self._last_sent[chat_id] = now
+                        return chat_id, self._pending.pop(chat_id)
+                    wait = ready - now if wait is None else min(wait, ready - now)
+                if self._stopping and not self._pending:
+                    return None
+                self._condition.wait(wait)
+
+    def _send_loop(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            chat_id, lines = item
+            try:
+                self.send(chat_id=chat_id, text="\n".join(lines))
+                self.sent += 1
+            except Exception:
+                self.errors += 1
+                logger.exception("Couldn't send a message to chat %s", chat_id)
+            # Spread the messages to stay within the global rate
+            time.sleep(1 / self.rate)
+            if len(self._last_sent) > 4096:
+                self._forget()
+
+    def _forget(self):
+        """Drop the chats that can be sent to again anyway"""
+        with self._condition:
+            expired = time.monotonic() - self.chat_interval
+            self._last_sent = {
+                chat_id: sent
+                for chat_id, sent in self._last_sent.items()
+                if sent > expired
+            }
@@ -0,0 +1,167 @@
+import logging
+import threading
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# What ChatPool.submit() did with a task
+QUEUED = "queued"
+DUPLICATE = "duplicate"
+FULL = "full"
+
+
+class ChatPool:
+    """Bounded pool of "workers" threads running the handlers off the dispatcher.
+
+    Each chat has its own queue of at most "per_chat" tasks, run one at a
+    time and in order; the workers take turns among the chats with pending
+    tasks, so a chat sending many messages only gets its fair share of them.
+    A task with the same "key" as one of the chat's queued or running tasks
+    is dropped, the answer to the first one will do for both.
+    """
+
+    def __init__(self, workers=8, per_chat=4):
+        self.workers = workers
+        self.per_chat = per_chat
+        # chat_id -> deque of (key, function, args)
+        self._queues = {}
+        # chat_id -> key of the task being run
+        self._running = {}
+        # Chats with pending tasks and none running, in the order they'll be served
+        self._ready = deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        # Counters
+        self.done = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    def submit(self, chat_id, function, *args, key=None):
+        """Queue function(*args) for "chat_id": return QUEUED, or DUPLICATE or
+        FULL when the task was dropped"""
+        with self._condition:
+            queue = self._queues.get(chat_id)
+            if key is not None and (
+                self._running.get(chat_id) == key
+                or (queue and any(task[0] == key for task in queue))
+            ):
+                self.duplicates += 1
+                return DUPLICATE
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+            elif len(queue) >= self.per_chat:
+                self.rejected += 1
+                return FULL
+            queue.append((key, function, args))
+            if chat_id not in self._running and len(queue) == 1:
+                self._ready.append(chat_id)
+                self._condition.notify()
+        return QUEUED
+
+    def pending(self):
+        """Number of tasks queued or running"""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values()) + len(
+                self._running
+            )
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+    def start(self):
+        """Start the worker threads"""
+        if self.running:
+            return
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name="ChatPool-{}".format(i), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the worker threads once they're done with the queued tasks"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self):
+        return {
+            "done": self.done,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "pending": self.pending(),
+        }
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._stopping:
+                    self._condition.wait()
+                if not self._ready:
+                    return
+                chat_id = self._ready.popleft()
+                key, function, args = self._queues[chat_id].popleft()
+                self._running[chat_id] = key
+
+            try:
+                function(*args)
+            except Exception:
+                logger.exception("Handler failed for chat %s", chat_id)
+
+            with self._condition:
+                del self._running[chat_id]
+                self.done += 1
+                if self._queues[chat_id]:
+                    # Back of the line, behind the other chats
+                    self._ready.append(chat_id)
+                    self._condition.notify()
+                else:
+                    del self._queues[chat_id]
+
+
+class SingleFlight:
+    """Share the result of a call among the callers asking for the same key
+    while it's in flight"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = function(*args)
+            except Exception as error:
+                call.error = error
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,126 @@
+import pytest
+
+pytest.importorskip("telegram")
+
+from bikemi_data_analyser.api.snapshot import SnapshotStore  # noqa: E402
+from bikemi_data_analyser.api.station import Station  # noqa: E402
+from bikemi_data_analyser.telegram_bot import cards  # noqa: E402
+from bikemi_data_analyser.telegram_bot.bot import TelegramBot  # noqa: E402
+from bikemi_data_analyser.telegram_bot.results import SearchResults  # noqa: E402
+from benchmarks.fakes import (  # noqa: E402
+    FakeCallbackQuery,
+    FakeContext,
+    FakeMessage,
+    FakeUpdate,
+)
+
+
+@pytest.fixture
+def bot():
+    stations = [
+        Station(
+            station_id=str(number),
+            title="{}. Via Numero {}".format(number, number),
+            lat=45.46 + number / 10000,
+            lon=9.19,
+            bike=1,
+            ebike=0,
+            availableDocks=10,
+        )
+        for number in range(1, 13)
+    ]
+    bot = TelegramBot()
+    bot.snapshots = SnapshotStore(lambda: stations, ttl=3600)
+    bot.results = SearchResults(limit=bot.SEARCH_RESULTS)
+    bot.cards = cards.StationCards(bot.tools)
+    return bot
+
+
+def search(bot, place):
+    calls = []
+    update = FakeUpdate(1, FakeMessage(calls=calls))
+    bot.search_station(update, FakeContext(calls=calls), place)
+    return calls
+
+
+def turn_page(bot, data):
+    calls = []
+    update = FakeUpdate(1, callback_query=FakeCallbackQuery(data, calls))
+    bot.search_page_callback(update, FakeContext(calls=calls))
+    return calls
+
+
+def buttons(call):
+    return [
+        button.callback_data
+        for row in call[2]["reply_markup"].inline_keyboard
+        for button in row
+    ]
+
+
+def test_a_search_sends_one_message_whatever_is_found(bot):
+    calls = search(bot, "via numero")
+    assert [name for name, _, _ in calls] == ["send_chat_action", "reply_text"]
+    assert "Found 12 stations, page 1 of 3" in calls[1][1][0]
+    data = buttons(calls[1])
+    assert data[: bot.PAGE_SIZE] == ["station:{}".format(i) for i in range(1, 6)]
+    assert data[bot.PAGE_SIZE :] == ["search:1:1"]
+
+
+def test_a_search_finding_nothing_sends_one_message(bot):
+    calls = search(bot, "zzzzzz")
+    assert [name for name, _, _ in calls] == ["send_chat_action", "reply_text"]
+    assert "doesn't exist" in calls[1][1][0]
+
+
+def test_turning_a_page_edits_the_message(bot):
+    search(bot, "via numero")
+    for page, first, footer in (
+        (1, 6, ["search:1:0", "search:1:2"]),
+        (2, 11, ["search:1:1"]),
+    ):
+        calls = turn_page(bot, "search:1:{}".format(page))
+        assert [name for name, _, _ in calls] == ["answer", "edit_message_text"]
+        assert "page {} of 3".format(page + 1) in calls[1][1][0]
+        data = buttons(calls[1])
+        assert data[0] == "station:{}".format(first)
+        assert data[-len(footer) :] == footer
+
+
+def test_turning_a_page_does_not_search_again(bot, monkeypatch):
+    search(bot, "via numero")
+    snapshot = bot.snapshots.get()
+    monkeypatch.setattr(snapshot.search, "search", pytest.fail, raising=False)
+    assert len(turn_page(bot, "search:1:1")) == 2
+
+
+def test_result_lines_are_rendered_once_per_snapshot(bot, monkeypatch):
+    search(bot, "via numero")
+    monkeypatch.setattr(cards, "result_text", pytest.fail)
+    calls = turn_page(bot, "search:1:1")
+    assert "\n6. 6. Via Numero 6\n" in calls[1][1][0]
+
+
+def test_an_expired_search_is_only_answered(bot):
+    calls = turn_page(bot, "search:ff:1")
+    assert [name for name, _, _ in calls] == ["answer"]
+    assert "expired" in calls[0][1][0]
+
+
+def nearest(bot, available=None):
+    calls = []
+    bot.reply_nearest(FakeUpdate(1, FakeMessage(calls=calls)), 45.46, 9.19, available)
+    return calls
+
+
+def test_nearest_with_a_filter_nothing_matches(bot):
+    calls = nearest(bot, {"ebike": 1})
+    assert [name for name, _, _ in calls] == ["reply_text"]
+    assert "No station has an electric bike right now" in calls[0][1][0]
+
+
+def test_nearest_without_stations(bot):
+    bot.snapshots = SnapshotStore(lambda: [], ttl=3600)
+    calls = nearest(bot)
+    assert [name for name, _, _ in calls] == ["reply_text"]
+    assert "There are no stations right now" in calls[0][1][0]
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from bikemi_data_analyser.api.snapshot import Snapshot, SnapshotStore  # noqa: E402
+from bikemi_data_analyser.api.station import Station  # noqa: E402
+from bikemi_data_analyser.telegram_bot.bot import TelegramBot  # noqa: E402
+from bikemi_data_analyser.telegram_bot.watch import WatchList  # noqa: E402
+from benchmarks.fakes import FakeCallbackQuery, FakeContext, FakeUpdate  # noqa: E402
+
+
+def down():
+    raise ConnectionError("upstream is down")
+
+
+def bot_with(age):
+    """A bot whose snapshot was fetched "age" seconds ago, upstream being down"""
+    station = Station(
+        station_id="1",
+        title="Duomo",
+        lat=45.46,
+        lon=9.19,
+        bike=2,
+        ebike=0,
+        availableDocks=10,
+    )
+    bot = TelegramBot()
+    bot.snapshots = SnapshotStore(down, ttl=60)
+    bot.snapshots.seed(Snapshot(1, [station], time.monotonic() - age))
+    bot.watches = WatchList()
+    return bot
+
+
+def watch(bot, data):
+    calls = []
+    update = FakeUpdate(1, callback_query=FakeCallbackQuery(data, calls))
+    bot.watch_callback(update, FakeContext(calls=calls))
+    return calls[-1][1][0]
+
+
+def test_recent_counts_answer_a_watch():
+    bot = bot_with(30)
+    assert "already has a bike right now" in watch(bot, "watch:1:bike")
+    assert len(bot.watches) == 0
+
+
+def test_old_counts_are_not_taken_for_the_current_ones():
+    bot = bot_with(600)
+    text = watch(bot, "watch:1:bike")
+    assert "I'll tell you when Duomo has a bike" in text
+    assert "10 minutes old" in text
+    assert len(bot.watches) == 1
+
+
+def test_old_counts_are_not_forecast_from():
+    class Forecaster:
+        def predict(self, station_id, minutes):
+            return {"bike": 1, "ebike": 0, "availableDocks": 9}
+
+        def horizon(self, minutes):
+            return 15
+
+    bot = bot_with(30)
+    bot.forecaster = Forecaster()
+    station = bot.snapshots.peek().by_id["1"]
+    assert "In 15 min" in bot.forecast_line(station)
+    bot = bot_with(600)
+    bot.forecaster = Forecaster()
+    assert bot.forecast_line(station) == ""
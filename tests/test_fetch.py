@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from bikemi_data_analyser.api.fetch import Fetcher
+
+
+class Upstream:
+    """Stub server: /slow answers after DELAY seconds, /etag honours
+    If-None-Match, /flaky fails with a 503 "failures" times and /hang never
+    answers in time"""
+
+    DELAY = 0.3
+
+    def __init__(self):
+        self.requests = []
+        self.failures = 1
+        self.running = 0
+        self.overlap = 0
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream.requests.append((self.path, dict(self.headers), time.time()))
+                handler = getattr(upstream, self.path.strip("/"))
+                handler(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def slow(self, handler):
+        with self._lock:
+            self.running += 1
+            self.overlap = max(self.overlap, self.running)
+        time.sleep(self.DELAY)
+        with self._lock:
+            self.running -= 1
+        reply(handler, 200, {"path": "slow"})
+
+    def etag(self, handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            reply(handler, 304, None, {"ETag": '"v1"'})
+        else:
+            reply(handler, 200, {"version": 1}, {"ETag": '"v1"'})
+
+    def flaky(self, handler):
+        if self.failures:
+            self.failures -= 1
+            reply(handler, 503, {"error": "unavailable"})
+        else:
+            reply(handler, 200, {"path": "flaky"})
+
+    def hang(self, handler):
+        time.sleep(2)
+        try:
+            reply(handler, 200, {"path": "hang"})
+        except ConnectionError:
+            # The client gave up long ago
+            pass
+
+
+def reply(handler, status, body, headers=None):
+    content = b"" if body is None else json.dumps(body).encode()
+    handler.send_response(status)
+    for key, value in (headers or {}).items():
+        handler.send_header(key, value)
+    handler.send_header("Content-Length", str(len(content)))
+    handler.end_headers()
+    handler.wfile.write(content)
+
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = Fetcher(timeout=5, backoff=0.1)
+    yield fetcher
+    fetcher.close()
+
+
+def parse(response):
+    return response.json()
+
+
+def test_fetches_overlap(upstream, fetcher):
+    start = time.perf_counter()
+    results = fetcher.get_many(
+        [(upstream.url + "/slow", parse, None), (upstream.url + "/slow", parse, None)]
+    )
+    elapsed = time.perf_counter() - start
+    assert [result.value for result in results] == [{"path": "slow"}] * 2
+    assert upstream.overlap == 2
+    assert elapsed < 2 * Upstream.DELAY
+
+
+def test_not_modified_skips_parsing(upstream, fetcher):
+    parsed = []
+
+    def counting(response):
+        parsed.append(response.status_code)
+        return response.json()
+
+    first = fetcher.get(upstream.url + "/etag", counting)
+    second = fetcher.get(upstream.url + "/etag", counting)
+    assert first.changed and first.value == {"version": 1}
+    assert "If-None-Match" not in upstream.requests[0][1]
+    assert upstream.requests[1][1]["If-None-Match"] == '"v1"'
+    assert not second.changed
+    assert second.value is first.value
+    assert parsed == [200]
+
+
+def test_server_errors_are_retried_with_backoff(upstream, fetcher):
+    upstream.failures = 2
+    result = fetcher.get(upstream.url + "/flaky", parse)
+    assert result.value == {"path": "flaky"}
+    times = [when for path, _, when in upstream.requests]
+    assert len(times) == 3
+    # 0.1s, then 0.2s
+    assert times[1] - times[0] >= 0.1
+    assert times[2] - times[1] >= 0.2
+
+
+def test_retries_give_up(upstream, fetcher):
+    upstream.failures = 3
+    with pytest.raises(requests.HTTPError):
+        fetcher.get(upstream.url + "/flaky", parse)
+    assert len(upstream.requests) == fetcher.retries + 1
+
+
+def test_timeouts_are_respected(upstream):
+    fetcher = Fetcher(timeout=5, retries=0)
+    start = time.perf_counter()
+    with pytest.raises(requests.Timeout):
+        fetcher.get(upstream.url + "/hang", parse, timeout=0.2)
+    assert time.perf_counter() - start < 1
+    fetcher.close()
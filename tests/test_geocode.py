@@ -0,0 +1,176 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bikemi_data_analyser.telegram_bot.geocode import GeocodeCache, place_key
+
+
+class FakeLocation:
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class FakeGeocoder:
+    """Finds every place but "nowhere", at a point of its own"""
+
+    def __init__(self):
+        self.queries = []
+
+    def geocode(self, query, **options):
+        self.queries.append(query)
+        if "nowhere" in query.lower():
+            return None
+        return FakeLocation(45 + len(self.queries) / 1000, 9.0)
+
+
+@pytest.mark.parametrize(
+    "text, key",
+    [
+        ("Piazza  Duomo, Milano", "piazza duomo"),
+        ("piazza duomo milano italia", "piazza duomo"),
+        ("Duomo, MI", "duomo"),
+        ("Corso Italia", "corso italia"),
+        ("Piazza Italia", "piazza italia"),
+        ("Via Milano", "via milano"),
+        ("Corso Italia Milano", "corso italia"),
+        ("Via Milano, Milano", "via milano"),
+        ("Politecnico di Milano", "politecnico di milano"),
+        ("Milano Centrale", "milano centrale"),
+        ("Milano", "milano"),
+        ("Città Studi", "citta studi"),
+    ],
+)
+def test_place_key(text, key):
+    assert place_key(text) == key
+
+
+def test_queries_written_differently_share_a_result():
+    geocoder = FakeGeocoder()
+    cache = GeocodeCache(geocoder)
+    first = cache.geocode("Corso Buenos Aires")
+    assert cache.geocode("corso buenos aires, Milano") == first
+    assert cache.geocode("CORSO  BUENOS AIRES") == first
+    assert geocoder.queries == ["Corso Buenos Aires"]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_names_with_qualifiers_are_different_places():
+    geocoder = FakeGeocoder()
+    cache = GeocodeCache(geocoder)
+    assert cache.geocode("Corso Italia") != cache.geocode("Corso")
+    assert cache.geocode("Via Milano") != cache.geocode("Via")
+    assert len(geocoder.queries) == 4
+
+
+def test_gazetteer_is_answered_offline():
+    geocoder = FakeGeocoder()
+    cache = GeocodeCache(geocoder, gazetteer={"duomo": (45.46, 9.19)})
+    assert cache.geocode("Duomo, Milano") == (45.46, 9.19)
+    assert geocoder.queries == []
+    assert cache.stats()["gazetteer_hits"] == 1
+
+
+def test_least_recently_used_are_evicted():
+    geocoder = FakeGeocoder()
+    cache = GeocodeCache(geocoder, size=2)
+    for place in ("Brera", "Navigli", "Brera", "Isola"):
+        cache.geocode(place)
+    # "Navigli" was the least recently used
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+    cache.geocode("Brera")
+    cache.geocode("Navigli")
+    assert geocoder.queries == ["Brera", "Navigli", "Isola", "Navigli"]
+    assert cache.stats() == {
+        "gazetteer_hits": 0,
+        "hits": 2,
+        "disk_hits": 0,
+        "misses": 4,
+        "evictions": 2,
+        "size": 2,
+    }
+
+
+def test_found_places_are_kept_on_disk(tmp_path):
+    path = tmp_path / "geocode.sqlite3"
+    cache = GeocodeCache(FakeGeocoder(), path=str(path))
+    found = cache.geocode("Brera")
+    assert cache.geocode("Nowhere at all") is None
+    cache.close()
+
+    geocoder = FakeGeocoder()
+    cache = GeocodeCache(geocoder, path=str(path))
+    assert cache.geocode("brera, milano") == found
+    assert cache.geocode("Nowhere at all") is None
+    # Places not found aren't persisted, they may be typos
+    assert geocoder.queries == ["Nowhere at all"]
+    assert cache.stats()["disk_hits"] == 1
+    cache.close()
+
+
+def test_importing_the_bot_creates_nothing(tmp_path):
+    pytest.importorskip("telegram")
+    environment = dict(os.environ, HOME=str(tmp_path))
+    for name in ("BIKEMI_GEOCODE_CACHE", "BIKEMI_WATCHES", "BIKEMI_IMAGE"):
+        environment.pop(name, None)
+    subprocess.run(
+        [sys.executable, "-c", "import bikemi_data_analyser.telegram_bot.bot"],
+        check=True,
+        env=environment,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert not list(tmp_path.iterdir())
+
+
+def test_the_bot_biases_places_towards_its_system(tmp_path):
+    pytest.importorskip("telegram")
+    from bikemi_data_analyser.api.snapshot import SnapshotStore
+    from bikemi_data_analyser.api.station import Station
+    from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+
+    stations = [
+        Station(station_id="1", title="Corso Italia", lat=45.0, lon=9.0),
+        Station(station_id="2", title="Via Milano", lat=45.2, lon=9.4),
+    ]
+    bot = TelegramBot()
+    bot.snapshots = SnapshotStore(lambda: stations)
+    bot.snapshots.get()
+    bot.GEOCODE_CACHE = str(tmp_path / "geocode.sqlite3")
+    bot.GAZETTEER = ""
+    bot.open_geocoder([["brera", [45.47, 9.18]]])
+    assert bot.geocoder.options["proximity"] == pytest.approx((45.1, 9.2))
+    assert bot.geocoder.geocode("Brera") == (45.47, 9.18)
+    bot.geocoder.close()
+
+
+def test_the_bot_starts_while_upstream_is_down(tmp_path):
+    pytest.importorskip("telegram")
+    from bikemi_data_analyser.api.snapshot import SnapshotStore
+    from bikemi_data_analyser.api.station import Station
+    from bikemi_data_analyser.telegram_bot.bot import TelegramBot
+
+    stations = []
+
+    def fetch():
+        if not stations:
+            raise ConnectionError("upstream is down")
+        return stations
+
+    bot = TelegramBot()
+    bot.snapshots = SnapshotStore(fetch)
+    bot.IMAGE = str(tmp_path / "warm.img")
+    bot.GEOCODE_CACHE = str(tmp_path / "geocode.sqlite3")
+    bot.GAZETTEER = ""
+    bot.open_geocoder(bot.load_image())
+    assert bot.geocoder.options["proximity"] == bot.PROXIMITY
+
+    # Centred on the stations once they're fetched
+    stations.append(Station(station_id="1", title="Duomo", lat=45.2, lon=9.4))
+    bot.snapshots.get()
+    bot.centre_geocoder()
+    assert bot.geocoder.options["proximity"] == pytest.approx((45.2, 9.4))
+    bot.geocoder.close()
@@ -0,0 +1,57 @@
+import time
+
+from bikemi_data_analyser.api.image import load_image, save_image
+from bikemi_data_analyser.api.snapshot import Snapshot
+from bikemi_data_analyser.api.station import Station
+
+
+def stations():
+    return [
+        Station(
+            station_id=str(i),
+            title="Station {}".format(i),
+            lat=45.46 + i * 0.002,
+            lon=9.18 + i * 0.002,
+            bike=i % 3,
+            ebike=1,
+        )
+        for i in range(20)
+    ]
+
+
+def test_restored_indexes_answer_like_the_saved_ones(tmp_path):
+    snapshot = Snapshot(1, stations(), time.monotonic())
+    path = tmp_path / "warm.img"
+    save_image(path, snapshot, {"geocode": []})
+    restored, extra = load_image(path)
+    assert extra == {"geocode": []}
+    assert list(restored.stations) == list(snapshot.stations)
+    for i in range(0, 20, 3):
+        lat, lon = 45.46 + i * 0.002, 9.18 + i * 0.002
+        expected = snapshot.spatial.nearest(lat, lon, 3)
+        assert restored.spatial.nearest(lat, lon, 3) == expected
+        assert restored.search.search("Station {}".format(i)) == (
+            snapshot.search.search("Station {}".format(i))
+        )
+
+
+def test_reordered_stations_keep_the_grid_order(tmp_path):
+    first = Snapshot(1, stations(), time.monotonic())
+    # Upstream lists the stations the other way around, no station moved
+    reordered = stations()[::-1]
+    reordered[0].bike = 7
+    snapshot = Snapshot(2, reordered, time.monotonic(), first)
+    assert [s.station_id for s in snapshot.stations] != [
+        s.station_id for s in snapshot.spatial.stations
+    ]
+    path = tmp_path / "warm.img"
+    save_image(path, snapshot)
+    restored, _ = load_image(path)
+    for i in range(20):
+        lat, lon = 45.46 + i * 0.002, 9.18 + i * 0.002
+        nearest = restored.spatial.nearest(lat, lon, 2)
+        assert nearest == snapshot.spatial.nearest(lat, lon, 2)
+        assert nearest[0][0].station_id == str(i)
+    assert restored.spatial.nearest(45.46, 9.18, 1, {"bike": 7})[0][0] is (
+        restored.by_id["19"]
+    )
@@ -0,0 +1,77 @@
+import pytest
+
+from bikemi_data_analyser.api.join import INNER, LEFT, OUTER, hash_join
+from bikemi_data_analyser.api.station import Station
+
+
+def sources():
+    """Basic info missing station "3", status missing station "2" """
+    basic = [
+        Station(station_id="1", title="Cadorna", lat=45.468, lon=9.176),
+        Station(station_id="2", title="Duomo", lat=45.464, lon=9.190),
+    ]
+    status = [
+        Station(station_id="3", bike=4, availableDocks=8),
+        Station(station_id="1", bike=2, ebike=1, availableDocks=10),
+    ]
+    return basic, status
+
+
+def test_inner_keeps_the_stations_on_both_sides():
+    basic, status = sources()
+    result = hash_join(basic, status, INNER)
+    assert [station.station_id for station in result.rows] == ["1"]
+    merged = result.rows[0]
+    assert merged.title == "Cadorna"
+    assert (merged.bike, merged.ebike, merged.availableDocks) == (2, 1, 10)
+    assert result.left_only == ["2"]
+    assert result.right_only == ["3"]
+    assert not result.complete
+
+
+def test_left_keeps_the_unmatched_left_stations():
+    basic, status = sources()
+    result = hash_join(basic, status, LEFT)
+    assert [station.station_id for station in result.rows] == ["1", "2"]
+    assert result.rows[1] is basic[1]
+    assert result.rows[1].bike is None
+    assert result.left_only == ["2"]
+    assert result.right_only == ["3"]
+
+
+def test_outer_appends_the_unmatched_right_stations():
+    basic, status = sources()
+    result = hash_join(basic, status, OUTER)
+    assert [station.station_id for station in result.rows] == ["1", "2", "3"]
+    assert result.rows[2] is status[0]
+    assert result.rows[2].title is None
+    assert result.left_only == ["2"]
+    assert result.right_only == ["3"]
+
+
+def test_matching_sources_are_complete():
+    basic, status = sources()
+    result = hash_join(basic[:1], status[1:], OUTER)
+    assert len(result.rows) == 1
+    assert result.left_only == result.right_only == []
+    assert result.complete
+
+
+def test_combine_and_key():
+    left = [{"id": "a", "x": 1}, {"id": "b", "x": 2}]
+    right = [{"id": "b", "y": 3}]
+    result = hash_join(
+        left,
+        right,
+        LEFT,
+        key=lambda row: row["id"],
+        combine=lambda a, b: a | b,
+    )
+    assert result.rows == [{"id": "a", "x": 1}, {"id": "b", "x": 2, "y": 3}]
+    assert result.left_only == ["a"]
+    assert result.right_only == []
+
+
+def test_unknown_join():
+    with pytest.raises(ValueError):
+        hash_join([], [], "cross")
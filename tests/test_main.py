@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+import pytest
+
+from bikemi_data_analyser.__main__ import main
+from bikemi_data_analyser.history.store import FIELDS, HistoryStore
+
+DAY = 86400
+
+
+def record(path, timestamps):
+    store = HistoryStore(str(path), create=True)
+    columns = {field: np.ones((len(timestamps), 2), int) for field in FIELDS}
+    store.extend(timestamps, ["1", "2"], columns)
+    store.close()
+
+
+def test_compact_thins_out_the_old_samples(tmp_path, capsys):
+    now = int(time.time()) // 3600 * 3600
+    # An hour of one-minute samples two days ago, and another one today
+    old = [now - 2 * DAY + 60 * i for i in range(60)]
+    recent = [now - 3600 + 60 * i for i in range(60)]
+    record(tmp_path, old + recent)
+
+    main(["compact", str(tmp_path), "--older-than", "1", "--interval", "900"])
+    times = HistoryStore(str(tmp_path)).times().tolist()
+    assert times == old[::15] + recent
+    assert "120 frames, 64 after compaction" in capsys.readouterr().out
+
+
+def test_compact_everything(tmp_path):
+    record(tmp_path, [3600 * i + 60 * j for i in range(3) for j in range(10)])
+    main(["compact", str(tmp_path), "--interval", "3600"])
+    assert HistoryStore(str(tmp_path)).times().tolist() == [0, 3600, 7200]
+
+
+def test_missing_stores_are_not_created(tmp_path):
+    path = tmp_path / "typo"
+    with pytest.raises(FileNotFoundError):
+        HistoryStore(str(path))
+    for command in (["compact", str(path)], ["analyse", str(path)]):
+        with pytest.raises(SystemExit) as exit:
+            main(command)
+        assert "No history store in" in str(exit.value)
+    assert not path.exists()
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from bikemi_data_analyser.api.metrics import MAX_EVERY, Metrics
+
+
+def counts(metrics):
+    return {
+        line.split("{")[1].split("}")[0]: int(line.rsplit(" ", 1)[1])
+        for line in metrics.render().splitlines()
+        if "_count{" in line
+    }
+
+
+def test_nothing_is_recorded_until_enabled():
+    metrics = Metrics()
+    handler = metrics.timed("idle")(lambda: None)
+    handler()
+    with metrics.span("stage"):
+        pass
+    assert counts(metrics) == {'handler="idle"': 0, 'stage="stage"': 0}
+
+
+def test_slow_runs_are_all_timed():
+    metrics = Metrics()
+    handler = metrics.timed("slow")(lambda: time.sleep(0.02))
+    metrics.enable()
+    for _ in range(5):
+        handler()
+    assert counts(metrics) == {'handler="slow"': 5}
+
+
+def test_fast_runs_are_sampled_and_weighted():
+    metrics = Metrics()
+    handler = metrics.timed("fast")(lambda: None)
+    metrics.enable()
+    runs = 20 * MAX_EVERY
+    for _ in range(runs):
+        handler()
+    for _ in range(runs):
+        with metrics.span("fast"):
+            pass
+    # Each sample counts for the runs skipped since the previous one
+    for count in counts(metrics).values():
+        assert runs - MAX_EVERY <= count <= runs
+    assert metrics.histogram("bikemi_handler_seconds", (("handler", "fast"),)).every > 1
+
+
+def test_errors_are_counted_on_every_run():
+    metrics = Metrics()
+
+    @metrics.timed("broken")
+    def handler():
+        raise RuntimeError
+
+    metrics.enable()
+    for _ in range(3 * MAX_EVERY):
+        with pytest.raises(RuntimeError):
+            handler()
+    assert (
+        'bikemi_handler_errors_total{{handler="broken"}} {}'.format(3 * MAX_EVERY)
+        in metrics.render()
+    )
@@ -0,0 +1,39 @@
+import time
+
+from bikemi_data_analyser.api.snapshot import Snapshot, SnapshotStore
+from bikemi_data_analyser.api.station import Station
+from bikemi_data_analyser.history.recorder import Recorder
+
+STATIONS = [Station(station_id="1", title="Duomo", bike=2)]
+
+
+class FakeStore:
+    def __init__(self):
+        self.frames = []
+
+    def append(self, timestamp, stations):
+        self.frames.append((timestamp, stations))
+
+
+def down():
+    raise ConnectionError("upstream is down")
+
+
+def snapshots(age):
+    """A store with a snapshot fetched "age" seconds ago, upstream being down"""
+    store = SnapshotStore(down)
+    store.seed(Snapshot(1, STATIONS, time.monotonic() - age))
+    return store
+
+
+def test_recent_snapshots_are_recorded():
+    store = FakeStore()
+    assert Recorder(store, snapshots(90), interval=60).record(60) is not None
+    assert store.frames == [(60, (STATIONS[0],))]
+
+
+def test_old_snapshots_are_skipped():
+    store = FakeStore()
+    assert Recorder(store, snapshots(150), interval=60).record(60) is None
+    assert Recorder(store, snapshots(30), max_age=20).record(60) is None
+    assert store.frames == []
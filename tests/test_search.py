@@ -0,0 +1,59 @@
+import pytest
+
+from bikemi_data_analyser.api.search import SearchIndex, swaps
+from bikemi_data_analyser.api.station import Station
+
+TITLES = ("Cadorna 1", "Cadorna 2", "Cordusio", "Corso Italia", "Cairoli", "Duomo")
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SearchIndex(
+        [
+            Station(station_id=str(100 + i), title=title)
+            for i, title in enumerate(TITLES)
+        ]
+    )
+
+
+def titles(stations):
+    return [station.title for station in stations]
+
+
+@pytest.mark.parametrize(
+    "query, found",
+    [
+        ("cadorna", ["Cadorna 1", "Cadorna 2"]),
+        ("Cadorna 2", ["Cadorna 2", "Cadorna 1"]),
+        ("cadorma", ["Cadorna 1", "Cadorna 2"]),
+        ("du", ["Duomo", "Cordusio"]),
+        ("102", ["Cordusio"]),
+    ],
+)
+def test_search(index, query, found):
+    assert titles(index.search(query)) == found
+
+
+@pytest.mark.parametrize(
+    "query, found",
+    [
+        # Each of these swaps breaks 4 trigrams, more than a typo can
+        ("cadrona", ["Cadorna 1", "Cadorna 2"]),
+        ("cdaorna", ["Cadorna 1", "Cadorna 2"]),
+        ("cadonra", ["Cadorna 1", "Cadorna 2"]),
+        ("crodusio", ["Cordusio"]),
+        ("cordusoi", ["Cordusio"]),
+    ],
+)
+def test_swapped_chars(index, query, found):
+    assert titles(index.search(query)) == found
+
+
+def test_a_swap_and_a_typo_are_too_many(index):
+    assert index.search("cdarona") == []
+    assert index.search("zzzzzzz") == []
+
+
+def test_swaps():
+    assert swaps("abc") == {"bac", "acb"}
+    assert swaps("aab") == {"aba"}
@@ -0,0 +1,119 @@
+import asyncio
+import gzip
+import json
+import re
+
+import pytest
+
+from bikemi_data_analyser.api.server import MAX_HEADERS, MAX_LINE, StationServer
+from bikemi_data_analyser.api.snapshot import SnapshotStore
+from bikemi_data_analyser.api.station import Station
+
+GZIP = {"accept-encoding": "gzip, deflate"}
+
+
+@pytest.fixture
+def server():
+    stations = [
+        Station(
+            station_id=str(i),
+            title="Station {}".format(i),
+            lat=45.46 + i / 1000,
+            lon=9.19,
+            bike=i % 5,
+        )
+        for i in range(50)
+    ]
+    return StationServer(SnapshotStore(lambda: stations, ttl=3600))
+
+
+def get(server, target, headers=None):
+    raw = server.respond("GET", target, headers or {})
+    head, _, body = raw.partition(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    fields = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split()[1]), fields, body
+
+
+def test_gzipped_bodies_have_their_own_etag(server):
+    status, plain, body = get(server, "/stations")
+    assert status == 200 and "Content-Encoding" not in plain
+    status, gzipped, compressed = get(server, "/stations", GZIP)
+    assert status == 200 and gzipped["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed) == body
+    assert gzipped["ETag"] == plain["ETag"][:-1] + '-gz"'
+
+
+def test_not_modified_only_for_the_same_representation(server):
+    plain = get(server, "/stations")[1]["ETag"]
+    gzipped = get(server, "/stations", GZIP)[1]["ETag"]
+    assert get(server, "/stations", {"if-none-match": plain})[0] == 304
+    assert get(server, "/stations", dict(GZIP, **{"if-none-match": gzipped}))[0] == 304
+    # A client changing its Accept-Encoding gets the other body in full
+    assert get(server, "/stations", dict(GZIP, **{"if-none-match": plain}))[0] == 200
+    assert get(server, "/stations", {"if-none-match": gzipped})[0] == 200
+
+
+def test_small_bodies_are_not_gzipped(server):
+    status, fields, body = get(server, "/stations/7", GZIP)
+    assert status == 200 and "Content-Encoding" not in fields
+    assert json.loads(body)["title"] == "Station 7"
+    assert fields["ETag"] == get(server, "/stations/7")[1]["ETag"]
+
+
+class FakeWriter:
+    def __init__(self):
+        self.written = b""
+        self.closed = False
+
+    def write(self, data):
+        self.written += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def handle(server, raw, limit=2**16):
+    """Statuses of the responses to the raw bytes sent on a connection"""
+
+    async def run():
+        reader = asyncio.StreamReader(limit=limit)
+        reader.feed_data(raw)
+        reader.feed_eof()
+        writer = FakeWriter()
+        await server.handle(reader, writer)
+        assert writer.closed
+        return writer.written
+
+    written = asyncio.run(run())
+    return [int(status) for status in re.findall(rb"HTTP/1\.1 (\d+)", written)]
+
+
+def test_requests_on_a_connection_are_answered(server):
+    raw = b"GET /stations/1 HTTP/1.1\r\nHost: x\r\n\r\n" * 2
+    assert handle(server, raw) == [200, 200]
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        b"GET /stations\r\n\r\n",
+        "GET /stazioni/cafè HTTP/1.1\r\n\r\n".encode("utf-8"),
+        b"GET /stations/1 HTTP/1.1\r\nHost x\r\n\r\n",
+        b"GET /stations/1 HTTP/1.1\r\n: x\r\n\r\n",
+        b"GET /stations/1 HTTP/1.1\r\nHost : x\r\n\r\n",
+        b"GET /stations/1 HTTP/1.1\r\n" + b"X-A: b\r\n" * (MAX_HEADERS + 1) + b"\r\n",
+        b"GET /stations/1 HTTP/1.1\r\nX-A: " + b"b" * MAX_LINE + b"\r\n\r\n",
+    ],
+)
+def test_malformed_requests_are_rejected(server, raw):
+    # The connection is closed after the 400: the next request isn't answered
+    assert handle(server, raw + b"GET /stations/1 HTTP/1.1\r\n\r\n") == [400]
+
+
+def test_lines_longer_than_the_reader_limit_are_rejected(server):
+    raw = b"GET /stations/1 HTTP/1.1\r\nX-A: " + b"b" * 2048 + b"\r\n\r\n"
+    assert handle(server, raw, limit=1024) == [400]
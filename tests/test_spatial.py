@@ -0,0 +1,76 @@
+import math
+import random
+
+import pytest
+
+from bikemi_data_analyser.api.snapshot import Snapshot
+from bikemi_data_analyser.api.spatial import EARTH_RADIUS, TOLERANCE, SpatialIndex
+from bikemi_data_analyser.api.station import Station
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Reference distance in meters, one pair of points at a time"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+@pytest.fixture(scope="module")
+def stations():
+    generator = random.Random(0)
+    return [
+        Station(
+            station_id=str(i),
+            title="Station {}".format(i),
+            lat=generator.uniform(45.40, 45.53),
+            lon=generator.uniform(9.10, 9.28),
+            bike=generator.randint(0, 3),
+        )
+        for i in range(500)
+    ]
+
+
+def queries(seed=1, n=50):
+    generator = random.Random(seed)
+    # Inside the system, and a few far outside of it
+    points = [
+        (generator.uniform(45.40, 45.53), generator.uniform(9.10, 9.28))
+        for _ in range(n)
+    ]
+    return points + [(45.07, 7.69), (41.90, 12.50)]
+
+
+def test_nearest_matches_a_reference_haversine(stations):
+    index = SpatialIndex(stations)
+    for lat, lon in queries():
+        found = index.nearest(lat, lon, k=5)
+        expected = sorted(
+            haversine(lat, lon, station["lat"], station["lon"]) for station in stations
+        )[:5]
+        assert [distance for _, distance in found] == pytest.approx(expected)
+        for station, distance in found:
+            assert distance == pytest.approx(
+                haversine(lat, lon, station["lat"], station["lon"])
+            )
+
+
+def test_nearest_is_within_the_tolerance_of_geodesic(stations):
+    distance = pytest.importorskip("geopy.distance")
+    index = SpatialIndex(stations)
+    for lat, lon in queries():
+        for station, found in index.nearest(lat, lon, k=3):
+            geodesic = distance.geodesic((lat, lon), (station["lat"], station["lon"]))
+            assert found == pytest.approx(geodesic.meters, rel=TOLERANCE)
+
+
+def test_stations_without_coordinates_are_left_out_of_the_updates(stations):
+    unplaced = Station(station_id="unplaced", title="Somewhere", bike=0)
+    previous = Snapshot(1, stations + [unplaced], 0)
+    changed = Station(station_id="unplaced", title="Somewhere", bike=2)
+    snapshot = Snapshot(2, stations + [changed], 0, previous)
+    assert snapshot.delta.changed == {"unplaced": {"bike": (0, 2)}}
+    assert len(snapshot.spatial) == len(stations)
+    assert snapshot.spatial.nearest(45.46, 9.19, available={"bike": 1})
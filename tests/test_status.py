@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from bikemi_data_analyser.api.fetch import Fetcher
+from bikemi_data_analyser.api.status import GbfsStatus
+
+
+def write(path, data):
+    with open(str(path), "w") as f:
+        json.dump(dict(data, last_updated=0, ttl=0), f)
+
+
+def vehicle_types(propulsion):
+    return {
+        "data": {
+            "vehicle_types": [
+                {"vehicle_type_id": "1", "name": "Bike", "propulsion_type": propulsion}
+            ]
+        }
+    }
+
+
+@pytest.fixture
+def feeds(tmp_path):
+    write(
+        tmp_path / "gbfs.json",
+        {
+            "data": {
+                "en": {
+                    "feeds": [
+                        {
+                            "name": name,
+                            "url": "file://{}/{}.json".format(tmp_path, name),
+                        }
+                        for name in ("station_status", "vehicle_types")
+                    ]
+                }
+            }
+        },
+    )
+    write(
+        tmp_path / "station_status.json",
+        {
+            "data": {
+                "stations": [
+                    {
+                        "station_id": "1",
+                        "num_bikes_available": 3,
+                        "num_docks_available": 7,
+                        "vehicle_types_available": [
+                            {"vehicle_type_id": "1", "count": 3}
+                        ],
+                    }
+                ]
+            }
+        },
+    )
+    write(tmp_path / "vehicle_types.json", vehicle_types("human"))
+    return tmp_path
+
+
+def test_unchanged_feeds_are_reported_unchanged(feeds):
+    status = GbfsStatus("file://{}/gbfs.json".format(feeds))
+    fetcher = Fetcher()
+    first = status.fetch(fetcher)
+    assert first.changed
+    assert first.value[0]["bike"] == 3
+    second = status.fetch(fetcher)
+    assert not second.changed
+    assert second.value is first.value
+
+
+def test_new_vehicle_types_change_the_counts(feeds):
+    status = GbfsStatus("file://{}/gbfs.json".format(feeds))
+    fetcher = Fetcher()
+    status.fetch(fetcher)
+    write(feeds / "vehicle_types.json", vehicle_types("electric_assist"))
+    result = status.fetch(fetcher)
+    assert result.changed
+    assert (result.value[0]["bike"], result.value[0]["ebike"]) == (0, 3)
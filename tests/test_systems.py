@@ -0,0 +1,65 @@
+import pytest
+
+from bikemi_data_analyser.api.systems import SystemRegistry
+from benchmarks import synthetic
+from benchmarks.systems import check_routing, write_fixtures
+
+STATIONS = 100
+
+
+@pytest.fixture(scope="module")
+def config(tmp_path_factory):
+    return write_fixtures(str(tmp_path_factory.mktemp("systems")), 20, STATIONS)
+
+
+def test_twenty_systems_are_refreshed_and_routed(config):
+    registry = SystemRegistry.load(config)
+    assert len(registry) == 20
+    assert registry.refresh_all() == {}
+    check_routing(registry)
+    # Unchanged feeds answer 304: nothing to parse or rebuild
+    assert registry.refresh_all() == {}
+    assert all(system.snapshot().version == 1 for system in registry)
+    registry.stop()
+
+
+def test_systems_are_picked_by_name(config):
+    registry = SystemRegistry.load(config, names=["system3"], ttl=5)
+    assert [system.name for system in registry] == ["system3"]
+    assert registry.get("system3").ttl == 5
+    with pytest.raises(ValueError):
+        SystemRegistry.load(config, names=["system3", "nowhere"])
+
+
+def test_bikemi_alone_by_default():
+    registry = SystemRegistry.load(ttl=30)
+    assert [system.name for system in registry] == ["bikemi"]
+    assert registry.get("bikemi").ttl == 30
+
+
+def test_contains_never_fetches(config):
+    system = SystemRegistry.load(config, names=["system0"]).get("system0")
+    lat, lon = sum(synthetic.LAT_RANGE) / 2, sum(synthetic.LON_RANGE) / 2
+    assert not system.contains(lat, lon)
+    assert system.snapshots.stats()["misses"] == 0
+    system.snapshot()
+    assert system.contains(lat, lon)
+
+
+def test_centre_of_each_system(config):
+    registry = SystemRegistry.load(config, names=["system0", "system6"])
+    registry.refresh_all()
+    for system in registry:
+        lat, lon = system.snapshot().spatial.centre
+        min_lat, min_lon, max_lat, max_lon = system.snapshot().spatial.bounds
+        assert min_lat < lat < max_lat and min_lon < lon < max_lon
+        assert registry.route(lat, lon) == [system]
+
+
+def test_stores_start_and_stop_their_registry(config):
+    registry = SystemRegistry.load(config, names=["system0"])
+    snapshots = registry.get("system0").snapshots
+    snapshots.start()
+    assert registry.running and snapshots.running
+    snapshots.stop()
+    assert not registry.running and not snapshots.running
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("telegram")
+
+from bikemi_data_analyser.telegram_bot.tools import Tools  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "available, text",
+    [
+        ({"bike": 1}, "a bike"),
+        ({"ebike": 1}, "an electric bike"),
+        ({"ebike_with_childseat": 1}, "an electric bike with child seat"),
+        ({"availableDocks": 1}, "a free dock"),
+        ({"ebike": 3}, "at least 3 electric bikes"),
+        ({"bike": 2, "availableDocks": 1}, "at least 2 bikes and a free dock"),
+    ],
+)
+def test_describe_availability(available, text):
+    assert Tools().describe_availability(available) == text
+
+
+def test_watch_buttons():
+    markup = Tools().watch_buttons({"station_id": "101"})
+    buttons = [button for row in markup.inline_keyboard for button in row]
+    assert [button.text for button in buttons] == [
+        "A bike",
+        "An electric bike",
+        "An electric bike with child seat",
+        "A free dock",
+    ]
+    assert buttons[1].callback_data == "watch:101:ebike"